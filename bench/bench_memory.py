@@ -0,0 +1,151 @@
+# memory per topic and per struct field for what a cumulative run keeps around
+# run from the repository root with
+#   python bench/bench_memory.py
+#   python bench/bench_memory.py --bags 20000 --topics 60
+
+# topics: writes a bag scan cache holding --bags bags with --topics topics each (what
+# years of cumulative runs leave behind), then loads it and builds the topic catalogs
+# and dataframes from it the way a run does. reported per bag topic record and per
+# distinct topic
+# fields: builds the synthetic .msg tree from bench/synthetic.py, gives every type in it
+# --struct-copies topics, and unwraps them. structs of the same type share their fields,
+# so they are reported per field of every distinct struct
+# bytes are what tracemalloc sees still allocated once the stage is done (so what the run
+# holds on to), peak is the most allocated at once during the stage. the peak RSS of the
+# whole process is printed at the end, tracemalloc's own bookkeeping included
+
+import argparse
+import contextlib
+import io
+import json
+import os
+import resource
+import shutil
+import sys
+import tempfile
+import tracemalloc
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import generate_bagstructdefs as gen
+from synthetic import CUSTOM_MSGS, SHARE_MSGS, write_msg_tree
+
+NAMESPACES = ('nav', 'sensors', 'sonar', 'power')
+
+
+# takes in a function and returns (its result, bytes still allocated after it, peak bytes during it)
+def measure(fn):
+    tracemalloc.reset_peak()
+    before = tracemalloc.get_traced_memory()[0]
+    result = fn()
+    current, peak = tracemalloc.get_traced_memory()
+    return result, current - before, peak - before
+
+
+# takes in a path and the number of bags and topics per bag and writes a bag scan cache,
+# every namespace having its own topics and every topic showing up in most bags
+def write_scan_cache(cachePath, numBags, numTopics):
+    bags = {}
+    for b in range(numBags):
+        namespace = NAMESPACES[b % len(NAMESPACES)]
+        bagPath = f'/data/jason/{2020 + b // 5000}/cruise{b // 500:03d}/dive{b // 50:04d}/{namespace}_{b:06d}.bag'
+        records = []
+        for t in range(numTopics):
+            # a few topics only show up in some bags
+            if t % 10 == 9 and b % 3:
+                continue
+            records.append([f'/jason/{namespace}/topic{t:03d}', f'ds_sensor_msgs/Type{t % 25}',
+                            f'{t % 25:032x}', 1000 + b % 7, 1])
+        bags[bagPath] = {'size': 1000000 + b, 'mtime': 1700000000.0 + b, 'records': records}
+    with open(cachePath, 'w') as file:
+        json.dump({'version': gen.BagScanCache.VERSION, 'bags': bags}, file)
+
+
+# takes in a loaded BagScanCache and returns (catalogs, dataframes) per namespace, built
+# from every cached bag the way NamespaceTopics builds them from scanned ones
+def build_catalogs(cache):
+    topics = gen.NamespaceTopics.__new__(gen.NamespaceTopics)
+    topics.name = 'jason'
+    catalogs = {}
+    for bagPath, entry in cache.entries.items():
+        namespace = os.path.basename(bagPath).split('_')[0]
+        catalog = catalogs.setdefault(namespace, gen.TopicCatalog())
+        topics.add_records(catalog, bagPath, entry['records'])
+    return catalogs, {namespace: catalog.to_df() for namespace, catalog in catalogs.items()}
+
+
+def bench_topics(workDir, args):
+    cachePath = os.path.join(workDir, 'bag_scans.json')
+    write_scan_cache(cachePath, args.bags, args.topics)
+    cache, cacheBytes, cachePeak = measure(lambda: gen.BagScanCache(cachePath))
+    (catalogs, dfs), catalogBytes, catalogPeak = measure(lambda: build_catalogs(cache))
+    numRecords = sum(len(entry['records']) for entry in cache.entries.values())
+    numTopics = sum(len(catalog) for catalog in catalogs.values())
+    return {'bags': len(cache.entries), 'topicRecords': numRecords, 'topics': numTopics,
+            'cacheBytes': cacheBytes, 'cachePeak': cachePeak, 'catalogBytes': catalogBytes, 'catalogPeak': catalogPeak,
+            'bytesPerRecord': cacheBytes / numRecords, 'bytesPerTopic': catalogBytes / numTopics}
+
+
+# takes in the work directory and the parsed arguments and unwraps every synthetic
+# type, returning how much memory the struct fields take
+def bench_fields(workDir, args):
+    home = os.path.join(workDir, 'home')
+    roots, customRoots = write_msg_tree(home, 'jason')
+    msgTypes = [f'{package}/{typeName}' for packages in (CUSTOM_MSGS, SHARE_MSGS)
+                for package, types in packages.items() for typeName in types]
+    topics = [(f'jason/sensors/{typeName.split("/")[1].lower()}{c}', typeName)
+              for typeName in msgTypes for c in range(args.struct_copies)]
+    config = gen.RunConfig(interactive=False, msgRoots=roots, customMsgRoots=customRoots)
+    # no schema cache from an earlier run, everything gets parsed and unwrapped
+    os.chdir(workDir)
+    defs = gen.BagStructDefs('jason', workDir, None, config)
+    catalog = gen.TopicCatalog()
+    for topic, typeName in topics:
+        catalog.add(topic, typeName)
+    defs.use_bags({'sensors': catalog.to_df()}, {'sensors': catalog})
+    with contextlib.redirect_stdout(io.StringIO()):
+        unwrapped, fieldBytes, fieldPeak = measure(defs.get_structFieldsUnwrapped)
+    distinct = {id(fields): fields for fields in unwrapped.values()}
+    numFields = sum(len(fields) for fields in distinct.values())
+    return {'structs': len(unwrapped), 'distinctStructs': len(distinct), 'fields': numFields,
+            'fieldBytes': fieldBytes, 'fieldPeak': fieldPeak, 'bytesPerField': fieldBytes / numFields}
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Measure memory per topic and per struct field')
+    parser.add_argument('--bags', type=int, default=5000, help='Bags in the synthetic scan cache')
+    parser.add_argument('--topics', type=int, default=40, help='Topics per bag')
+    parser.add_argument('--struct-copies', type=int, default=20, help='Topics per synthetic message type')
+    parser.add_argument('--json', help='Also write the results to this file')
+    args = parser.parse_args()
+
+    gen.tracer.verbosity = 0
+    workDir = tempfile.mkdtemp(prefix='bench_memory_')
+    oldCwd = os.getcwd()
+    tracemalloc.start()
+    try:
+        topics = bench_topics(workDir, args)
+        fields = bench_fields(workDir, args)
+    finally:
+        tracemalloc.stop()
+        os.chdir(oldCwd)
+        shutil.rmtree(workDir, ignore_errors=True)
+
+    print(f"topics: {topics['bags']} bags, {topics['topicRecords']} bag topic records, {topics['topics']} topics")
+    print(f"  scan cache    {topics['cacheBytes'] / 1e6:>9.2f} MB held {topics['cachePeak'] / 1e6:>9.2f} MB peak"
+          f"  {topics['bytesPerRecord']:>8.1f} bytes per bag topic record")
+    print(f"  catalogs      {topics['catalogBytes'] / 1e6:>9.2f} MB held {topics['catalogPeak'] / 1e6:>9.2f} MB peak"
+          f"  {topics['bytesPerTopic']:>8.1f} bytes per topic")
+    print(f"fields: {fields['structs']} structs, {fields['distinctStructs']} distinct with {fields['fields']} unwrapped fields")
+    print(f"  unwrapped     {fields['fieldBytes'] / 1e6:>9.2f} MB held {fields['fieldPeak'] / 1e6:>9.2f} MB peak"
+          f"  {fields['bytesPerField']:>8.1f} bytes per struct field")
+    print(f"peak RSS {resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1e3:.1f} MB")
+
+    if args.json:
+        with open(args.json, 'w') as file:
+            json.dump({'topics': topics, 'fields': fields}, file, indent=2)
+
+
+if __name__ == '__main__':
+    main()
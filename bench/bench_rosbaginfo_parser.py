@@ -0,0 +1,76 @@
+# perf check for parse_rosbag_info on synthetic 'rosbag info' dumps
+# run from the repository root with
+#   python bench/bench_rosbaginfo_parser.py
+
+# builds dumps of 1k and 10k topics, checks every topic comes back with the right type,
+# and checks parsing time grows linearly with the number of topics (a quadratic
+# parser would take ~100x longer on the 10k dump than on the 1k dump)
+
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+
+from generate_bagstructdefs import parse_rosbag_info
+
+
+# takes in a number of topics and returns the lines of a rosbag info dump with that many topics,
+# every third topic lives outside the vehicle namespace like the topics in globals do
+def make_info_dump(numTopics, vehicle='sentry'):
+    numTypes = max(1, numTopics // 10)
+    lines = [
+        'path:        /data/sentry/2023/synthetic.bag\n',
+        'version:     2.0\n',
+        'duration:    59:59s (3599s)\n',
+        'size:        1.0 GB\n',
+        f'messages:    {numTopics * 100}\n',
+        'compression: none [900/900 chunks]\n',
+    ]
+    for t in range(numTypes):
+        prefix = 'types:       ' if t == 0 else '             '
+        lines.append(f'{prefix}synthetic_msgs/Type{t} [{t:032x}]\n')
+    for i in range(numTopics):
+        prefix = 'topics:      ' if i == 0 else '             '
+        topic = f'/globals/topic{i}' if i % 3 == 0 else f'/{vehicle}/sensors/topic{i}'
+        count = 100 + i
+        connections = '  (2 connections)' if i % 7 == 0 else ''
+        lines.append(f'{prefix}{topic:<40} {count:>8} msgs    : synthetic_msgs/Type{i % numTypes}{connections}\n')
+    return lines
+
+
+# takes in a dump and returns (records, seconds to parse) using the best of a few runs
+def time_parse(lines, repeats=5):
+    best = None
+    records = None
+    for _ in range(repeats):
+        start = time.perf_counter()
+        records = list(parse_rosbag_info(lines))
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return records, best
+
+
+def main():
+    small = make_info_dump(1000)
+    large = make_info_dump(10000)
+
+    records, largeSeconds = time_parse(large)
+    assert len(records) == 10000, f'expected 10000 records, got {len(records)}'
+    for i, (topic, type, md5sum, count, connections) in enumerate(records):
+        assert topic.endswith(f'topic{i}'), topic
+        assert type == f'synthetic_msgs/Type{i % 1000}', type
+        assert md5sum == f'{i % 1000:032x}', md5sum
+        assert count == 100 + i
+        assert connections == (2 if i % 7 == 0 else 1)
+
+    _, smallSeconds = time_parse(small)
+    ratio = largeSeconds / smallSeconds
+    print(f'1k topics:  {smallSeconds * 1e3:8.2f} ms')
+    print(f'10k topics: {largeSeconds * 1e3:8.2f} ms ({ratio:.1f}x the 1k dump)')
+    # linear is ~10x, leave plenty of room for timer noise
+    assert ratio < 25, f'parse time grew {ratio:.1f}x for 10x the topics, expected linear growth'
+
+
+if __name__ == '__main__':
+    main()
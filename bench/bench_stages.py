@@ -0,0 +1,133 @@
+# per-stage timings and peak memory on synthetic dive archives, no NDSF servers needed
+# run from the repository root with
+#   python bench/bench_stages.py
+#   python bench/bench_stages.py --vehicles jason sentry --sizes small medium --repeat 3 --json out.json
+#   python bench/bench_stages.py --sizes large --sample-arrays
+
+# for every vehicle and size, builds an archive with bench/synthetic.py in a temporary
+# directory (HOME points into it, so nothing under the real ~/git or ~/ros is touched)
+# and times each stage of a non-interactive run on it:
+#   dive discovery     RosbagDiveData in cumulative mode
+#   bag scan           BagStructDefs.get_bags (listing, sampling, index reads)
+#   struct unwrap      BagStructDefs.get_structFieldsUnwrapped (msg resolution, unwrapping)
+#   populate_Bags      writing bag_defs
+#   populate_structs   writing struct_defs
+# peak memory is the tracemalloc peak within the stage. every repeat starts without the
+# caches and topic catalog unless --warm is given, and the best time of the repeats is kept
+
+import argparse
+import contextlib
+import io
+import json
+import os
+import shutil
+import sys
+import tempfile
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import generate_bagstructdefs as gen
+from synthetic import SIZES, build_archive
+
+STAGES = ('dive discovery', 'bag scan', 'struct unwrap', 'populate_Bags', 'populate_structs')
+
+
+# takes in a function and returns (its result, seconds it took, peak bytes allocated while it ran)
+def measure(fn):
+    tracemalloc.reset_peak()
+    before = tracemalloc.get_traced_memory()[0]
+    start = time.perf_counter()
+    result = fn()
+    elapsed = time.perf_counter() - start
+    peak = tracemalloc.get_traced_memory()[1] - before
+    return result, elapsed, max(peak, 0)
+
+
+# takes in a built archive, a vehicle and the parsed arguments and runs every stage once,
+# returning {stage: (seconds, peak bytes)}
+def run_once(archive, vehicle, args):
+    config = gen.RunConfig(interactive=False, msgRoots=archive['msgRoots'],
+                           customMsgRoots=archive['customMsgRoots'], seed=args.seed,
+                           sampleArrays=args.sample_arrays)
+    results = {}
+    data, *results['dive discovery'] = measure(lambda: gen.RosbagDiveData(vehicle, archive['dataDir'], 'cumulative', args.seed))
+    defs = gen.BagStructDefs(vehicle, archive['dataDir'], data, config)
+    _, *results['bag scan'] = measure(defs.get_bags)
+    _, *results['struct unwrap'] = measure(defs.get_structFieldsUnwrapped)
+    _, *results['populate_Bags'] = measure(lambda: gen.populate_Bags(defs))
+    _, *results['populate_structs'] = measure(lambda: gen.populate_structs(defs))
+    return {stage: tuple(value) for stage, value in results.items()}
+
+
+# takes in a vehicle, a size name and the parsed arguments and returns the best
+# {stage: (seconds, peak bytes)} over the repeats, along with the archive stats
+def bench_archive(vehicle, sizeName, args):
+    root = tempfile.mkdtemp(prefix=f'bench_{vehicle}_{sizeName}_')
+    oldHome = os.environ.get('HOME')
+    oldCwd = os.getcwd()
+    try:
+        archive = build_archive(root, vehicle, sizeName, args.seed)
+        os.environ['HOME'] = archive['home']
+        os.chdir(archive['workDir'])
+        best = {}
+        for _ in range(args.repeat):
+            if not args.warm:
+                shutil.rmtree(os.path.join(archive['workDir'], 'dsros_python', vehicle, 'cache'), ignore_errors=True)
+                catalogPath = os.path.join(archive['workDir'], gen.TopicStore.default_path(vehicle))
+                if os.path.exists(catalogPath):
+                    os.remove(catalogPath)
+            with contextlib.redirect_stdout(io.StringIO()):
+                results = run_once(archive, vehicle, args)
+            for stage, (seconds, peak) in results.items():
+                if stage not in best or seconds < best[stage][0]:
+                    best[stage] = (seconds, peak)
+        return best, archive
+    finally:
+        os.chdir(oldCwd)
+        if oldHome is not None:
+            os.environ['HOME'] = oldHome
+        if not args.keep:
+            shutil.rmtree(root, ignore_errors=True)
+        else:
+            print(f'kept archive under {root}')
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark every stage on synthetic dive archives')
+    parser.add_argument('--vehicles', nargs='+', default=['jason', 'alvin', 'sentry'],
+                        choices=['jason', 'alvin', 'sentry'])
+    parser.add_argument('--sizes', nargs='+', default=['small', 'medium'], choices=sorted(SIZES))
+    parser.add_argument('--repeat', type=int, default=3, help='Runs per archive, the best time is kept')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--warm', action='store_true', help='Keep the caches and topic catalog between repeats')
+    parser.add_argument('--sample-arrays', action='store_true',
+                        help='Size unsized arrays from sampled messages, timed as part of struct unwrap')
+    parser.add_argument('--keep', action='store_true', help='Keep the synthetic archives')
+    parser.add_argument('--json', help='Also write the results to this file')
+    args = parser.parse_args()
+
+    gen.tracer.verbosity = 0
+    tracemalloc.start()
+    report = []
+    print(f"{'vehicle':<8} {'size':<7} {'stage':<17} {'seconds':>9} {'peak MB':>9}")
+    for vehicle in args.vehicles:
+        for sizeName in args.sizes:
+            best, archive = bench_archive(vehicle, sizeName, args)
+            for stage in STAGES:
+                seconds, peak = best[stage]
+                print(f'{vehicle:<8} {sizeName:<7} {stage:<17} {seconds:>9.3f} {peak / 1e6:>9.2f}')
+                report.append({'vehicle': vehicle, 'size': sizeName, 'stage': stage, 'seconds': seconds,
+                               'peakBytes': peak, 'dives': len(archive['dives']), 'archiveBytes': archive['bytes']})
+            print(f"{'':<8} {sizeName:<7} ({len(archive['dives'])} dives, {archive['bytes'] / 1e6:.1f} MB of bags)")
+    tracemalloc.stop()
+
+    if args.json:
+        with open(args.json, 'w') as file:
+            json.dump(report, file, indent=2)
+
+
+if __name__ == '__main__':
+    main()
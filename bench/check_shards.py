@@ -0,0 +1,178 @@
+# checks that a sharded run gives the same topic catalog and defs as an unsharded one,
+# with every shard running as its own process. run from the repository root with
+#   python bench/check_shards.py
+#   python bench/check_shards.py --vehicle jason --size medium --shards 4
+
+# builds an archive with bench/synthetic.py in a temporary directory (HOME points into
+# it, so nothing under the real ~/git or ~/ros is touched) and generates defs for it twice:
+#   unsharded   one run over every bag (--every-cruise, and --converge-k set past the
+#               number of bags so the adaptive sampler reads every bag, the same bags
+#               the shards read)
+#   sharded     --shards '--shard i/N' processes started side by side, then 'merge'
+# the archive gets --cruises cruises per year (and ship), more than a cumulative run
+# samples, so shards which only covered the sampled cruises would show up
+# and checks that the topics and sightings in the topic catalogs, the bag_defs and
+# struct_defs, and the bags in the bag scan cache are the same for both.
+# exits with 1 if anything differs
+
+import argparse
+import filecmp
+import glob
+import json
+import os
+import shutil
+import sqlite3
+import subprocess
+import sys
+import tempfile
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import generate_bagstructdefs as gen
+from synthetic import SIZES, build_archive
+
+SCRIPT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src', 'generate_bagstructdefs.py')
+
+
+# takes in the built archive, the vehicle and the parsed arguments and returns the
+# command line options every run shares
+def base_options(archive, vehicle, args):
+    options = ['--vehicle', vehicle, '--datadir', archive['dataDir'], '--seed', str(args.seed),
+               '--non-interactive', '-q']
+    for root in archive['msgRoots']:
+        options += ['--msg-root', root]
+    for root in archive['customMsgRoots']:
+        options += ['--custom-msg-root', root]
+    return options
+
+
+# takes in a command and the built archive and starts it from the archive's work
+# directory with HOME pointing into the archive. warnings (i.e. special types without
+# a rule) are dropped, errors still show up on stderr
+def start(command, archive):
+    env = dict(os.environ, HOME=archive['home'])
+    return subprocess.Popen([sys.executable, SCRIPT] + command, cwd=archive['workDir'], env=env,
+                            stdout=subprocess.DEVNULL)
+
+
+def run(command, archive):
+    proc = start(command, archive)
+    if proc.wait() != 0:
+        raise SystemExit(f"'{' '.join(command)}' exited with {proc.returncode}")
+
+
+# takes in the built archive and the vehicle and returns the defs directory and the
+# directory the topic catalog and caches live in
+def output_dirs(archive, vehicle):
+    return (os.path.join(archive['home'], 'git', 'dslpp-git', 'dsros_python', vehicle),
+            os.path.join(archive['workDir'], 'dsros_python', vehicle))
+
+
+# takes in the built archive and the vehicle and returns (topics, sightings), the sorted
+# rows of the topic catalog
+def read_catalog(archive, vehicle):
+    conn = sqlite3.connect(os.path.join(archive['workDir'], gen.TopicStore.default_path(vehicle)))
+    try:
+        topics = sorted(conn.execute('SELECT * FROM topics').fetchall(), key=repr)
+        sightings = sorted(conn.execute('SELECT * FROM sightings').fetchall(), key=repr)
+    finally:
+        conn.close()
+    return topics, sightings
+
+
+# takes in the built archive and the vehicle and returns the set of bags in the bag scan cache
+def read_scanCache(archive, vehicle):
+    with open(os.path.join(archive['workDir'], gen.BagScanCache.default_path(vehicle)), 'r') as file:
+        return set(json.load(file)['bags'])
+
+
+# takes in two directories and returns the relative paths of every file which is only
+# in one of them or differs between them
+def diff_dirs(left, right, relDir=''):
+    cmp = filecmp.dircmp(left, right)
+    differences = [os.path.join(relDir, name) for name in cmp.left_only + cmp.right_only + cmp.funny_files]
+    _, mismatch, errors = filecmp.cmpfiles(left, right, cmp.common_files, shallow=False)
+    differences += [os.path.join(relDir, name) for name in mismatch + errors]
+    for sub in cmp.common_dirs:
+        differences += diff_dirs(os.path.join(left, sub), os.path.join(right, sub), os.path.join(relDir, sub))
+    return differences
+
+
+# takes in the built archive, the vehicle and the parsed arguments and runs both ways,
+# returning a list of what differs
+def check(root, archive, vehicle, args):
+    defsDir, workDir = output_dirs(archive, vehicle)
+    pristineDefs = os.path.join(root, 'pristine_defs')
+    shutil.copytree(defsDir, pristineDefs)
+    numBags = sum(len(glob.glob(os.path.join(dive, '*.bag'))) for dive in archive['dives'])
+    options = base_options(archive, vehicle, args)
+
+    run(options + ['--every-cruise', '--converge-k', str(numBags + 1)], archive)
+    unshardedDefs = os.path.join(root, 'unsharded_defs')
+    shutil.copytree(defsDir, unshardedDefs)
+    unsharded = read_catalog(archive, vehicle)
+    print(f'unsharded: {len(unsharded[0])} topics, {len(unsharded[1])} sightings')
+
+    # start over from the archive as it was built
+    shutil.rmtree(defsDir)
+    shutil.copytree(pristineDefs, defsDir)
+    shutil.rmtree(workDir)
+    os.makedirs(os.path.join(workDir, 'csv'))
+
+    partialDir = os.path.join(root, 'partials')
+    partials = [os.path.join(partialDir, f'shard-{i}-of-{args.shards}.json') for i in range(1, args.shards + 1)]
+    procs = [start(options + ['--shard', f'{i}/{args.shards}', '--partial-out', partial], archive)
+             for i, partial in enumerate(partials, 1)]
+    failed = [i for i, proc in enumerate(procs, 1) if proc.wait() != 0]
+    if failed:
+        raise SystemExit(f"shards {', '.join(map(str, failed))} of {args.shards} failed")
+    run(['merge'] + options + partials, archive)
+    sharded = read_catalog(archive, vehicle)
+    print(f'sharded:   {len(sharded[0])} topics, {len(sharded[1])} sightings from {args.shards} shards')
+
+    differences = []
+    if sharded[0] != unsharded[0]:
+        differences.append('catalog topics')
+    if sharded[1] != unsharded[1]:
+        differences.append('catalog sightings')
+    differences += [f'defs: {path}' for path in diff_dirs(unshardedDefs, defsDir)]
+    cachedBags = len(read_scanCache(archive, vehicle))
+    print(f'scan cache: {cachedBags} of {numBags} bags')
+    if cachedBags != numBags:
+        differences.append('bag scan cache')
+    return differences
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Check that sharded runs match an unsharded run')
+    parser.add_argument('--vehicle', default='sentry', choices=['jason', 'alvin', 'sentry'])
+    parser.add_argument('--size', default='small', choices=sorted(SIZES))
+    parser.add_argument('--shards', type=int, default=3)
+    parser.add_argument('--cruises', type=int, default=3,
+                        help='Cruises per year (and ship), a cumulative run samples 2 per year for sentry '
+                             'and 1 per ship and year for jason and alvin')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--keep', action='store_true', help='Keep the synthetic archive')
+    args = parser.parse_args()
+
+    root = tempfile.mkdtemp(prefix=f'check_shards_{args.vehicle}_')
+    try:
+        archive = build_archive(root, args.vehicle, args.size, args.seed, args.cruises)
+        differences = check(root, archive, args.vehicle, args)
+    finally:
+        if not args.keep:
+            shutil.rmtree(root, ignore_errors=True)
+        else:
+            print(f'kept archive under {root}')
+
+    if differences:
+        print('sharded and unsharded runs differ:')
+        for difference in differences:
+            print(f'  {difference}')
+        sys.exit(1)
+    print('sharded and unsharded runs match')
+
+
+if __name__ == '__main__':
+    main()
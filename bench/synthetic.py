@@ -0,0 +1,372 @@
+# synthetic dive archives for benchmarking without the NDSF servers
+
+# builds, under a root directory:
+#   data/<vehicle>/...      cruise and dive directories laid out the way
+#                           RosbagDiveData expects for that vehicle, full of ROS1 bags
+#   home/git/dslpp-git/dsros_python/<vehicle>/
+#                           the extract .yaml and empty bag_defs / struct_defs
+#   home/ros/<vehicle>_ws/src/ds_msgs, home/share
+#                           a .msg tree (custom and 'ROS share' packages) with deeply
+#                           nested types and unsized arrays
+#   work/dsros_python/<vehicle>/csv
+#                           the working directory to run from, for the csv master lists
+#                           and caches
+# everything comes from a seed, so the same seed and size always build the same archive
+
+import hashlib
+import os
+import random
+import struct
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+
+from generate_bagstructdefs import RosbagArraySampler, parse_message_definition
+
+
+# how big an archive is: cruises per year and ship, dives per cruise, bags per namespace
+# per dive, messages per topic per bag, and the length of the raw data arrays in messages
+SIZES = {
+    'small': {'cruises': 1, 'dives': 2, 'bags': 3, 'messages': 20, 'dataLength': 64},
+    'medium': {'cruises': 2, 'dives': 4, 'bags': 6, 'messages': 100, 'dataLength': 1024},
+    'large': {'cruises': 3, 'dives': 8, 'bags': 12, 'messages': 400, 'dataLength': 16384},
+}
+
+# how many levels the deeply nested synth_msgs/Level0 type goes down
+NESTING_DEPTH = 12
+
+# package -> {type: .msg def}. 'share' packages go where the ROS share directory
+# would be, the rest into the vehicle's ds_msgs workspace
+SHARE_MSGS = {
+    'std_msgs': {
+        'Header': 'uint32 seq\ntime stamp\nstring frame_id\n',
+        'String': 'string data\n',
+    },
+    'geometry_msgs': {
+        'Vector3': 'float64 x\nfloat64 y\nfloat64 z\n',
+        'Quaternion': 'float64 x\nfloat64 y\nfloat64 z\nfloat64 w\n',
+        'Point': 'float64 x\nfloat64 y\nfloat64 z\n',
+        'Pose': 'Point position\nQuaternion orientation\n',
+        'PoseWithCovariance': 'Pose pose\nfloat64[36] covariance\n',
+        'Vector3Stamped': 'Header header\nVector3 vector\n',
+        'Twist': 'Vector3 linear\nVector3 angular\n',
+    },
+    'sensor_msgs': {
+        'PointField': 'uint8 INT8 = 1\nuint8 FLOAT32 = 7\nstring name\nuint32 offset\nuint8 datatype\nuint32 count\n',
+        'PointCloud2': 'Header header\nuint32 height\nuint32 width\nPointField[] fields\nbool is_bigendian\nuint8[] data\nbool is_dense\n',
+        'Imu': 'Header header\ngeometry_msgs/Quaternion orientation\nfloat64[9] orientation_covariance\n'
+               'geometry_msgs/Vector3 angular_velocity\ngeometry_msgs/Vector3 linear_acceleration\n',
+    },
+}
+
+CUSTOM_MSGS = {
+    'ds_core_msgs': {
+        'DsHeader': 'time io_time\nuint8[16] uuid\n',
+        'FlaggedDouble': 'float64 value\nbool valid\n',
+    },
+    'ds_sensor_msgs': {
+        'Ctd': 'Header header\nds_core_msgs/DsHeader ds_header\nfloat64 conductivity # S/m\nfloat64 temperature\n'
+               'bool salinity_valid\nds_core_msgs/FlaggedDouble depth\n',
+        'PhinsStatus': 'uint32 status\nbool ok\n',
+        'PhinsStdbin3': 'Header header\nds_core_msgs/DsHeader ds_header\nuint32 nav_fields\n'
+                        'geometry_msgs/Vector3Stamped[2] velocities\nds_sensor_msgs/PhinsStatus status\n'
+                        'geometry_msgs/PoseWithCovariance pose\nfloat64[3] attitude\n',
+        'Gyro': 'Header header\nds_core_msgs/DsHeader ds_header\nfloat64[3] gyro\nstring[] names\n',
+        'MultibeamRaw': 'Header header\nds_core_msgs/DsHeader ds_header\nfloat32[] beamflag\nfloat32[] twowayTravelTime\n'
+                        'string sonar_name\n',
+    },
+    'synth_msgs': {},
+}
+
+# the deep type: Level0 holds Level1 holds ... holds Leaf, with a sized and an unsized array on the way
+for _level in range(NESTING_DEPTH):
+    _child = f'Level{_level + 1}' if _level + 1 < NESTING_DEPTH else 'Leaf'
+    CUSTOM_MSGS['synth_msgs'][f'Level{_level}'] = (f'Header header\nfloat64 value{_level}\n{_child} child\n'
+                                                   f'geometry_msgs/Vector3[2] samples\nstring label\n')
+CUSTOM_MSGS['synth_msgs']['Leaf'] = 'float64 value\nbool valid\nuint16[] counts\n'
+
+# namespace -> list of (topic name, type, chance the topic shows up in a bag). topics
+# with a chance below 1 make a namespace's topic set vary from bag to bag
+NAMESPACES = {
+    'nav': [('phinsbin', 'ds_sensor_msgs/PhinsStdbin3', 1.0), ('imu', 'sensor_msgs/Imu', 1.0),
+            ('vel', 'geometry_msgs/Vector3Stamped', 1.0), ('twist', 'geometry_msgs/Twist', 0.5)],
+    'sensors': [('ctd', 'ds_sensor_msgs/Ctd', 1.0), ('gyro', 'ds_sensor_msgs/Gyro', 1.0),
+                ('deep', 'synth_msgs/Level0', 1.0), ('status', 'std_msgs/String', 0.3)],
+    'sonar': [('multibeam', 'ds_sensor_msgs/MultibeamRaw', 1.0), ('cloud', 'sensor_msgs/PointCloud2', 1.0),
+              ('sidescan', 'sensor_msgs/PointCloud2', 0.2)],
+}
+
+PRIMITIVE_FORMATS = {'bool': '<B', 'int8': '<b', 'uint8': '<B', 'byte': '<B', 'char': '<B',
+                     'int16': '<h', 'uint16': '<H', 'int32': '<i', 'uint32': '<I', 'float32': '<f',
+                     'int64': '<q', 'uint64': '<Q', 'float64': '<d', 'time': '<II', 'duration': '<ii'}
+
+
+# takes in a root directory and writes the .msg tree for a vehicle under it,
+# returning ([share directory], [ds_msgs workspace]), the common and custom roots
+def write_msg_tree(home, vehicle):
+    roots = [os.path.join(home, 'ros', f'{vehicle}_ws', 'src', 'ds_msgs'), os.path.join(home, 'share')]
+    for root, packages in zip(roots, (CUSTOM_MSGS, SHARE_MSGS)):
+        for package, types in packages.items():
+            msgDir = os.path.join(root, package, 'msg')
+            os.makedirs(msgDir, exist_ok=True)
+            for typeName, definition in types.items():
+                with open(os.path.join(msgDir, typeName + '.msg'), 'w') as file:
+                    file.write(definition)
+    return [roots[1]], [roots[0]]
+
+
+# takes in a 'package/Type' and returns its .msg def
+def lookup_msg(msgType):
+    package, typeName = msgType.split('/')
+    for packages in (CUSTOM_MSGS, SHARE_MSGS):
+        if typeName in packages.get(package, {}):
+            return packages[package][typeName]
+    raise KeyError(msgType)
+
+
+# takes in a 'package/Type' and returns the message_definition a bag stores for it:
+# its .msg def followed by the def of every type nested in it
+def full_definition(msgType):
+    parts = [lookup_msg(msgType)]
+    seen = {msgType}
+    stack = [msgType]
+    while stack:
+        curType = stack.pop()
+        for fieldType, _, _ in parse_message_definition(curType, lookup_msg(curType))[curType]:
+            if '/' in fieldType and fieldType not in seen:
+                seen.add(fieldType)
+                stack.append(fieldType)
+                parts.append('=' * 80 + f'\nMSG: {fieldType}\n' + lookup_msg(fieldType))
+    return '\n'.join(parts)
+
+
+# serializes random messages of a type from its message_definition
+class MessageEncoder():
+    def __init__(self, msgType, definition, rng, dataLength):
+        self.msgType = msgType
+        self.defs = parse_message_definition(msgType, definition)
+        self.rng = rng
+        self.dataLength = dataLength
+        self.payloads = []
+
+    # takes in a field and returns how long to make an unsized array of it,
+    # raw byte/float data gets long, everything else stays short
+    def array_length(self, fieldType, field):
+        if fieldType in ('uint8', 'float32'):
+            return self.rng.randint(self.dataLength // 2, self.dataLength)
+        return self.rng.randint(1, 4)
+
+    def encode_value(self, fieldType, out):
+        if fieldType == 'string':
+            value = f'synthetic{self.rng.randint(0, 999)}'.encode()
+            out += struct.pack('<I', len(value)) + value
+        elif fieldType in ('time', 'duration'):
+            out += struct.pack(PRIMITIVE_FORMATS[fieldType], self.rng.randint(0, 2 ** 30), 0)
+        elif fieldType in PRIMITIVE_FORMATS:
+            size = RosbagArraySampler.PRIMITIVE_SIZES[fieldType]
+            if fieldType.startswith('float'):
+                out += struct.pack(PRIMITIVE_FORMATS[fieldType], self.rng.random())
+            else:
+                out += struct.pack(PRIMITIVE_FORMATS[fieldType], self.rng.randint(0, 2 ** (8 * size - 2)))
+        else:
+            self.encode_type(fieldType, out)
+
+    def encode_type(self, msgType, out):
+        for fieldType, arrayLength, field in self.defs[msgType]:
+            if arrayLength is None:
+                self.encode_value(fieldType, out)
+                continue
+            if arrayLength == -1:
+                arrayLength = self.array_length(fieldType, field)
+                out += struct.pack('<I', arrayLength)
+            if fieldType in ('uint8', 'byte', 'char'):
+                out += bytes(self.rng.getrandbits(8) for _ in range(min(arrayLength, 64))).ljust(arrayLength, b'\0')
+            else:
+                for _ in range(arrayLength):
+                    self.encode_value(fieldType, out)
+
+    # encoding every message field by field is slow in python, so a handful of distinct
+    # payloads per type are encoded and then drawn from
+    def encode(self, variants=8):
+        if len(self.payloads) < variants:
+            out = bytearray()
+            self.encode_type(self.msgType, out)
+            self.payloads.append(bytes(out))
+            return self.payloads[-1]
+        return self.rng.choice(self.payloads)
+
+
+# takes in a list of (name, value) pairs and returns them as a record header
+def record_header(fields):
+    out = bytearray()
+    for name, value in fields:
+        if isinstance(value, str):
+            value = value.encode()
+        field = name.encode() + b'=' + value
+        out += struct.pack('<I', len(field)) + field
+    return bytes(out)
+
+
+# takes in header fields and data and returns the whole record
+def record(fields, data):
+    header = record_header(fields)
+    return struct.pack('<I', len(header)) + header + struct.pack('<I', len(data)) + data
+
+
+# takes in a path, a list of (topic, type) connections and a list of (connection index,
+# time, payload) messages sorted by time, and writes an indexed, uncompressed ROS1 v2.0
+# bag: bag header, chunks each followed by their index data records, then the
+# connection and chunk info records of the index
+def write_bag(bagPath, connections, messages, chunkSize=64 * 1024):
+    connRecords = []
+    for connId, (topic, msgType) in enumerate(connections):
+        definition = full_definition(msgType)
+        md5sum = hashlib.md5(definition.encode()).hexdigest()
+        data = record_header([('topic', topic), ('type', msgType), ('md5sum', md5sum),
+                              ('message_definition', definition)])
+        connRecords.append(record([('op', b'\x07'), ('conn', struct.pack('<I', connId)), ('topic', topic)], data))
+
+    out = bytearray(b'#ROSBAG V2.0\n')
+    headerPos = len(out)
+    out += b'\0' * 4096
+    chunkInfos = []
+    written = set()
+    pos = 0
+    while pos < len(messages):
+        chunkPos = len(out)
+        inner = bytearray()
+        index = {}
+        startTime = messages[pos][1]
+        endTime = startTime
+        while pos < len(messages) and (not inner or len(inner) < chunkSize):
+            connId, stamp, payload = messages[pos]
+            if connId not in written:
+                inner += connRecords[connId]
+                written.add(connId)
+            index.setdefault(connId, []).append((stamp, len(inner)))
+            inner += record([('op', b'\x02'), ('conn', struct.pack('<I', connId)),
+                             ('time', struct.pack('<II', stamp, 0))], payload)
+            endTime = stamp
+            pos += 1
+        out += record([('op', b'\x05'), ('compression', 'none'), ('size', struct.pack('<I', len(inner)))], bytes(inner))
+        for connId, entries in sorted(index.items()):
+            data = b''.join(struct.pack('<IiI', stamp, 0, offset) for stamp, offset in entries)
+            out += record([('op', b'\x04'), ('ver', struct.pack('<I', 1)), ('conn', struct.pack('<I', connId)),
+                           ('count', struct.pack('<I', len(entries)))], data)
+        chunkInfos.append((chunkPos, startTime, endTime, {c: len(e) for c, e in index.items()}))
+
+    indexPos = len(out)
+    for connRecord in connRecords:
+        out += connRecord
+    for chunkPos, startTime, endTime, counts in chunkInfos:
+        data = b''.join(struct.pack('<II', c, n) for c, n in sorted(counts.items()))
+        out += record([('op', b'\x06'), ('ver', struct.pack('<I', 1)), ('chunk_pos', struct.pack('<Q', chunkPos)),
+                       ('start_time', struct.pack('<II', startTime, 0)), ('end_time', struct.pack('<II', endTime, 0)),
+                       ('count', struct.pack('<I', len(counts)))], data)
+
+    header = record_header([('op', b'\x03'), ('index_pos', struct.pack('<Q', indexPos)),
+                            ('conn_count', struct.pack('<I', len(connections))),
+                            ('chunk_count', struct.pack('<I', len(chunkInfos)))])
+    padding = 4096 - len(header) - 8
+    out[headerPos:headerPos + 4096] = struct.pack('<I', len(header)) + header + struct.pack('<I', padding) + b' ' * padding
+    with open(bagPath, 'wb') as file:
+        file.write(out)
+    return len(out)
+
+
+# takes in a vehicle, a dive directory, the archive size and a random generator and fills
+# the dive with bags for every namespace, returning the total bytes written
+def write_dive(vehicle, diveDir, size, rng, startTime):
+    os.makedirs(diveDir, exist_ok=True)
+    encoders = {}
+    totalBytes = 0
+    for namespace, topics in NAMESPACES.items():
+        for b in range(size['bags']):
+            bagStart = startTime + b * 3600
+            present = [(f'/{vehicle}/{namespace}/{name}', msgType) for name, msgType, chance in topics
+                       if rng.random() < chance]
+            messages = []
+            for connId, (topic, msgType) in enumerate(present):
+                if msgType not in encoders:
+                    encoders[msgType] = MessageEncoder(msgType, full_definition(msgType), rng, size['dataLength'])
+                for m in range(size['messages']):
+                    messages.append((connId, bagStart + m * 3600 // size['messages'], encoders[msgType].encode()))
+            messages.sort(key=lambda message: message[1])
+            stamp = f'2023-01-{1 + b // 24:02d}-{b % 24:02d}-00-00'
+            totalBytes += write_bag(os.path.join(diveDir, f'{namespace}_{stamp}.bag'), present, messages)
+        # a bag which is still being recorded, which discovery has to skip
+        if namespace == 'nav':
+            with open(os.path.join(diveDir, f'{namespace}_2023-12-31-23-59-59.bag.active'), 'wb') as file:
+                file.write(b'#ROSBAG V2.0\n')
+    return totalBytes
+
+
+# takes in a vehicle, a data directory, the archive size and a random generator and
+# returns the list of dive directories for the vehicle's cumulative layout
+def make_dive_dirs(vehicle, dataDir, size):
+    diveDirs = []
+    if vehicle == 'jason':
+        for year in (2022, 2023):
+            for ship in ('KM', 'TN'):
+                for c in range(size['cruises']):
+                    cruise = os.path.join(dataDir, str(year), f'{ship}{year % 100}{c:02d}')
+                    for d in range(size['dives']):
+                        diveDirs.append(os.path.join(cruise, 'Vehicle', 'Rawdata', 'Navest', 'rosbag', f'J2-{1400 + d}'))
+    elif vehicle == 'alvin':
+        for year in (2022, 2023):
+            for c in range(size['cruises']):
+                cruise = os.path.join(dataDir, str(year), f'AT{year % 100}-{c:02d}')
+                for d in range(size['dives']):
+                    diveDirs.append(os.path.join(cruise, f'AL{5000 + d}', 'c+c', 'rosbag'))
+    elif vehicle == 'sentry':
+        for year in (2021, 2022, 2023):
+            for c in range(size['cruises']):
+                cruise = os.path.join(dataDir, str(year), f'{year}-cruise{c:02d}')
+                for d in range(size['dives']):
+                    diveDirs.append(os.path.join(cruise, 'dives', f'sentry{600 + d:03d}', 'nav-sci', 'raw', 'rosbag'))
+    else:
+        raise ValueError(f'Unknown vehicle {vehicle}')
+    return diveDirs
+
+
+# takes in a root directory, a vehicle, a size name, a seed and optionally the number of
+# cruises per year (and ship) to use instead of the size's, and builds the whole archive,
+# returning a dictionary with the 'dataDir', 'home', 'workDir', 'msgRoots',
+# 'customMsgRoots', 'dives' and 'bytes' written
+def build_archive(root, vehicle, sizeName='small', seed=0, cruises=None):
+    size = dict(SIZES[sizeName])
+    if cruises is not None:
+        size['cruises'] = cruises
+    rng = random.Random(seed)
+    dataDir = os.path.join(root, 'data', vehicle)
+    home = os.path.join(root, 'home')
+    workDir = os.path.join(root, 'work')
+
+    dsrosDir = os.path.join(home, 'git', 'dslpp-git', 'dsros_python', vehicle)
+    for sub in ('bag_defs', 'struct_defs'):
+        os.makedirs(os.path.join(dsrosDir, sub), exist_ok=True)
+    with open(os.path.join(dsrosDir, f'{vehicle}_extract.yaml'), 'w') as file:
+        file.write('globals:\n  vehicle: ' + vehicle + '\n')
+        for namespace in NAMESPACES:
+            file.write(f'{namespace}:\n  def: {namespace}.yaml\n')
+    os.makedirs(os.path.join(workDir, 'dsros_python', vehicle, 'csv'), exist_ok=True)
+    msgRoots, customMsgRoots = write_msg_tree(home, vehicle)
+
+    diveDirs = make_dive_dirs(vehicle, dataDir, size)
+    totalBytes = 0
+    for i, diveDir in enumerate(diveDirs):
+        totalBytes += write_dive(vehicle, diveDir, size, rng, 1672531200 + i * 86400)
+    return {'dataDir': dataDir, 'home': home, 'workDir': workDir, 'msgRoots': msgRoots,
+            'customMsgRoots': customMsgRoots, 'dives': diveDirs, 'bytes': totalBytes}
+
+
+if __name__ == '__main__':
+    import argparse
+    parser = argparse.ArgumentParser(description='Build a synthetic dive archive')
+    parser.add_argument('root', help='Directory to build the archive under')
+    parser.add_argument('--vehicle', default='jason', choices=['jason', 'sentry', 'alvin'])
+    parser.add_argument('--size', default='small', choices=sorted(SIZES))
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+    archive = build_archive(args.root, args.vehicle, args.size, args.seed)
+    print(f"built {len(archive['dives'])} dives, {archive['bytes'] / 1e6:.1f} MB of bags under {args.root}")
@@ -30,7 +30,8 @@
 
 # add more informative error catching 
 
-# add support for unsized arrays (non trivial to implement)
+# unsized arrays are only expanded when --sample-arrays is given, and only to the
+# longest length seen in the sampled messages
 
 # print information regarding which files were updated and how, when populate method is called
 # include msg path 
@@ -44,138 +45,2273 @@
 # as populate methods have become more complex 
 
 import argparse
+import bz2
 from collections import OrderedDict
-import copy
+import concurrent.futures
+import contextlib
 import csv
+import ctypes
+import ctypes.util
+import fcntl
+import fnmatch
+import hashlib
+import json
 import yaml 
 import os
 import random
+import queue
 import re
+import select
+import shutil
+import sqlite3
+import struct
 import subprocess
+import sys
 import pandas as pd
 import tempfile
+import threading
+import time
+
+# lz4 compressed bag chunks can only be sampled when the lz4 package is installed
+try:
+    import lz4.frame as lz4frame
+except ImportError:
+    lz4frame = None
+
+# libyaml's C loader/dumper are much faster than the pure python ones, when pyyaml was built with them
+try:
+    from yaml import CSafeLoader as YamlLoader, CSafeDumper as YamlDumper
+except ImportError:
+    from yaml import SafeLoader as YamlLoader, SafeDumper as YamlDumper
+
+
+# context manager which takes in a path and yields a temp file next to it to write to.
+# once the block is done the temp file is flushed, synced to disk and renamed over the
+# path, so readers never see a half written file. the temp file is named after the
+# process, so two runs writing the same file (i.e. a watch and a manual run) each write
+# their own, and it is removed again if the block raises
+@contextlib.contextmanager
+def atomic_write(path):
+    tmpPath = f'{path}.{os.getpid()}.tmp'
+    try:
+        with open(tmpPath, 'w') as file:
+            yield file
+            file.flush()
+            os.fsync(file.fileno())
+        os.replace(tmpPath, path)
+    except BaseException:
+        if os.path.exists(tmpPath):
+            os.remove(tmpPath)
+        raise
+
+
+# A Tracer object records how long each stage of a run takes (spans) and counts
+# the work done along the way (bytes read, subprocesses, stats, cache hits), so a
+# run can say where its time went. spans can be written out in the Chrome trace
+# event format (open in chrome://tracing or https://ui.perfetto.dev) and are summed
+# up in a table at the end of a run
+
+# field 'verbosity' decides how much gets printed through log(): 0 only warnings
+# (warn()) and prompts, 1 also summaries (the default), 2 also debug output. a thread can
+# hold back what log() prints with buffered(), i.e. to print it in one piece later
+
+# there is one module level tracer, 'tracer', which every class records into
+
+class Tracer():
+    def __init__(self):
+        self.start = time.perf_counter()
+        self.events = []
+        self.counters = {}
+        self.threadNames = {}
+        self.verbosity = 1
+        self.lock = threading.Lock()
+        self.local = threading.local()
+
+    # context manager which records a span named name around the code it wraps
+    @contextlib.contextmanager
+    def span(self, name, **args):
+        begin = time.perf_counter()
+        try:
+            yield
+        finally:
+            end = time.perf_counter()
+            thread = threading.current_thread()
+            with self.lock:
+                self.threadNames[thread.ident] = thread.name
+                self.events.append((name, begin - self.start, end - begin, thread.ident, args))
+
+    # takes in a counter name and adds amount to it
+    def count(self, name, amount=1):
+        with self.lock:
+            self.counters[name] = self.counters.get(name, 0) + amount
+
+    # takes in a warning and prints it at every verbosity, held back with the rest of
+    # log() while the thread is buffered
+    def warn(self, message):
+        self.log(message, 0)
+
+    # takes in a message and prints it if the verbosity is at least level
+    def log(self, message, level=1):
+        if self.verbosity >= level:
+            buffer = getattr(self.local, 'buffer', None)
+            if buffer is not None:
+                buffer.append(str(message))
+            else:
+                print(message)
+
+    # context manager which holds back everything log() prints on this thread,
+    # yielding the list the held back lines are collected in
+    @contextlib.contextmanager
+    def buffered(self):
+        lines = []
+        self.local.buffer = lines
+        try:
+            yield lines
+        finally:
+            self.local.buffer = None
+
+    # takes in a function and returns one which runs it with the buffer of the thread
+    # calling carry_buffer, so whatever a worker thread (i.e. a bag scan worker) logs
+    # on behalf of a buffered thread is held back with the rest of that thread's lines
+    def carry_buffer(self, fn):
+        buffer = getattr(self.local, 'buffer', None)
+
+        def run(*args, **kwargs):
+            previous = getattr(self.local, 'buffer', None)
+            self.local.buffer = buffer
+            try:
+                return fn(*args, **kwargs)
+            finally:
+                self.local.buffer = previous
+        return run
+
+    # takes in a path and writes every span and the final counters to it as a Chrome trace
+    def write(self, tracePath):
+        pid = os.getpid()
+        traceEvents = [{'name': 'thread_name', 'ph': 'M', 'pid': pid, 'tid': tid, 'args': {'name': name}}
+                       for tid, name in self.threadNames.items()]
+        for name, begin, duration, tid, args in self.events:
+            traceEvents.append({'name': name, 'cat': 'stage', 'ph': 'X', 'pid': pid, 'tid': tid,
+                                'ts': begin * 1e6, 'dur': duration * 1e6, 'args': args})
+        end = (time.perf_counter() - self.start) * 1e6
+        for name, value in sorted(self.counters.items()):
+            traceEvents.append({'name': name, 'ph': 'C', 'pid': pid, 'ts': end, 'args': {name: value}})
+        with atomic_write(tracePath) as file:
+            json.dump({'traceEvents': traceEvents, 'displayTimeUnit': 'ms'}, file)
+
+    # prints a table of calls and time per span name, and every counter
+    def report(self):
+        if self.verbosity < 1:
+            return
+        totals = {}
+        for name, _, duration, _, _ in self.events:
+            total = totals.setdefault(name, [0, 0.0, 0.0])
+            total[0] += 1
+            total[1] += duration
+            total[2] = max(total[2], duration)
+        wall = time.perf_counter() - self.start
+        print(f'\nrun took {wall:.2f}s')
+        print(f"{'stage':<22}{'calls':>8}{'total s':>10}{'max s':>10}{'% wall':>8}")
+        for name, (calls, total, longest) in sorted(totals.items(), key=lambda item: -item[1][1]):
+            print(f'{name:<22}{calls:>8}{total:>10.3f}{longest:>10.3f}{100 * total / wall if wall else 0:>8.1f}')
+        for name, value in sorted(self.counters.items()):
+            print(f'{name:<22}{value:>8}')
+
+
+tracer = Tracer()
+
+
+# A SymbolTable object interns the strings a run holds many copies of (topics, types,
+# md5sums and field names), so every distinct string is kept once and everything else
+# holds a reference to it. topics, types and md5sums repeat in every bag that carries
+# them and field names repeat in every struct a type shows up in, but there are only
+# ever a few thousand distinct ones, so the table stays small however many bags or
+# cruises a run covers. bag paths are not interned, they are distinct already and the
+# table would only keep them alive
+
+# there is one module level symbol table, 'symbols', which every class interns into
+
+class SymbolTable():
+    def __init__(self):
+        self.strings = {}
+
+    def __len__(self):
+        return len(self.strings)
+
+    # takes in a string and returns the one copy of it the table keeps. setdefault is a
+    # single dictionary operation, so scan threads can intern at the same time
+    def intern(self, text):
+        return self.strings.setdefault(text, text)
+
+    # takes in a (topic, type, md5sum, message count, connection count) record and
+    # returns it as a tuple with its strings interned
+    def intern_record(self, record):
+        topic, type, md5sum, msgCount, connCount = record
+        return (self.intern(topic), self.intern(type), self.intern(md5sum), msgCount, connCount)
+
+    def get_stats(self):
+        return {'strings': len(self.strings), 'bytes': sum(sys.getsizeof(s) for s in self.strings)}
+
+    def report(self):
+        stats = self.get_stats()
+        tracer.log(f"symbol table: {stats['strings']} strings, {stats['bytes'] / 1e3:.1f} kB")
+
+
+symbols = SymbolTable()
+
+
+# A RosbagIndexReader object reads the index section of a ROS1 (format v2.0) bag file
+# without any ROS tooling. the bag header record at the start of the file holds
+# index_pos, the offset of the index, which is made up of one connection record per
+# connection followed by one chunk info record per chunk. only the bag header and the
+# index are read, so inspecting a bag costs a few kilobytes instead of a full
+# 'rosbag info' run
+
+# field 'path' is the path to the bag file
+
+# field 'connections' is a dictionary where every key is a connection id and every
+# value is a dictionary with the 'topic', 'type', 'md5sum' and 'message_definition'
+# of that connection
+
+# field 'chunkInfos' is a list of dictionaries, one per chunk, with the 'chunk_pos',
+# 'start_time', 'end_time' and 'counts' (connection id -> message count) of that chunk
+
+# field 'bytesRead' is the number of bytes read from the bag
+
+# raises ValueError if the file is not a v2.0 bag or has no index
+# (i.e. a bag which is still being recorded)
+
+class RosbagIndexReader():
+    MAGIC = b'#ROSBAG V2.0\n'
+    OP_BAG_HEADER = 0x03
+    OP_CHUNK_INFO = 0x06
+    OP_CONNECTION = 0x07
+
+    def __init__(self, bagPath):
+        self.path = bagPath
+        self.connections = {}
+        self.chunkInfos = []
+        self.bytesRead = 0
+        self.read_index()
+
+    # takes in the bytes of a record header and returns a dictionary
+    # of field name -> raw field value
+    def parse_header(self, headerBytes):
+        fields = {}
+        pos = 0
+        end = len(headerBytes)
+        while pos < end:
+            if pos + 4 > end:
+                raise ValueError(f'Truncated record header in {self.path}')
+            fieldLen = struct.unpack_from('<I', headerBytes, pos)[0]
+            pos += 4
+            field = headerBytes[pos:pos + fieldLen]
+            pos += fieldLen
+            sep = field.find(b'=')
+            if sep < 0:
+                raise ValueError(f'Malformed record header field in {self.path}')
+            fields[field[:sep].decode()] = field[sep + 1:]
+        return fields
+
+    # takes in a buffer and offset and returns (header, data, newOffset)
+    # for the record starting at that offset
+    def parse_record(self, buf, pos):
+        if pos + 4 > len(buf):
+            raise ValueError(f'Truncated record in {self.path}')
+        headerLen = struct.unpack_from('<I', buf, pos)[0]
+        pos += 4
+        header = self.parse_header(buf[pos:pos + headerLen])
+        pos += headerLen
+        if pos + 4 > len(buf):
+            raise ValueError(f'Truncated record in {self.path}')
+        dataLen = struct.unpack_from('<I', buf, pos)[0]
+        pos += 4
+        data = buf[pos:pos + dataLen]
+        if len(data) != dataLen:
+            raise ValueError(f'Truncated record in {self.path}')
+        pos += dataLen
+        return header, data, pos
+
+    # reads the bag header record, then seeks to index_pos and reads
+    # the connection and chunk info records
+    def read_index(self):
+        with open(self.path, 'rb') as f:
+            magic = f.read(len(self.MAGIC))
+            self.bytesRead += len(magic)
+            if magic != self.MAGIC:
+                raise ValueError(f'{self.path} is not a ROS bag v2.0 file')
+
+            # header_len, header, data_len; the data is just padding so we don't need it
+            headerLen = struct.unpack('<I', f.read(4))[0]
+            header = self.parse_header(f.read(headerLen))
+            self.bytesRead += 4 + headerLen
+            if header.get('op') != bytes([self.OP_BAG_HEADER]):
+                raise ValueError(f'{self.path} does not start with a bag header record')
+
+            indexPos = struct.unpack('<Q', header['index_pos'])[0]
+            connCount = struct.unpack('<I', header['conn_count'])[0]
+            chunkCount = struct.unpack('<I', header['chunk_count'])[0]
+            if indexPos == 0:
+                raise ValueError(f'{self.path} is not indexed (still being recorded?)')
+
+            f.seek(indexPos)
+            buf = f.read()
+            self.bytesRead += len(buf)
+
+        pos = 0
+        for _ in range(connCount):
+            recHeader, data, pos = self.parse_record(buf, pos)
+            if recHeader.get('op') != bytes([self.OP_CONNECTION]):
+                raise ValueError(f'Expected a connection record in the index of {self.path}')
+            connId = struct.unpack('<I', recHeader['conn'])[0]
+            connHeader = self.parse_header(data)
+            self.connections[connId] = {
+                'topic': recHeader['topic'].decode(),
+                'type': connHeader.get('type', b'').decode(),
+                'md5sum': connHeader.get('md5sum', b'').decode(),
+                'message_definition': connHeader.get('message_definition', b'').decode(),
+            }
+
+        for _ in range(chunkCount):
+            recHeader, data, pos = self.parse_record(buf, pos)
+            if recHeader.get('op') != bytes([self.OP_CHUNK_INFO]):
+                raise ValueError(f'Expected a chunk info record in the index of {self.path}')
+            startSec, startNsec = struct.unpack('<II', recHeader['start_time'])
+            endSec, endNsec = struct.unpack('<II', recHeader['end_time'])
+            numConns = struct.unpack('<I', recHeader['count'])[0]
+            counts = {}
+            for i in range(numConns):
+                connId, count = struct.unpack_from('<II', data, i * 8)
+                counts[connId] = count
+            self.chunkInfos.append({
+                'chunk_pos': struct.unpack('<Q', recHeader['chunk_pos'])[0],
+                'start_time': startSec + startNsec * 1e-9,
+                'end_time': endSec + endNsec * 1e-9,
+                'counts': counts,
+            })
+
+    # returns a list of (topic, type, md5sum, message count, connection count) tuples,
+    # one per topic, sorted by topic
+    def get_topics(self):
+        msgCounts = {}
+        for info in self.chunkInfos:
+            for connId, count in info['counts'].items():
+                msgCounts[connId] = msgCounts.get(connId, 0) + count
+        topics = {}
+        for connId, conn in self.connections.items():
+            topic = conn['topic']
+            if topic not in topics:
+                topics[topic] = [conn['type'], conn['md5sum'], 0, 0]
+            topics[topic][2] += msgCounts.get(connId, 0)
+            topics[topic][3] += 1
+        return [symbols.intern_record((topic, v[0], v[1], v[2], v[3])) for topic, v in sorted(topics.items())]
+
+    def get_connections(self):
+        return self.connections
+
+    def get_chunkInfos(self):
+        return self.chunkInfos
+
+
+# takes in a number n and returns 0..n-1 in an order which spreads the first picks
+# over the whole range (0, n/2, n/4, 3n/4, ...), i.e. over the length of a bag or a dive
+def spread_order(n):
+    order = []
+    seen = set()
+    step = 1
+    while step < n:
+        step *= 2
+    while step >= 1:
+        for i in range(0, n, step):
+            if i not in seen:
+                seen.add(i)
+                order.append(i)
+        step //= 2
+    return order
+
+
+# takes in the type of a connection and its message_definition (the .msg def of the
+# type followed by the .msg def of every type nested in it, each after a 'MSG: package/Type'
+# line) and returns a dictionary where every key is a 'package/Type' and every value is
+# a list of (fieldType, arrayLength, field) tuples, arrayLength being None if the field
+# is not an array and -1 if it is an unsized array
+def parse_message_definition(msgType, definition):
+    defs = {msgType: []}
+    curType = msgType
+    for line in definition.splitlines():
+        line = line.split('#', 1)[0].strip()
+        if not line or line.startswith('=='):
+            continue
+        if line.startswith('MSG:'):
+            curType = line[len('MSG:'):].strip()
+            defs[curType] = []
+            continue
+        parts = line.split()
+        # constants (i.e. 'uint8 OK=0') aren't serialized
+        if len(parts) < 2 or '=' in line:
+            continue
+        fieldType, field = parts[0], parts[1]
+        arrayLength = None
+        if fieldType.endswith(']'):
+            fieldType, size = fieldType[:-1].split('[', 1)
+            arrayLength = int(size) if size else -1
+        if fieldType == 'Header':
+            fieldType = 'std_msgs/Header'
+        elif fieldType not in RosbagArraySampler.PRIMITIVE_SIZES and fieldType != 'string' and '/' not in fieldType:
+            fieldType = curType.split('/', 1)[0] + '/' + fieldType
+        defs[curType].append((fieldType, arrayLength, field))
+    return defs
+
+
+# A RosbagArraySampler object reads a bounded number of messages per topic straight
+# out of bag chunks and records the longest length seen for every unsized array
+# field (i.e. 'sensor_msgs/PointField[] fields'), so those fields can be expanded
+# like sized arrays. the chunks to read come from the chunk infos in the bag index,
+# so a bag is never scanned from the start, and messages are decoded from the
+# message_definition stored with each connection, so no .msg files are needed
+
+# takes in the most messages and the most bytes of chunk data to read per topic,
+# and the longest array length which is still expanded (longer arrays, i.e.
+# image data, stay unsized)
+
+# field 'lengths' is a dictionary where every key is a (message type, field) tuple
+# and every value is the longest length seen for that unsized array field
+
+# field 'overflow' is the set of (message type, field) tuples which were seen longer
+# than maxLength
+
+class RosbagArraySampler():
+    PRIMITIVE_SIZES = {'bool': 1, 'int8': 1, 'uint8': 1, 'byte': 1, 'char': 1,
+                       'int16': 2, 'uint16': 2, 'int32': 4, 'uint32': 4, 'float32': 4,
+                       'int64': 8, 'uint64': 8, 'float64': 8, 'time': 8, 'duration': 8}
+    OP_MSG_DATA = 0x02
+    OP_CHUNK = 0x05
+
+    def __init__(self, maxMessages=50, maxBytes=16 * 1024 ** 2, maxLength=64):
+        self.maxMessages = maxMessages
+        self.maxBytes = maxBytes
+        self.maxLength = maxLength
+        self.lengths = {}
+        self.overflow = set()
+        # topic -> [messages decoded, chunk bytes read]
+        self.topicUsage = {}
+        self.defs = {}
+        self.fixedSizes = {}
+        self.bagsRead = 0
+        self.bytesRead = 0
+        self.messagesRead = 0
+        self.errors = 0
+
+    # takes in a message type and its message_definition and returns the parsed
+    # definitions, parsing every type's definition only once
+    def get_defs(self, msgType, definition):
+        if msgType not in self.defs:
+            for defType, fields in parse_message_definition(msgType, definition).items():
+                self.defs.setdefault(defType, fields)
+        return self.defs
+
+    # takes in a message type and returns True if it or a type nested in it has an unsized array
+    def has_unsized(self, msgType):
+        stack = [msgType]
+        seen = set()
+        while stack:
+            curType = stack.pop()
+            if curType in seen or curType not in self.defs:
+                continue
+            seen.add(curType)
+            for fieldType, arrayLength, _ in self.defs[curType]:
+                if arrayLength == -1:
+                    return True
+                if fieldType in self.defs:
+                    stack.append(fieldType)
+        return False
+
+    # takes in a message type and returns its serialized size if it is always the
+    # same (no strings or unsized arrays anywhere in it), None otherwise
+    def fixed_size(self, msgType):
+        if msgType in self.fixedSizes:
+            return self.fixedSizes[msgType]
+        self.fixedSizes[msgType] = None
+        size = 0
+        for fieldType, arrayLength, _ in self.defs.get(msgType, ()):
+            if arrayLength == -1:
+                return None
+            fieldSize = self.PRIMITIVE_SIZES.get(fieldType)
+            if fieldSize is None:
+                fieldSize = self.fixed_size(fieldType) if fieldType in self.defs else None
+            if fieldSize is None:
+                return None
+            size += fieldSize * (arrayLength if arrayLength is not None else 1)
+        self.fixedSizes[msgType] = size
+        return size
+
+    # takes in a message type, a serialized message and an offset and returns the
+    # offset just past that type, recording the length of every unsized array on the way
+    def walk(self, msgType, buf, pos):
+        for fieldType, arrayLength, field in self.defs[msgType]:
+            count = 1 if arrayLength is None else arrayLength
+            if arrayLength == -1:
+                count = struct.unpack_from('<I', buf, pos)[0]
+                pos += 4
+                key = (msgType, field)
+                if count > self.lengths.get(key, 0):
+                    self.lengths[key] = count
+                if count > self.maxLength:
+                    self.overflow.add(key)
+            size = self.PRIMITIVE_SIZES.get(fieldType)
+            if size is None and fieldType != 'string':
+                if fieldType not in self.defs:
+                    raise ValueError(f'No definition for {fieldType}')
+                size = self.fixed_size(fieldType)
+            if size is not None:
+                pos += size * count
+            elif fieldType == 'string':
+                for _ in range(count):
+                    pos += 4 + struct.unpack_from('<I', buf, pos)[0]
+            else:
+                for _ in range(count):
+                    pos = self.walk(fieldType, buf, pos)
+            if pos > len(buf):
+                raise ValueError(f'Message of type {msgType} is truncated')
+        return pos
+
+    # takes in the header of a chunk record and its data and returns the uncompressed data,
+    # or None if the compression isn't supported here
+    def decompress(self, header, data):
+        compression = header.get('compression', b'none').decode()
+        if compression == 'none':
+            return data
+        if compression == 'bz2':
+            return bz2.decompress(data)
+        if compression == 'lz4' and lz4frame is not None:
+            return lz4frame.decompress(data)
+        return None
+
+    # takes in a topic and returns True if it can still take more messages
+    def wants(self, topic):
+        usage = self.topicUsage.get(topic, (0, 0))
+        return usage[0] < self.maxMessages and usage[1] < self.maxBytes
+
+    # takes in the path to a bag and the set of message types to sample and reads
+    # the chunks holding those types until every topic of those types hits its caps
+    def sample_bag(self, bagPath, msgTypes):
+        try:
+            reader = RosbagIndexReader(bagPath)
+        except (OSError, ValueError, KeyError, struct.error) as e:
+            tracer.warn(f'Not sampling arrays from {bagPath} ({e})')
+            return
+        self.bagsRead += 1
+        self.bytesRead += reader.bytesRead
+
+        # only connections whose type has an unsized array somewhere are worth reading
+        conns = {}
+        for connId, conn in reader.get_connections().items():
+            if conn['type'] in msgTypes:
+                self.get_defs(conn['type'], conn['message_definition'])
+                if self.has_unsized(conn['type']):
+                    conns[connId] = conn
+        if not conns:
+            return
+
+        chunkInfos = reader.get_chunkInfos()
+        with open(bagPath, 'rb') as f:
+            for i in spread_order(len(chunkInfos)):
+                info = chunkInfos[i]
+                topics = {conns[c]['topic'] for c in info['counts'] if c in conns}
+                topics = {t for t in topics if self.wants(t)}
+                if not topics:
+                    if not any(self.wants(conns[c]['topic']) for c in conns):
+                        break
+                    continue
+                try:
+                    self.read_chunk(f, reader, info['chunk_pos'], conns, topics)
+                except (OSError, ValueError, KeyError, struct.error) as e:
+                    self.errors += 1
+                    tracer.warn(f'Skipping chunk at {info["chunk_pos"]} of {bagPath} ({e})')
+
+    # takes in an open bag, its reader, the offset of a chunk, the connections being
+    # sampled and the topics which still want messages, and walks the wanted messages in it
+    def read_chunk(self, f, reader, chunkPos, conns, topics):
+        f.seek(chunkPos)
+        headerLen = struct.unpack('<I', f.read(4))[0]
+        header = reader.parse_header(f.read(headerLen))
+        if header.get('op') != bytes([self.OP_CHUNK]):
+            raise ValueError('not a chunk record')
+        dataLen = struct.unpack('<I', f.read(4))[0]
+        # the chunk counts against every topic it is read for, and is only read
+        # if that keeps at least one of them within its byte cap
+        self.bytesRead += 8 + headerLen
+        topics = {t for t in topics if self.topicUsage.get(t, (0, 0))[1] + dataLen <= self.maxBytes}
+        if not topics:
+            return
+        data = f.read(dataLen)
+        self.bytesRead += len(data)
+        for t in topics:
+            self.topicUsage.setdefault(t, [0, 0])[1] += dataLen
+        data = self.decompress(header, data)
+        if data is None:
+            raise ValueError(f"unsupported compression {header.get('compression', b'').decode()}")
+
+        pos = 0
+        while pos < len(data):
+            recHeader, msg, pos = reader.parse_record(data, pos)
+            if recHeader.get('op') != bytes([self.OP_MSG_DATA]):
+                continue
+            conn = conns.get(struct.unpack('<I', recHeader['conn'])[0])
+            if conn is None or conn['topic'] not in topics:
+                continue
+            usage = self.topicUsage[conn['topic']]
+            if usage[0] >= self.maxMessages:
+                continue
+            usage[0] += 1
+            self.messagesRead += 1
+            try:
+                self.walk(conn['type'], msg, 0)
+            except (ValueError, struct.error, RecursionError):
+                self.errors += 1
+
+    # returns a dictionary where every key is a (message type, field) tuple and every
+    # value is the length to expand that unsized array field to
+    def get_hints(self):
+        return {key: length for key, length in self.lengths.items()
+                if 0 < length <= self.maxLength and key not in self.overflow}
+
+    def report(self):
+        tracer.log(f'array sampler: {self.messagesRead} messages from {len(self.topicUsage)} topics in '
+                   f'{self.bagsRead} bags, {self.bytesRead} bytes read, {len(self.get_hints())} arrays sized, '
+                   f'{len(self.overflow)} too long, {self.errors} errors')
+
+
+# A BagListing object enumerates dive directories and buckets the bags in them by
+# namespace. every directory is listed once with os.scandir, no matter how many
+# namespaces there are, and a file is matched against the namespaces through a
+# prefix index: for every distinct namespace length L, name[:L] is looked up in the
+# set of namespaces of that length, so matching costs the same for 1 or 100 namespaces
+
+# takes in the namespaces to bucket files into (the keys of the extract .yaml), which
+# can be left out when the listing is only used for its stats
+
+# field 'stats' is a dictionary where every key is a path to a bag and every value is
+# the (size, mtime) of that bag, captured while listing so nothing has to stat it again
+
+class BagListing():
+    def __init__(self, namespaces=()):
+        self.byLength = {}
+        for namespace in namespaces:
+            self.byLength.setdefault(len(namespace), set()).add(namespace)
+        self.stats = {}
+        self.dirsListed = 0
+        self.filesSeen = 0
+        self.listSeconds = 0.0
+        self.lock = threading.Lock()
+
+    # takes in a dive directory and returns a dictionary where every key is a namespace
+    # and every value is a list of the names of files in the directory which start with
+    # that namespace and don't end in '.active', in directory order
+    def list_dir(self, diveDir):
+        with tracer.span('dive discovery', dir=diveDir):
+            start = time.perf_counter()
+            buckets = {}
+            with os.scandir(diveDir) as entries:
+                for entry in entries:
+                    self.filesSeen += 1
+                    name = entry.name
+                    if name.endswith('.active'):
+                        continue
+                    matched = False
+                    for length, namespaces in self.byLength.items():
+                        if name[:length] in namespaces:
+                            buckets.setdefault(name[:length], []).append(name)
+                            matched = True
+                    if matched:
+                        tracer.count("files stat'ed")
+                        try:
+                            st = entry.stat()
+                        except OSError:
+                            continue
+                        with self.lock:
+                            self.stats[entry.path] = (st.st_size, st.st_mtime)
+            self.dirsListed += 1
+            self.listSeconds += time.perf_counter() - start
+            return buckets
+
+    # takes in a path to a bag and returns its (size, mtime), from the listing if it
+    # was listed and from os.stat if not. raises OSError if the bag can't be stat'd
+    def get_stat(self, bagFile):
+        stat = self.stats.get(bagFile)
+        if stat is None:
+            tracer.count("files stat'ed")
+            st = os.stat(bagFile)
+            stat = (st.st_size, st.st_mtime)
+            with self.lock:
+                self.stats[bagFile] = stat
+        return stat
+
+    # takes in a path to a bag and returns its size, 0 if it can't be stat'd
+    def get_size(self, bagFile):
+        try:
+            return self.get_stat(bagFile)[0]
+        except OSError:
+            return 0
+
+    def report(self):
+        tracer.log(f'listed {self.dirsListed} dive directories ({self.filesSeen} files, '
+                   f'{len(self.stats)} bags matched) in {self.listSeconds:.3f}s')
+
+
+# A BagScanCache object is an on-disk record of every bag which has been scanned,
+# so later runs don't inspect the same bag again. a closed .bag file never changes,
+# so each entry is keyed by the absolute path of the bag and is only trusted while
+# the size and mtime of the bag still match
+
+# takes in the path to the cache file (created on save if it doesn't exist yet) and
+# optionally the BagListing the bags came from, which already knows their size and mtime
+
+# field 'entries' is a dictionary where every key is an absolute bag path and every
+# value is a dictionary with the 'size' and 'mtime' of the bag and the 'records'
+# (topic, type, md5sum, message count, connection count) tuples scanned from it, with
+# their strings interned in the symbol table
+
+class BagScanCache():
+    VERSION = 1
+
+    def __init__(self, cachePath, listing=None):
+        self.path = cachePath
+        self.listing = listing if listing is not None else BagListing()
+        self.dirCounts = None
+        self.hits = 0
+        self.misses = 0
+        self.dirty = False
+        # bags put since the cache was loaded, which are what save() writes over the file
+        self.updated = set()
+        self.lock = threading.Lock()
+        self.entries = self.read_entries()
+
+    # reads the cache file and returns its entries, an empty dictionary if the file
+    # is missing, unreadable, or from a different cache version
+    def read_entries(self):
+        if not os.path.exists(self.path):
+            return {}
+        try:
+            with open(self.path, 'r') as file:
+                content = json.load(file)
+        except (OSError, ValueError) as e:
+            tracer.warn(f'Ignoring unreadable bag scan cache {self.path} ({e})')
+            return {}
+        if content.get('version') != self.VERSION:
+            return {}
+        entries = content.get('bags', {})
+        # every bag repeats the topics, types and md5sums of the bags before it,
+        # the records keep one copy of each
+        for entry in entries.values():
+            entry['records'] = tuple(symbols.intern_record(r) for r in entry['records'])
+        return entries
+
+    # returns the path of the bag scan cache for a vehicle, which lives in
+    # dsros_python/vehiclename/cache next to the .csv master lists
+    @staticmethod
+    def default_path(vehicleName):
+        return os.path.join('dsros_python', vehicleName, 'cache', 'bag_scans.json')
+
+    # takes in a path to a bag and returns True if it has ever been scanned,
+    # without checking whether it changed since
+    def has(self, bagFile):
+        return os.path.abspath(bagFile) in self.entries
+
+    # takes in a directory (i.e. a cruise or a dive) and returns how many bags under it
+    # have ever been scanned. counts for every directory are worked out on the first call
+    def count_under(self, dirPath):
+        if self.dirCounts is None:
+            self.dirCounts = {}
+            for bagPath in list(self.entries):
+                parent = os.path.dirname(bagPath)
+                while True:
+                    self.dirCounts[parent] = self.dirCounts.get(parent, 0) + 1
+                    grandparent = os.path.dirname(parent)
+                    if grandparent == parent:
+                        break
+                    parent = grandparent
+        return self.dirCounts.get(os.path.abspath(dirPath), 0)
+
+    # takes in a path to a bag and returns its (size, mtime)
+    def stat_bag(self, bagFile):
+        return self.listing.get_stat(bagFile)
+
+    # takes in a path to a bag and returns the cached records for it,
+    # or None if the bag hasn't been scanned or has changed since
+    def get(self, bagFile):
+        key = os.path.abspath(bagFile)
+        entry = self.entries.get(key)
+        if entry is not None:
+            try:
+                size, mtime = self.stat_bag(bagFile)
+            except OSError:
+                size, mtime = None, None
+            if entry['size'] == size and entry['mtime'] == mtime:
+                with self.lock:
+                    self.hits += 1
+                tracer.count('scan cache hits')
+                return list(entry['records'])
+        with self.lock:
+            self.misses += 1
+        tracer.count('scan cache misses')
+        return None
+
+    # takes in a path to a bag and the records scanned from it and stores them
+    def put(self, bagFile, records):
+        try:
+            size, mtime = self.stat_bag(bagFile)
+        except OSError:
+            return
+        with self.lock:
+            self.entries[os.path.abspath(bagFile)] = {
+                'size': size,
+                'mtime': mtime,
+                'records': tuple(symbols.intern_record(r) for r in records),
+            }
+            self.updated.add(os.path.abspath(bagFile))
+            self.dirty = True
+
+    # writes the cache file if anything changed, via a temp file so an interrupted
+    # run never leaves a half written cache behind. processes running side by side from
+    # one directory (i.e. shards) take turns through a lock file, and each one reads the
+    # file again under the lock and writes the bags it put on top of it, so no process
+    # loses what another one saved since it loaded the cache
+    def save(self):
+        if not self.dirty:
+            return
+        cacheDir = os.path.dirname(self.path)
+        if cacheDir:
+            os.makedirs(cacheDir, exist_ok=True)
+        with self.lock, open(self.path + '.lock', 'a') as lockFile:
+            fcntl.flock(lockFile, fcntl.LOCK_EX)
+            ours = {bagPath: self.entries[bagPath] for bagPath in self.updated}
+            self.entries.update(self.read_entries())
+            self.entries.update(ours)
+            content = {'version': self.VERSION, 'bags': self.entries}
+            with atomic_write(self.path) as file:
+                json.dump(content, file)
+            self.dirCounts = None
+            self.updated = set()
+            self.dirty = False
+
+    def get_stats(self):
+        return {'entries': len(self.entries), 'hits': self.hits, 'misses': self.misses}
+
+
+# A BagScanPool object fans the per-bag inspection out across a pool of worker
+# threads. bag inspection is almost entirely file I/O, so threads are enough to keep
+# several reads in flight against the storage server
+
+# takes in the number of jobs (worker threads) to run with, 1 means inspect bags
+# one after another on the calling thread, optionally a BagScanCache which is
+# consulted before a bag is inspected and updated after, optionally the BagListing
+# the bags came from, optionally the RunBudget index reads count against, and
+# optionally an executor to run inspections on instead of starting its own
+# (i.e. the one executor every vehicle of a multi vehicle run shares)
+
+# field 'results' is a dictionary where every key is a path to a bag and every value
+# is the list of (topic, type, md5sum, message count, connection count) tuples read
+# from its index, or None if the index couldn't be read and the bag needs the
+# rosbag info fallback. results are kept so a bag is only ever inspected once per run
+
+# field 'workerStats' is a dictionary where every key is a worker thread name and
+# every value is [bags inspected, bytes read, bag bytes covered, seconds spent]
+
+class BagScanPool():
+    def __init__(self, jobs=1, cache=None, listing=None, budget=None, executor=None):
+        self.jobs = max(1, int(jobs))
+        self.cache = cache
+        self.listing = listing if listing is not None else BagListing()
+        self.budget = budget if budget is not None else RunBudget()
+        self.results = {}
+        self.workerStats = {}
+        self.lock = threading.Lock()
+        self.executor = executor
+        # an executor handed in belongs to whoever made it and is left running
+        self.ownsExecutor = executor is None
+        if self.executor is None and self.jobs > 1:
+            self.executor = concurrent.futures.ThreadPoolExecutor(max_workers=self.jobs,
+                                                                  thread_name_prefix='bagscan')
+
+    def get_jobs(self):
+        return self.jobs
+
+    def get_listing(self):
+        return self.listing
+
+    # takes in a path to a bag and reads its index, returning the topic records
+    # or None if the index couldn't be read
+    def inspect_bag(self, bagFile):
+        with tracer.span('bag inspection', bag=bagFile):
+            start = time.perf_counter()
+            bytesRead = 0
+            try:
+                reader = RosbagIndexReader(bagFile)
+                bytesRead = reader.bytesRead
+                records = reader.get_topics()
+            except (OSError, ValueError, KeyError, struct.error) as e:
+                tracer.warn(f'Could not read index of {bagFile} ({e}), falling back to rosbag info')
+                records = None
+            bagSize = self.listing.get_size(bagFile)
+            self.budget.charge(bytesRead)
+            tracer.count('bytes read', bytesRead)
+            elapsed = time.perf_counter() - start
+
+            worker = threading.current_thread().name
+            with self.lock:
+                stats = self.workerStats.setdefault(worker, [0, 0, 0, 0.0])
+                stats[0] += 1
+                stats[1] += bytesRead
+                stats[2] += bagSize
+                stats[3] += elapsed
+            return records
+
+    # takes in a list of paths to bags and returns a dictionary of bag path -> records
+    # for those bags, inspecting any bag that hasn't been inspected yet. the returned
+    # dictionary follows the order of bagfileList no matter which worker finishes first
+    def scan(self, bagfileList):
+        pending = []
+        seen = set()
+        for bagFile in bagfileList:
+            if bagFile not in self.results and bagFile not in seen:
+                seen.add(bagFile)
+                cached = self.cache.get(bagFile) if self.cache is not None else None
+                if cached is not None:
+                    self.results[bagFile] = cached
+                else:
+                    pending.append(bagFile)
 
-
-# A NamespaceTopics object represents a comprehensive list of rostopics for a 
+        if self.executor is None:
+            for bagFile in pending:
+                self.results[bagFile] = self.inspect_bag(bagFile)
+        else:
+            inspect = tracer.carry_buffer(self.inspect_bag)
+            futures = {bagFile: self.executor.submit(inspect, bagFile) for bagFile in pending}
+            for bagFile, future in futures.items():
+                self.results[bagFile] = future.result()
+
+        if self.cache is not None:
+            for bagFile in pending:
+                if self.results[bagFile] is not None:
+                    self.cache.put(bagFile, self.results[bagFile])
+
+        return {bagFile: self.results[bagFile] for bagFile in bagfileList}
+
+    # takes in a path to a bag and the records found for it some other way
+    # (i.e. rosbag info) and keeps them as the result for that bag
+    def record(self, bagFile, records):
+        self.results[bagFile] = records
+        if self.cache is not None:
+            self.cache.put(bagFile, records)
+
+    # prints bags inspected and throughput for every worker
+    def report(self):
+        if self.cache is not None:
+            stats = self.cache.get_stats()
+            tracer.log(f"bag scan cache: {stats['hits']} hits, {stats['misses']} misses, {stats['entries']} entries")
+        if not self.workerStats:
+            return
+        tracer.log(f'\nbag scan workers ({self.jobs} jobs):')
+        tracer.log(f"{'worker':<14}{'bags':>6}{'index KB':>12}{'bag MB':>12}{'seconds':>10}{'bags/s':>10}")
+        for worker, (bags, bytesRead, bagBytes, seconds) in sorted(self.workerStats.items()):
+            rate = bags / seconds if seconds > 0 else 0.0
+            tracer.log(f'{worker:<14}{bags:>6}{bytesRead / 1e3:>12.1f}{bagBytes / 1e6:>12.1f}{seconds:>10.2f}{rate:>10.1f}')
+
+    def shutdown(self):
+        if self.executor is not None and self.ownsExecutor:
+            self.executor.shutdown(wait=True)
+        self.executor = None
+
+
+# A BagStager object copies bags to a local staging directory for the tools that
+# can't work on bags in place (rosbag info). bags are copied in batches with one
+# rsync per batch on a background thread, so the next batch is transferring while
+# the current one is being inspected. staged bytes are kept under a byte budget and
+# each bag is evicted as soon as the caller is done with it
+
+# takes in the directory to stage under, the byte budget for that directory
+# (None for no budget), the maximum number of bags per transfer batch, optionally
+# the BagListing the bags came from, and optionally the RunBudget of the run. once
+# the run budget is used up no more bags are staged, and a batch is cut short rather
+# than pull more bytes than the run budget has left. a bag which alone is bigger than
+# what the run budget has left is skipped, smaller bags after it can still be staged
+
+# a bag bigger than the whole budget still gets staged, but only once nothing
+# else is staged
+
+class BagStager():
+    def __init__(self, stageDir='/tmp', byteBudget=None, batchSize=4, listing=None, budget=None):
+        self.stageDir = stageDir
+        self.listing = listing if listing is not None else BagListing()
+        self.budget = budget if budget is not None else RunBudget()
+        self.byteBudget = byteBudget
+        self.batchSize = max(1, int(batchSize))
+        self.stagedBytes = 0
+        self.peakBytes = 0
+        self.transferredBytes = 0
+        self.transferSeconds = 0.0
+        self.transfers = 0
+        self.stagedSizes = {}
+        self.cond = threading.Condition()
+
+    # takes in a list of sizes of the bags waiting to be staged and returns how many
+    # of them the next batch should hold, waiting for evictions until at least one fits.
+    # returns 0 if staging was stopped while waiting
+    def wait_for_room(self, sizes, stop):
+        with self.cond:
+            while not stop.is_set():
+                available = None if self.byteBudget is None else self.byteBudget - self.stagedBytes
+                count = 0
+                batchBytes = 0
+                for size in sizes[:self.batchSize]:
+                    if available is not None and batchBytes + size > available:
+                        break
+                    batchBytes += size
+                    count += 1
+                if count > 0:
+                    return count
+                if self.stagedBytes == 0:
+                    # bag is bigger than the whole budget, stage it on its own
+                    return 1
+                self.cond.wait()
+            return 0
+
+    # takes in a list of bags and a destination directory and copies them
+    # with a single rsync, returning the list of bags which made it
+    def transfer(self, batch, destDir):
+        with tracer.span('staging', bags=len(batch)):
+            rsyncCommand = ['rsync', '-a'] + batch + [destDir + os.sep]
+            start = time.perf_counter()
+            tracer.count('subprocesses')
+            try:
+                result = subprocess.run(rsyncCommand)
+                if result.returncode != 0:
+                    tracer.warn(f'rsync exited with {result.returncode} while staging {len(batch)} bags')
+            except OSError as e:
+                tracer.warn(f'Could not run rsync to stage bags ({e})')
+            self.transferSeconds += time.perf_counter() - start
+            self.transfers += 1
+            return [b for b in batch if os.path.exists(os.path.join(destDir, os.path.basename(b)))]
+
+    # takes in a list of paths to bags and yields (bag, local copy) pairs as
+    # soon as each bag has been staged. the caller must call evict() on the
+    # local copy once it's done with it
+    def stage(self, bagfileList):
+        sizes = [self.listing.get_size(bagFile) for bagFile in bagfileList]
+        runDir = tempfile.mkdtemp(prefix='bagstage_', dir=self.stageDir)
+        ready = queue.Queue()
+        stop = threading.Event()
+
+        def producer():
+            remaining = list(zip(bagfileList, sizes))
+            batchNum = 0
+            try:
+                while remaining and not stop.is_set():
+                    count = self.wait_for_room([size for _, size in remaining], stop)
+                    if count == 0:
+                        break
+                    # bags with the same filename from different dives can't share a batch directory
+                    batch = []
+                    names = set()
+                    for bagFile, size in remaining[:count]:
+                        if os.path.basename(bagFile) in names:
+                            break
+                        names.add(os.path.basename(bagFile))
+                        batch.append((bagFile, size))
+                    if self.budget.exhausted():
+                        tracer.warn(f'Run budget used up, not staging {len(remaining)} more bags')
+                        break
+                    bytesLeft = self.budget.bytes_left()
+                    while batch and bytesLeft is not None and sum(size for _, size in batch) > bytesLeft:
+                        batch.pop()
+                    if not batch:
+                        # the next bag alone needs more than the run budget has left, smaller ones may still fit
+                        bagFile, size = remaining.pop(0)
+                        tracer.warn(f'Not staging {bagFile}, it is {size / 1e6:.1f} MB and the run budget '
+                                    f'has {bytesLeft / 1e6:.1f} MB left')
+                        continue
+                    remaining = remaining[len(batch):]
+
+                    destDir = os.path.join(runDir, str(batchNum))
+                    batchNum += 1
+                    os.makedirs(destDir)
+                    with self.cond:
+                        for bagFile, size in batch:
+                            self.stagedSizes[os.path.join(destDir, os.path.basename(bagFile))] = size
+                            self.stagedBytes += size
+                        self.peakBytes = max(self.peakBytes, self.stagedBytes)
+                    copied = set(self.transfer([b for b, _ in batch], destDir))
+                    for bagFile, size in batch:
+                        localFile = os.path.join(destDir, os.path.basename(bagFile))
+                        if bagFile in copied:
+                            self.transferredBytes += size
+                            self.budget.charge(size)
+                            tracer.count('bytes read', size)
+                            ready.put((bagFile, localFile))
+                        else:
+                            self.evict(localFile)
+            finally:
+                ready.put(None)
+
+        worker = threading.Thread(target=tracer.carry_buffer(producer), name='bagstage', daemon=True)
+        worker.start()
+        try:
+            while True:
+                item = ready.get()
+                if item is None:
+                    break
+                yield item
+        finally:
+            # if the caller stopped early, let the producer finish and drop whatever it staged
+            stop.set()
+            with self.cond:
+                self.cond.notify_all()
+            worker.join()
+            for localFile in [f for f in self.stagedSizes if f.startswith(runDir + os.sep)]:
+                self.evict(localFile)
+            shutil.rmtree(runDir, ignore_errors=True)
+
+    # takes in the local copy of a staged bag, deletes it and frees its bytes from the budget
+    def evict(self, localFile):
+        if os.path.exists(localFile):
+            os.remove(localFile)
+        with self.cond:
+            self.stagedBytes -= self.stagedSizes.pop(localFile, 0)
+            self.cond.notify_all()
+
+    # prints staged bytes, transfer rate and peak staging disk usage
+    def report(self):
+        if self.transfers == 0:
+            return
+        rate = self.transferredBytes / self.transferSeconds if self.transferSeconds > 0 else 0.0
+        budget = 'none' if self.byteBudget is None else f'{self.byteBudget / 1e6:.1f} MB'
+        tracer.log(f'bag staging: {self.transferredBytes / 1e6:.1f} MB staged in {self.transfers} transfers, '
+                   f'{rate / 1e6:.1f} MB/s, peak {self.peakBytes / 1e6:.1f} MB (budget {budget})')
+
+
+# An AdaptiveBagSampler object decides how many bags to inspect per namespace. rather
+# than a fixed number of bags per dive, it keeps drawing bags from a namespace until
+# convergeK bags in a row added no new (topic, type) pair, so a namespace with a stable
+# topic set stops after a handful of bags and one whose topics vary keeps going.
+# draws go round robin over the dives, and within a dive are spread over time (bag
+# names sort by time), all in an order decided by the seed so a run can be repeated
+
+# takes in the seed, the number of bags in a row without new topics after which a
+# namespace counts as converged, optionally the RunBudget of the run, and optionally
+# the BagScanCache of earlier runs. with a budget, sampling stops when it runs out,
+# and with history the namespaces and dives earlier runs scanned least go first, so
+# a run that gets cut short spends its budget where coverage is lowest
+
+# field 'plans' is a dictionary where every key is a namespace and every value is a
+# dictionary describing how it was sampled, see sample()
+
+class AdaptiveBagSampler():
+    def __init__(self, seed=0, convergeK=3, budget=None, history=None):
+        self.seed = seed
+        self.rng = random.Random(seed)
+        self.convergeK = max(1, int(convergeK))
+        self.budget = budget if budget is not None else RunBudget()
+        self.history = history
+        self.plans = {}
+
+    # takes in a list with the bags of every dive and returns all of them in the order
+    # they should be drawn: round robin over the dives, spread over each dive
+    def order_bags(self, diveBags):
+        queues = []
+        for bags in diveBags:
+            bags = sorted(bags)
+            if not bags:
+                continue
+            offset = self.rng.randrange(len(bags))
+            queues.append([bags[(i + offset) % len(bags)] for i in spread_order(len(bags))])
+        self.rng.shuffle(queues)
+        if self.history is not None:
+            # least scanned dives first, the shuffle breaks ties
+            queues.sort(key=lambda q: self.history.count_under(os.path.dirname(q[0])))
+        order = []
+        for i in range(max((len(q) for q in queues), default=0)):
+            order.extend(q[i] for q in queues if i < len(q))
+        return order
+
+    # takes in a dictionary where every key is a namespace and every value is a list
+    # with the bags of every dive for that namespace, and a BagScanPool to inspect bags
+    # with. returns a dictionary of namespace -> list of sampled bags, in draw order
+
+    # every round draws the next bag of every namespace that hasn't converged yet, so
+    # the pool always has a bag per namespace to work on
+    def sample(self, namespaceDiveBags, pool):
+        states = {}
+        for namespace, diveBags in namespaceDiveBags.items():
+            order = self.order_bags(diveBags)
+            states[namespace] = {'order': order, 'next': 0, 'sampled': [], 'incidence': {},
+                                 'readable': 0, 'streak': 0,
+                                 'dives': sum(1 for bags in diveBags if bags), 'bags': len(order)}
+        active = [n for n in states if states[n]['order']]
+        if self.history is not None:
+            # namespaces with the smallest share of bags ever scanned first
+            def scannedShare(namespace):
+                order = states[namespace]['order']
+                return sum(1 for bag in order if self.history.has(bag)) / len(order)
+            active.sort(key=scannedShare)
+        while active:
+            if self.budget.exhausted():
+                break
+            draws = {}
+            for namespace in active:
+                state = states[namespace]
+                draws[namespace] = state['order'][state['next']]
+                state['next'] += 1
+            results = pool.scan(list(dict.fromkeys(draws.values())))
+            for namespace, bag in draws.items():
+                state = states[namespace]
+                state['sampled'].append(bag)
+                records = results.get(bag)
+                # a bag whose index can't be read tells us nothing yet (it goes to the
+                # rosbag info fallback later), so it neither resets nor extends the streak
+                if records is None:
+                    continue
+                state['readable'] += 1
+                new = False
+                for record in records:
+                    pair = (record[0], record[1])
+                    if pair not in state['incidence']:
+                        new = True
+                    state['incidence'][pair] = state['incidence'].get(pair, 0) + 1
+                state['streak'] = 0 if new else state['streak'] + 1
+            active = [n for n in active
+                      if states[n]['streak'] < self.convergeK and states[n]['next'] < len(states[n]['order'])]
+
+        sampled = {}
+        for namespace, state in states.items():
+            self.plans[namespace] = self.make_plan(state)
+            sampled[namespace] = state['sampled']
+        return sampled
+
+    # takes in the sampling state of a namespace and returns its plan: how many bags and
+    # dives there were and were sampled, the topics found, why sampling stopped, and the
+    # estimated coverage 1 - f1/n, where f1 is the number of topics seen in exactly one
+    # sampled bag and n the number of sampled bags (Good-Turing)
+    def make_plan(self, state):
+        singletons = sum(1 for count in state['incidence'].values() if count == 1)
+        readable = state['readable']
+        coverage = max(0.0, 1.0 - singletons / readable) if readable else 0.0
+        divesSampled = len({os.path.dirname(bag) for bag in state['sampled']})
+        return {'bags': state['bags'], 'sampled': len(state['sampled']), 'dives': state['dives'],
+                'divesSampled': divesSampled, 'topics': len(state['incidence']),
+                'converged': state['streak'] >= self.convergeK,
+                'exhausted': state['next'] >= len(state['order']), 'coverage': coverage}
+
+    def get_plans(self):
+        return self.plans
+
+    def report(self):
+        tracer.log(f'sampling plan (seed {self.seed}, converge after {self.convergeK} bags without new topics):')
+        for namespace, plan in self.plans.items():
+            if plan['converged']:
+                reason = 'converged'
+            elif plan['exhausted']:
+                reason = 'ran out of bags'
+            else:
+                reason = 'stopped by the run budget'
+            tracer.log(f"  {namespace}: {plan['sampled']} of {plan['bags']} bags from {plan['divesSampled']} of "
+                       f"{plan['dives']} dives, {plan['topics']} topics, {reason}, "
+                       f"estimated coverage {plan['coverage']:.0%}")
+
+
+# this function takes in the lines of 'rosbag info' output (i.e. a pipe from the
+# process) and yields one (topic, type, md5sum, message count, connection count)
+# tuple per topic, the same records RosbagIndexReader.get_topics returns.
+# each line is looked at once, so it runs in linear time in the size of the output
+
+# output looks like
+# types:       geometry_msgs/Vector3 [4a842b65f413084dc2b10fb484ea7f17]
+# topics:      /jason/nav/foo    123 msgs    : geometry_msgs/Vector3
+#              /jason/nav/bar      1 msg     : std_msgs/Header        (2 connections)
+# a topic recorded with more than one type gets the extra types on lines of their own
+def parse_rosbag_info(lines):
+    section = None
+    md5sums = {}
+    lastTopic = None
+    for line in lines:
+        if not line.strip():
+            continue
+        # unindented lines start a new 'key: value' section,
+        # indented lines continue the current one
+        if not line[0].isspace():
+            key, sep, rest = line.partition(':')
+            if not sep:
+                section = None
+                continue
+            section = key.strip()
+        else:
+            rest = line
+        tokens = rest.split()
+        if not tokens:
+            continue
+
+        if section == 'types':
+            # name [md5sum]
+            if len(tokens) >= 2:
+                md5sums[tokens[0]] = tokens[1].strip('[]')
+        elif section == 'topics':
+            if ':' not in tokens:
+                # extra type for the previous topic
+                if lastTopic is not None and len(tokens) == 1:
+                    topic, count, connections = lastTopic
+                    yield (topic, tokens[0], md5sums.get(tokens[0], ''), count, connections)
+                continue
+            colon = tokens.index(':')
+            if colon < 2 or colon + 1 >= len(tokens):
+                continue
+            topic = tokens[0]
+            try:
+                count = int(tokens[1])
+            except ValueError:
+                continue
+            type = tokens[colon + 1]
+            connections = 1
+            if colon + 2 < len(tokens) and tokens[colon + 2].startswith('('):
+                try:
+                    connections = int(tokens[colon + 2][1:])
+                except ValueError:
+                    pass
+            lastTopic = (topic, count, connections)
+            yield (topic, type, md5sums.get(type, ''), count, connections)
+
+
+# A TopicEntry object is one (topic, type) pair of a TopicCatalog, along with the
+# md5sum of the type (None if unknown) and the bags the pair was seen in. entries have
+# __slots__ since a run keeps one per pair per namespace of every vehicle, and the bags
+# are kept as the keys of a dictionary rather than a set. the bags are most of what a
+# catalog holds, and with topics seen in thousands of bags each, bench/bench_memory.py
+# --bags 20000 --topics 60 has the catalogs take 23.8 MB this way against 116.5 MB
+# with sets. with only a few bags per topic the difference is much smaller
+
+class TopicEntry():
+    __slots__ = ('topic', 'type', 'md5sum', 'bags')
+
+    def __init__(self, topic, type, md5sum=None):
+        self.topic = topic
+        self.type = type
+        self.md5sum = md5sum
+        self.bags = {}
+
+
+# A TopicCatalog object is the set of (topic, type) pairs seen for a namespace,
+# along with which bags each pair came from. topic, type and md5sum strings are
+# interned in the symbol table so the many repeats of the same topic across bags
+# share one string, and pairs are kept in a dictionary so adding a pair is O(1) no
+# matter how big the catalog gets. pairs keep the order they were first added in,
+# which is the order rows get exported in
+
+# field 'pairs' is a dictionary where every key is a (topic, type) tuple and every
+# value is the TopicEntry for that pair
+
+class TopicCatalog():
+    def __init__(self):
+        self.pairs = {}
+
+    def __len__(self):
+        return len(self.pairs)
+
+    def __contains__(self, pair):
+        return pair in self.pairs
+
+    # takes in a topic, a type and optionally the bag they came from and the md5sum of
+    # the type and adds them, returns True if the (topic, type) pair wasn't in the catalog yet
+    def add(self, topic, type, bag=None, md5sum=None):
+        key = (topic, type)
+        entry = self.pairs.get(key)
+        isNew = entry is None
+        if isNew:
+            entry = TopicEntry(symbols.intern(topic), symbols.intern(type))
+            self.pairs[(entry.topic, entry.type)] = entry
+        if bag is not None:
+            entry.bags[bag] = None
+        if md5sum:
+            entry.md5sum = symbols.intern(md5sum)
+        return isNew
+
+    # takes in another TopicCatalog and adds all its pairs and bags to this one,
+    # returns the number of pairs which were new
+    def update(self, other):
+        newPairs = 0
+        for key, entry in other.pairs.items():
+            if self.add(entry.topic, entry.type, md5sum=entry.md5sum):
+                newPairs += 1
+            self.pairs[key].bags.update(entry.bags)
+        return newPairs
+
+    # returns a list of (topic, type) tuples
+    def get_pairs(self):
+        return list(self.pairs)
+
+    # takes in a topic and type and returns the bags they were seen in, as a set-like view
+    def get_bags(self, topic, type):
+        entry = self.pairs.get((topic, type))
+        return entry.bags.keys() if entry is not None else {}.keys()
+
+    # takes in a topic and type and returns the md5sum of the type, or None if unknown
+    def get_md5sum(self, topic, type):
+        entry = self.pairs.get((topic, type))
+        return entry.md5sum if entry is not None else None
+
+    # returns a pandas dataframe object with columns of topics and types,
+    # the shape NamespaceTopics has always handed out
+    def to_df(self):
+        return pd.DataFrame({'Topics': [p[0] for p in self.pairs], 'Types': [p[1] for p in self.pairs]})
+
+    # takes in a path and writes the catalog to it as a .csv master list
+    def to_csv(self, csvPath):
+        with open(csvPath, 'w', newline='') as csvfile:
+            writer = csv.writer(csvfile)
+            writer.writerow(['Topics', 'Types'])
+            writer.writerows(self.pairs)
+
+    # takes in a path to a .csv master list and returns a TopicCatalog with its pairs
+    @classmethod
+    def from_csv(cls, csvPath):
+        catalog = cls()
+        with open(csvPath, 'r', newline='') as csvfile:
+            reader = csv.reader(csvfile)
+            next(reader, None)
+            for row in reader:
+                if len(row) >= 2:
+                    catalog.add(row[0], row[1])
+        return catalog
+
+
+# A TopicStore object is the master list of topics and types kept in an sqlite database,
+# one row per (vehicle, namespace, topic, type) recording the md5sum of the type, the
+# first and last bag the pair was seen in, and the dive and cruise of that first bag.
+# rows are upserted, so recording a run only touches the pairs that run found, however
+# many cruises the catalog already holds. first and last are by bag path, which with
+# the year/cruise/dive/namespace_time.bag layout of the archive is the order they were
+# recorded in. rows come back in the order they were first added, the order the .csv
+# master lists have always had
+
+# next to the topics, the catalog keeps an inverted index of every bag each
+# (topic, type) pair was seen in, along with the dive, cruise and year of the bag,
+# so which dives or cruises carried a topic is answered without opening any bag
+
+# takes in a path to the database, which gets created if it doesn't exist yet
+
+class TopicStore():
+    def __init__(self, dbPath):
+        self.path = dbPath
+        dbDir = os.path.dirname(dbPath)
+        if dbDir:
+            os.makedirs(dbDir, exist_ok=True)
+        self.conn = sqlite3.connect(dbPath)
+        self.create_tables()
+
+    # returns the path of the topic catalog for a vehicle, which lives in
+    # dsros_python/vehiclename next to the .csv master lists
+    @staticmethod
+    def default_path(vehicleName):
+        return os.path.join('dsros_python', vehicleName, 'catalog.sqlite')
+
+    def create_tables(self):
+        with self.conn:
+            self.conn.execute('''CREATE TABLE IF NOT EXISTS topics (
+                vehicle TEXT NOT NULL,
+                namespace TEXT NOT NULL,
+                topic TEXT NOT NULL,
+                type TEXT NOT NULL,
+                md5sum TEXT,
+                first_seen_bag TEXT,
+                last_seen_bag TEXT,
+                dive TEXT,
+                cruise TEXT,
+                PRIMARY KEY (vehicle, namespace, topic, type))''')
+            self.conn.execute('CREATE INDEX IF NOT EXISTS topics_by_type ON topics (type)')
+            self.conn.execute('''CREATE TABLE IF NOT EXISTS sightings (
+                vehicle TEXT NOT NULL,
+                topic TEXT NOT NULL,
+                type TEXT NOT NULL,
+                bag TEXT NOT NULL,
+                namespace TEXT NOT NULL,
+                dive TEXT,
+                cruise TEXT,
+                year INTEGER,
+                PRIMARY KEY (topic, type, vehicle, bag)) WITHOUT ROWID''')
+            self.conn.execute('CREATE INDEX IF NOT EXISTS sightings_by_dive ON sightings (dive)')
+
+    # takes in a vehicle and a namespace and returns True if the catalog has any rows for them
+    def has_namespace(self, vehicle, namespace):
+        row = self.conn.execute('SELECT 1 FROM topics WHERE vehicle = ? AND namespace = ? LIMIT 1',
+                                (vehicle, namespace)).fetchone()
+        return row is not None
+
+    # takes in a vehicle, a namespace, a topic and a type and returns True if the
+    # catalog has a row for them
+    def has_pair(self, vehicle, namespace, topic, type):
+        row = self.conn.execute('''SELECT 1 FROM topics WHERE vehicle = ? AND namespace = ?
+                                   AND topic = ? AND type = ?''', (vehicle, namespace, topic, type)).fetchone()
+        return row is not None
+
+    # takes in a vehicle and returns the namespaces the catalog has rows for
+    def get_namespaces(self, vehicle):
+        rows = self.conn.execute('SELECT DISTINCT namespace FROM topics WHERE vehicle = ? ORDER BY namespace',
+                                 (vehicle,))
+        return [row[0] for row in rows]
+
+    # takes in a vehicle, a namespace, a TopicCatalog and a function which takes in a bag
+    # and returns its (dive, cruise, year), and upserts a row for every pair in the catalog
+    # and a sighting for every bag of every pair. returns the number of rows written
+    def upsert(self, vehicle, namespace, catalog, locateBag):
+        rows = []
+        sightings = []
+        locations = {}
+        for topic, type in catalog.get_pairs():
+            bags = catalog.get_bags(topic, type)
+            for bag in bags:
+                if bag not in locations:
+                    locations[bag] = locateBag(bag)
+                sightings.append((vehicle, topic, type, bag, namespace) + locations[bag])
+            firstBag = min(bags) if bags else None
+            lastBag = max(bags) if bags else None
+            dive, cruise, year = locations[firstBag] if firstBag else (None, None, None)
+            rows.append((vehicle, namespace, topic, type, catalog.get_md5sum(topic, type),
+                         firstBag, lastBag, dive, cruise))
+        # every SET expression sees the row as it was before the update
+        with self.conn:
+            self.conn.executemany('''INSERT INTO topics
+                (vehicle, namespace, topic, type, md5sum, first_seen_bag, last_seen_bag, dive, cruise)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+                ON CONFLICT (vehicle, namespace, topic, type) DO UPDATE SET
+                    md5sum = coalesce(excluded.md5sum, md5sum),
+                    first_seen_bag = CASE WHEN first_seen_bag IS NULL OR excluded.first_seen_bag < first_seen_bag
+                                     THEN excluded.first_seen_bag ELSE first_seen_bag END,
+                    dive = CASE WHEN first_seen_bag IS NULL OR excluded.first_seen_bag < first_seen_bag
+                           THEN excluded.dive ELSE dive END,
+                    cruise = CASE WHEN first_seen_bag IS NULL OR excluded.first_seen_bag < first_seen_bag
+                             THEN excluded.cruise ELSE cruise END,
+                    last_seen_bag = CASE WHEN last_seen_bag IS NULL OR excluded.last_seen_bag > last_seen_bag
+                                    THEN excluded.last_seen_bag ELSE last_seen_bag END''', rows)
+            self.conn.executemany('''INSERT OR IGNORE INTO sightings
+                (vehicle, topic, type, bag, namespace, dive, cruise, year) VALUES (?, ?, ?, ?, ?, ?, ?, ?)''', sightings)
+        tracer.count('catalog rows upserted', len(rows))
+        return len(rows)
+
+    # takes in a topic (leading '/' optional, may hold * and ? wildcards) and optionally
+    # a type, a vehicle, a year and a cruise to narrow it down, and returns the sorted
+    # distinct values of column 'by' ('bags', 'dives' or 'cruises') the topic was seen in
+    def find(self, topic, type=None, vehicle=None, year=None, cruise=None, by='dives'):
+        column = {'bags': 'bag', 'dives': 'dive', 'cruises': 'cruise'}[by]
+        topic = topic.lstrip('/')
+        conditions = ['topic GLOB ?' if any(c in topic for c in '*?[') else 'topic = ?']
+        params = [topic]
+        for name, value in (('type', type), ('vehicle', vehicle), ('year', year)):
+            if value is not None:
+                conditions.append(f'{name} = ?')
+                params.append(value)
+        if cruise is not None:
+            conditions.append('cruise GLOB ?')
+            params.append(f'*{cruise}*')
+        rows = self.conn.execute(f'''SELECT DISTINCT {column} FROM sightings WHERE {' AND '.join(conditions)}
+                                     AND {column} IS NOT NULL ORDER BY {column}''', params)
+        return [row[0] for row in rows]
+
+    # takes in a vehicle, a namespace and a path to a .csv master list and adds its
+    # pairs to the catalog (with nothing known about where they were seen)
+    def import_csv(self, vehicle, namespace, csvPath):
+        catalog = TopicCatalog.from_csv(csvPath)
+        with self.conn:
+            self.conn.executemany('INSERT OR IGNORE INTO topics (vehicle, namespace, topic, type) VALUES (?, ?, ?, ?)',
+                                  [(vehicle, namespace, topic, type) for topic, type in catalog.get_pairs()])
+        return len(catalog)
+
+    # takes in a vehicle and a namespace and returns a TopicCatalog with their rows,
+    # with each pair's first and last seen bags
+    def get_catalog(self, vehicle, namespace):
+        catalog = TopicCatalog()
+        rows = self.conn.execute('''SELECT topic, type, md5sum, first_seen_bag, last_seen_bag FROM topics
+                                    WHERE vehicle = ? AND namespace = ? ORDER BY rowid''', (vehicle, namespace))
+        for topic, type, md5sum, firstBag, lastBag in rows:
+            catalog.add(topic, type, firstBag, md5sum)
+            if lastBag:
+                catalog.add(topic, type, lastBag)
+        return catalog
+
+    # takes in a vehicle, a namespace and a path and writes their rows to it
+    # as a .csv master list
+    def export_csv(self, vehicle, namespace, csvPath):
+        csvDir = os.path.dirname(csvPath)
+        if csvDir:
+            os.makedirs(csvDir, exist_ok=True)
+        catalog = self.get_catalog(vehicle, namespace)
+        catalog.to_csv(csvPath)
+        return len(catalog)
+
+    def close(self):
+        self.conn.close()
+
+
+# A NamespaceTopics object represents a comprehensive list of rostopics for a
 # specific namespace for a given vehicle
 
-# takes in a vehicle name and list of bagfiles for a certain namespace
+# takes in a vehicle name and list of bagfiles for a certain namespace, and optionally
+# the BagScanPool to inspect them with (bags already inspected by the pool aren't
+# read again) and the BagStager to copy bags with when their index can't be read
 
 # field 'name' is name of vehicle
-# field 'df' is a pandas dataframe object with columns 
-# of topics and types 
+# field 'catalog' is a TopicCatalog with the topics and types found in the bagfiles
+# field 'df' is a pandas dataframe object with columns
+# of topics and types
 
-# gets called while initializing the bag field of a BagStructDefs object 
+# gets called while initializing the bag field of a BagStructDefs object
 
 class NamespaceTopics():
-    def __init__(self, vehicle, bagfiles):
+    def __init__(self, vehicle, bagfiles, pool=None, stager=None):
         self.name = vehicle
+        self.pool = pool if pool is not None else BagScanPool()
+        self.stager = stager if stager is not None else BagStager()
         # importantly, the bagfiles parameter is a list of paths to rosbag files for dives across cruises
         # for a particular namespace
         totalSize = 0
         for b in bagfiles:
-            print(os.path.getsize(b))
-            totalSize += os.path.getsize(b)
-        print('total bagfile size is ' + str(totalSize))
-
-        self.df = self.convert_rosbaginfo_to_masterDf(bagfiles)
-
-    # this function takes in the lists of topics and types of a namespace for a vehicle
-    # and converts them into a pandas dataframe object 
+            bagSize = self.pool.get_listing().get_size(b)
+            tracer.log(f'{b}: {bagSize} bytes', 2)
+            totalSize += bagSize
+        tracer.log('total bagfile size is ' + str(totalSize), 2)
+
+        self.catalog = self.build_catalog(bagfiles)
+        self.df = self.catalog.to_df()
+
+    # topics get stored starting from the vehicle name, i.e. '/jason/nav/foo'
+    # becomes 'jason/nav/foo', which is what has always been put in the
+    # .csv files. returns None for topics which don't include the vehicle name
+    def normalize_topic(self, topic):
+        start = topic.find(self.name)
+        if start < 0:
+            return None
+        return topic[start:].strip()
 
-    def generate_df(self, types, topics):
-        df = pd.DataFrame({'Topics': topics, 'Types': types})
-        return df
-    
-    # to do: 
-
-    # some topics don't include name of vehicle 
-    # i.e. topics in the globals namespace. the current parsing algorithm 
-    # will then encounter a value error as there will be more topic types 
-    # than topics, meaning generate_df will not be able to create a dataframe
-    # since list objects are of different lengths
-    # current fix is omitting globals namespace, but could also switch 
-    # patternTopics to be patternTopicsNameOptional (though this switch is untested)
-
-    # this function takes in contents of a txt file which is the result 
-    # of running rosbag info on a bag file,
-    # and parses out the types and topics as lists, returning two lists
-
-    def parse_txt_file(self, contents):
-
-        # Get section from file that contains topic and topic type info
-        start_index = contents.find('topics:') + len('topics:')
-        relevantSection = contents[start_index:]
-
-        # Extract topics
-        patternTopics = r'' + self.name + r'(?:(?!\d+\s*msg[s]?).)*?(?=\d+\s*msg[s]?)'
-        patternTopicsNameOptional = r'(?:(?:' + self.name + r')?.*?(?=\d+\s*msg[s]?))'
-        topics = re.findall(patternTopics, relevantSection)
-        topics = [topic.strip() for topic in topics if topic.strip()]
-
-        # Extract types 
-        patternTypes =r'(?<=:\s)(.*)(?=\n)'
-        types = re.findall(patternTypes, relevantSection)
-        types = [re.sub(r'\s*\(\d+\s*connection(?:s)?\)', '', type.strip()) for type in types if type.strip()]
-        
-        
-        return types, topics
-    
-     
     # this function takes in a list of paths to .bag files for a certain namespace
-    # and returns a pandas dataframe object which consists of all the types and topics
-    # from the .bag files (with duplicates removed)
+    # and returns a TopicCatalog which holds all the types and topics from the
+    # .bag files (with duplicates removed) and which bags they came from
+
+    # the bag index is read directly where possible. bags whose index can't be read
+    # (i.e. unindexed bags) fall back to rsync and rosbag info
+    def build_catalog(self, bagfileList):
+            catalog = TopicCatalog()
+            fallbackBagfiles = []
+            scanned = self.pool.scan(bagfileList)
+            for bagFile, records in scanned.items():
+                if records is None:
+                    fallbackBagfiles.append(bagFile)
+                    continue
+                self.add_records(catalog, bagFile, records)
+
+            if fallbackBagfiles:
+                self.add_rosbaginfo_fallback(catalog, fallbackBagfiles)
+            return catalog
+
+    # this function takes in a catalog, a bag and the records read from it,
+    # and adds the topics which belong to this vehicle to the catalog
+    def add_records(self, catalog, bagFile, records):
+        for topic, type, md5sum, msgCount, connCount in records:
+            normalized = self.normalize_topic(topic)
+            if normalized is not None:
+                catalog.add(normalized, type, bagFile, md5sum)
+
+    # this function takes in a path to a local .bag file and returns the topic records
+    # from running rosbag info on it, parsing the output straight from the pipe.
+    # returns None if rosbag info can't be run (i.e. no ROS install) or fails on the bag
+    def run_rosbag_info(self, bagFile):
+        with tracer.span('rosbag info', bag=bagFile):
+            command = ['rosbag', 'info', bagFile]
+            tracer.count('subprocesses')
+            try:
+                with subprocess.Popen(command, stdout=subprocess.PIPE, text=True) as proc:
+                    records = list(parse_rosbag_info(proc.stdout))
+            except OSError as e:
+                tracer.warn(f'Could not run rosbag info on {bagFile} ({e}), skipping it')
+                return None
+            if proc.returncode != 0:
+                tracer.warn(f'rosbag info exited with {proc.returncode} on {bagFile}, skipping it')
+                return None
+            return records
+
+    # this function takes in a catalog and a list of paths to .bag files, copies the bags
+    # locally and runs rosbag info on them, adding their topics and types to the catalog.
+    # the records are handed back to the pool so they get cached like index reads.
+    # bags rosbag info fails on are left out and not cached, so a later run tries them again
+    def add_rosbaginfo_fallback(self, catalog, bagfileList):
+            # rsync is used because performing ros operations
+            # is faster on local files than on vast
+            for bagFile, localFile in self.stager.stage(bagfileList):
+                try:
+                    records = self.run_rosbag_info(localFile)
+                finally:
+                    self.stager.evict(localFile)
+                if records is None:
+                    continue
+                # 'empty' rosbags have no topics, no need to remember them
+                if records:
+                    self.pool.record(bagFile, records)
+                self.add_records(catalog, bagFile, records)
 
-    def convert_rosbaginfo_to_masterDf(self, bagfileList):
-            masterDf = pd.DataFrame()
-            txt_files = []
-            root_dir = os.path.expanduser("~")
-            tempDir = '/tmp'
-            bagfileListLocal = []
-            for bagFile in bagfileList:
-                # rsync is used because performing ros operations 
-                # is faster on local files than on vast
-                rsyncCommand = ['rsync', '-av', bagFile, tempDir]
-                subprocess.run(rsyncCommand)
-                filename = os.path.basename(bagFile)
-                copiedFilePath = os.path.join(tempDir, filename)
-                bagfileListLocal.append(copiedFilePath)
-                print('this is bagfile that just got copied ')
-                print(bagFile)
-
-
-            # for every bagfile for a certain namespace
-            for bagFile in bagfileListLocal:
-                # create a temporary file called temp_file
-                with tempfile.NamedTemporaryFile(prefix='bag_txtfile_', mode='w', delete=False) as temp_file:
-                    # append the path to that temp_file txt_files list 
-                    txt_files.append(temp_file.name)
-                    # command is rosbag info <bagfile> 
-                    command = ['rosbag', 'info', bagFile]
-                    with open(temp_file.name, 'r+') as file:
-                        subprocess.run(command, stdout=file)
-                        file.seek(0)
-                        content = file.read()
-                        # filter out 'empty' rosbags 
-                        if 'topics:' in content:
-                            # create a dataframe for this .txtfile, add it to masterDf, and then close file
-                            types, topics = self.parse_txt_file(content)
-                            curDf = self.generate_df(types, topics)
-                            masterDf = pd.concat([masterDf, curDf])
-        
-            # remove temporary .txt files and rsynced bagfiles 
-            for f in txt_files:
-                os.remove(f)
-            for b in bagfileListLocal:
-                 if os.path.exists(b):
-                    os.remove(b)
-
-            masterDf.drop_duplicates(inplace=True)
-            return masterDf
-   
     def get_df(self):
         return self.df
 
+    def get_catalog(self):
+        return self.catalog
+
+
+
+# takes in a size string such as '500M', '20G' or '1048576' and returns
+# the number of bytes it represents
+def parse_size(sizeString):
+    units = {'K': 1024, 'M': 1024 ** 2, 'G': 1024 ** 3, 'T': 1024 ** 4}
+    sizeString = str(sizeString).strip().upper().rstrip('B')
+    if sizeString and sizeString[-1] in units:
+        return int(float(sizeString[:-1]) * units[sizeString[-1]])
+    return int(sizeString)
+
+# takes in a duration string, i.e. '90', '45s', '30m' or '2h' and returns it in seconds
+def parse_duration(durationString):
+    units = {'S': 1, 'M': 60, 'H': 3600}
+    durationString = str(durationString).strip().upper()
+    if durationString and durationString[-1] in units:
+        return float(durationString[:-1]) * units[durationString[-1]]
+    return float(durationString)
+
+
+# A RunBudget object keeps track of how much wall clock time and how many bytes pulled
+# from the data server a run has used, so long running stages can check it and stop
+# cleanly once either runs out. the clock starts when the budget is made
+
+# takes in the most seconds and the most bytes the run may use, None for no limit
+
+class RunBudget():
+    def __init__(self, timeBudget=None, byteBudget=None):
+        self.timeBudget = timeBudget
+        self.byteBudget = byteBudget
+        self.start = time.monotonic()
+        self.bytesUsed = 0
+        self.stoppedBy = None
+        self.lock = threading.Lock()
+
+    # returns True if there is a time or byte budget at all
+    def is_limited(self):
+        return self.timeBudget is not None or self.byteBudget is not None
+
+    def elapsed(self):
+        return time.monotonic() - self.start
+
+    # takes in a number of bytes read from the data server and counts them against the budget
+    def charge(self, numBytes):
+        with self.lock:
+            self.bytesUsed += numBytes
+
+    # returns how many more bytes may be read, None if there is no byte budget
+    def bytes_left(self):
+        if self.byteBudget is None:
+            return None
+        with self.lock:
+            return max(0, self.byteBudget - self.bytesUsed)
+
+    # returns True once the time or byte budget has run out, remembering which one did
+    def exhausted(self):
+        with self.lock:
+            if self.timeBudget is not None and self.elapsed() >= self.timeBudget:
+                self.stoppedBy = self.stoppedBy or 'time'
+            elif self.byteBudget is not None and self.bytesUsed >= self.byteBudget:
+                self.stoppedBy = self.stoppedBy or 'bytes'
+            return self.stoppedBy is not None
+
+    def report(self):
+        if not self.is_limited():
+            return
+        timeBudget = 'none' if self.timeBudget is None else f'{self.timeBudget:.0f}s'
+        byteBudget = 'none' if self.byteBudget is None else f'{self.byteBudget / 1e6:.1f} MB'
+        stopped = f', stopped early on the {self.stoppedBy} budget' if self.stoppedBy else ''
+        with self.lock:
+            bytesUsed = self.bytesUsed
+        tracer.log(f'run budget: {self.elapsed():.1f}s used (budget {timeBudget}), '
+                   f'{bytesUsed / 1e6:.1f} MB read (budget {byteBudget}){stopped}')
+
+
+# A RunConfig object holds the options which control how a run scans and
+# generates defs, so they don't all have to be threaded through as separate
+# parameters. defaults match what the script has always done
+
+# field 'jobs' is the number of bags to inspect in parallel
+
+# field 'stageDir' is the directory bags get copied into when they need to be local
+
+# field 'stageBudget' is the most bytes which can be staged at once, None for no limit
+
+# fields 'msgRoots' and 'customMsgRoots' are the lists of common (ROS share) and custom
+# (vehicle workspace) directories to look for .msg definitions under, None for the
+# defaults of the vehicle (see MsgRegistry)
+
+# fields 'sampleArrays', 'sampleMessages', 'sampleBytes' and 'sampleMaxLength' control
+# sizing unsized arrays from bag messages (see RosbagArraySampler)
+
+# field 'interactive' is False if nobody is around to answer prompts, and
+# 'specialTypesPath' is the special type rules file, None for the default
+
+# fields 'seed' and 'convergeK' control which bags get sampled (see AdaptiveBagSampler)
+
+# field 'everyCruise' is True if cumulative mode should look at every cruise rather
+# than a sample of them (see RosbagDiveData)
+
+# field 'budget' is the RunBudget for the run, limited by 'timeBudget' seconds and
+# 'byteBudget' bytes (None for no limit)
+
+class RunConfig():
+    def __init__(self, jobs=1, stageDir='/tmp', stageBudget=None, msgRoots=None, customMsgRoots=None,
+                 sampleArrays=False, sampleMessages=50, sampleBytes=16 * 1024 ** 2, sampleMaxLength=64,
+                 interactive=True, specialTypesPath=None, seed=0, convergeK=3,
+                 timeBudget=None, byteBudget=None, everyCruise=False):
+        self.jobs = jobs
+        self.stageDir = stageDir
+        self.stageBudget = stageBudget
+        self.msgRoots = msgRoots
+        self.customMsgRoots = customMsgRoots
+        self.sampleArrays = sampleArrays
+        self.sampleMessages = sampleMessages
+        self.sampleBytes = sampleBytes
+        self.sampleMaxLength = sampleMaxLength
+        self.interactive = interactive
+        self.specialTypesPath = specialTypesPath
+        self.seed = seed
+        self.convergeK = convergeK
+        self.everyCruise = everyCruise
+        self.timeBudget = timeBudget
+        self.byteBudget = byteBudget
+        self.budget = RunBudget(timeBudget, byteBudget)
+
+    # takes in parsed command line arguments and returns a RunConfig
+    @classmethod
+    def from_args(cls, args):
+        stageBudget = parse_size(args.stage_budget) if args.stage_budget else None
+        return cls(jobs=args.jobs, stageDir=args.stage_dir, stageBudget=stageBudget,
+                   msgRoots=args.msg_root, customMsgRoots=args.custom_msg_root, sampleArrays=args.sample_arrays,
+                   sampleMessages=args.sample_messages, sampleBytes=parse_size(args.sample_bytes),
+                   sampleMaxLength=args.sample_max_length, interactive=not args.non_interactive,
+                   specialTypesPath=args.special_types, seed=args.seed, convergeK=args.converge_k,
+                   timeBudget=parse_duration(args.time_budget) if args.time_budget else None,
+                   byteBudget=parse_size(args.byte_budget) if args.byte_budget else None,
+                   everyCruise=args.every_cruise)
+
+
+# A SharedWork object holds what the vehicles of a multi vehicle run share, so work
+# one vehicle already did isn't done again for the next: one executor every vehicle's
+# bags get inspected on, the message roots scanned so far, and the .msg files read
+# so far (keyed by path, so vehicles only share the ones they resolve to the same file)
+
+# takes in the number of jobs (worker threads) to inspect bags with across all vehicles
+
+# field 'rootIndexes' is a dictionary where every key is a message root and every
+# value is the index MsgRegistry.scan_root built for it
+
+class SharedWork():
+    def __init__(self, jobs=1):
+        self.executor = None
+        if jobs > 1:
+            self.executor = concurrent.futures.ThreadPoolExecutor(max_workers=jobs, thread_name_prefix='bagscan')
+        self.rootIndexes = {}
+        self.rootLocks = {}
+        self.msgFileMemo = TypeMemo('msg files')
+        self.lock = threading.Lock()
+
+    # takes in a message root and a function which scans a root and returns its index,
+    # and returns the index of the root, scanning it only the first time. a vehicle
+    # asking for a root another vehicle is scanning waits for that scan
+    def get_rootIndex(self, root, scanRoot):
+        with self.lock:
+            rootLock = self.rootLocks.setdefault(root, threading.Lock())
+        with rootLock:
+            if root not in self.rootIndexes:
+                self.rootIndexes[root] = scanRoot(root)
+            return self.rootIndexes[root]
+
+    def shutdown(self):
+        if self.executor is not None:
+            self.executor.shutdown(wait=True)
+            self.executor = None
+
+
+# A MsgRegistry object is an in-memory index of every .msg definition under a set
+# of message roots, built by walking the roots once. resolving a 'package/Type'
+# is then a dictionary lookup instead of a filesystem probe per candidate path
+
+# takes in a list of common roots (ROS share directories, i.e. /opt/ros/noetic/share)
+# and a list of custom roots (vehicle workspaces, i.e. ~/ros/jason_ws/src/ds_msgs).
+# a root is any directory with packages beneath it that hold a msg/ directory, and
+# within each group the first root holding a type wins. the groups are kept apart
+# because every lookup has always had its own order:
+#   find                struct types, common roots first then custom
+#   find_common         types a .msg def names without a package (i.e. 'Vector3'
+#                       inside geometry_msgs), common roots only
+#   find_custom_first   nested field types, custom roots first then common
+# optionally takes in the SharedWork of a multi vehicle run, which roots are only
+# scanned once for. only the root indexes are shared, every vehicle has a registry
+# of its own, so the lookup counters are per vehicle and only its thread updates them
+
+# fields 'commonIndex' and 'customIndex' are dictionaries where every key is
+# 'package/Type' and every value is the absolute path to that type's .msg file
+# under the common and custom roots
+
+class MsgRegistry():
+    # how far below a root to look for package msg/ directories
+    MAX_DEPTH = 3
+
+    def __init__(self, roots, customRoots=(), shared=None):
+        self.roots = list(roots)
+        self.customRoots = list(customRoots)
+        self.shared = shared
+        self.commonIndex = {}
+        self.customIndex = {}
+        self.lookups = 0
+        self.hits = 0
+        self.misses = 0
+        self.dirsScanned = 0
+        for root in self.roots:
+            self.index_root(root, self.commonIndex)
+        for root in self.customRoots:
+            self.index_root(root, self.customIndex)
+
+    # returns the default common roots for a vehicle, the ROS noetic share directory
+    @staticmethod
+    def default_roots(vehicleName):
+        return [os.path.join('/opt', 'ros', 'noetic', 'share')]
+
+    # returns the default custom roots for a vehicle, its ds_msgs workspace
+    @staticmethod
+    def default_customRoots(vehicleName):
+        rootDir = os.path.expanduser('~')
+        return [os.path.join(rootDir, 'ros', f'{vehicleName}_ws', 'src', 'ds_msgs')]
+
+    # takes in a root directory and an index and adds every package/msg/Type.msg beneath
+    # the root to it, roots already scanned for another vehicle of the run aren't scanned again
+    def index_root(self, root, index):
+        if self.shared is not None:
+            rootIndex = self.shared.get_rootIndex(root, self.scan_root)
+        else:
+            rootIndex = self.scan_root(root)
+        for miniPath, msgPath in rootIndex.items():
+            index.setdefault(miniPath, msgPath)
+
+    # takes in a root directory and returns a dictionary where every key is a
+    # 'package/Type' beneath it and every value is the path to its .msg file
+    def scan_root(self, root):
+        rootIndex = {}
+        with tracer.span('msg resolution', root=root):
+            stack = [(root, 0)]
+            while stack:
+                dirPath, depth = stack.pop()
+                try:
+                    entries = sorted((e for e in os.scandir(dirPath) if e.is_dir()), key=lambda e: e.name, reverse=True)
+                except OSError:
+                    continue
+                self.dirsScanned += 1
+                for entry in entries:
+                    if entry.name == 'msg':
+                        package = os.path.basename(dirPath)
+                        try:
+                            msgEntries = sorted(os.scandir(entry.path), key=lambda e: e.name)
+                        except OSError:
+                            continue
+                        self.dirsScanned += 1
+                        for msgEntry in msgEntries:
+                            if msgEntry.name.endswith('.msg'):
+                                rootIndex.setdefault(package + '/' + msgEntry.name[:-len('.msg')], msgEntry.path)
+                    elif depth < self.MAX_DEPTH:
+                        stack.append((entry.path, depth + 1))
+        return rootIndex
+
+    # takes in a 'package/Type' and the indexes to look in, in order, and returns the
+    # path to its .msg file, or '' if there isn't one
+    def lookup(self, miniPath, indexes):
+        self.lookups += 1
+        for index in indexes:
+            path = index.get(miniPath)
+            if path:
+                self.hits += 1
+                return path
+        self.misses += 1
+        return ''
+
+    def find(self, miniPath):
+        return self.lookup(miniPath, (self.commonIndex, self.customIndex))
+
+    def find_common(self, miniPath):
+        return self.lookup(miniPath, (self.commonIndex,))
+
+    def find_custom_first(self, miniPath):
+        return self.lookup(miniPath, (self.customIndex, self.commonIndex))
+
+    # returns every root, common roots first
+    def get_roots(self):
+        return self.roots + self.customRoots
+
+    # returns [common roots, custom roots]
+    def get_rootGroups(self):
+        return [self.roots, self.customRoots]
+
+    # takes in a kind of lookup ('find', 'common' or 'custom_first') and a 'package/Type'
+    # and returns the path that lookup gives now, so a lookup recorded by an earlier run
+    # can be checked. raises KeyError for any other kind
+    def resolve(self, kind, miniPath):
+        return {'find': self.find, 'common': self.find_common, 'custom_first': self.find_custom_first}[kind](miniPath)
+
+    def get_stats(self):
+        types = len(self.commonIndex.keys() | self.customIndex.keys())
+        return {'types': types, 'roots': len(self.get_roots()), 'dirsScanned': self.dirsScanned,
+                'lookups': self.lookups, 'hits': self.hits, 'misses': self.misses}
+
+    def report(self):
+        stats = self.get_stats()
+        tracer.log(f"msg registry: {stats['types']} types from {stats['roots']} roots, "
+                   f"{stats['lookups']} lookups, {stats['hits']} hits, {stats['misses']} misses")
+
+
+# A StructSchema object is a flat sequence of (fieldType, field) pairs, i.e. the fields
+# of a .msg def or the unwrapped fields of a message type or struct. instead of a tuple
+# per field, the field types and names are kept in two parallel tuples of strings
+# interned in the symbol table, so a field costs two references, and a name like
+# 'header.stamp' is kept once however many structs have a header. it iterates, indexes
+# and compares like the tuple of (fieldType, field) tuples it stands in for
+
+# takes in an iterable of (fieldType, field) pairs
+
+class StructSchema():
+    __slots__ = ('types', 'names')
+
+    def __init__(self, fields=()):
+        types = []
+        names = []
+        for fieldType, field in fields:
+            types.append(symbols.intern(fieldType))
+            names.append(symbols.intern(field))
+        self.types = tuple(types)
+        self.names = tuple(names)
+
+    def __len__(self):
+        return len(self.types)
+
+    def __iter__(self):
+        return zip(self.types, self.names)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return tuple(zip(self.types[index], self.names[index]))
+        return (self.types[index], self.names[index])
+
+    def __eq__(self, other):
+        if isinstance(other, StructSchema):
+            return self.types == other.types and self.names == other.names
+        if isinstance(other, (tuple, list)):
+            return tuple(self) == tuple(tuple(f) for f in other)
+        return NotImplemented
+
+    def __hash__(self):
+        return hash((self.types, self.names))
+
+    def __repr__(self):
+        return f'StructSchema({tuple(self)!r})'
+
+
+# A TypeMemo object remembers a value per message type (or .msg file) so that work
+# done for a type is only ever done once, and counts how often that paid off. the
+# vehicles of a multi vehicle run share one for .msg files (see SharedWork), so
+# lookups and the counters go through a lock
+
+# takes in a name for the memo which is used when reporting hit rates
+
+class TypeMemo():
+    def __init__(self, name):
+        self.name = name
+        self.values = {}
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.values)
+
+    # takes in a key and returns the remembered value, or None if there isn't one
+    def get(self, key):
+        with self.lock:
+            value = self.values.get(key)
+            if value is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+        return value
+
+    def put(self, key, value):
+        with self.lock:
+            self.values[key] = value
+
+    def get_stats(self):
+        with self.lock:
+            hits, misses, entries = self.hits, self.misses, len(self.values)
+        lookups = hits + misses
+        hitRate = hits / lookups if lookups else 0.0
+        return {'entries': entries, 'hits': hits, 'misses': misses, 'hitRate': hitRate}
+
+    def report(self):
+        stats = self.get_stats()
+        tracer.log(f"{self.name} cache: {stats['entries']} entries, {stats['hits']} hits, "
+                   f"{stats['misses']} misses ({stats['hitRate']:.0%} hit rate)")
+
+
+# A SchemaCache object persists parsed .msg defs and unwrapped types between runs so
+# a run doesn't have to read every .msg def again. every entry remembers the .msg
+# files it was built from (mtime, size and sha1 hash) and the registry lookups it made
+# along the way (which .msg file a 'package/Type' resolved to, or that it didn't
+# resolve), and is only used while all of those files are unchanged and all of those
+# lookups still give the same answer. a file whose mtime changed but whose contents
+# didn't keeps its entries valid, and adding or removing a .msg file only makes the
+# entries which looked it up stale. stale entries are recompiled one at a time
+# instead of throwing away the whole cache
+
+# takes in the path to the cache file, the message roots the registry was built from
+# ([common roots, custom roots]), the MsgRegistry to check recorded lookups against and
+# the array hints types were unwrapped with. a cache written for different roots is
+# ignored, and since array hints decide how unsized arrays unwrap, unwrapped types
+# written with different hints are ignored
+
+# deps are handed in and out as a set holding the path of every .msg file read and a
+# (kind, 'package/Type', path) tuple for every lookup made (see MsgRegistry.resolve)
+
+# field 'entries' is a dictionary with a 'msgs' dictionary (.msg path|directory -> parsed
+# fields) and a 'types' dictionary (message type -> unwrapped fields), where every
+# value is a dictionary with the 'value', the 'deps' (.msg path -> [mtime, size, sha1])
+# and the 'lookups' ('kind|package/Type' -> path, '' if it didn't resolve) it was built from
+
+class SchemaCache():
+    VERSION = 3
+
+    def __init__(self, cachePath, roots, registry, arrayHints=None):
+        self.path = cachePath
+        self.roots = list(roots)
+        self.registry = registry
+        self.arrayHints = sorted([owner, field, length] for (owner, field), length in (arrayHints or {}).items())
+        self.entries = {'msgs': {}, 'types': {}}
+        self.fileChecks = {}
+        self.fileStates = {}
+        self.hits = 0
+        self.misses = 0
+        self.stale = 0
+        self.dirty = False
+        self.load()
+
+    # loads the cache file, starting from an empty cache if the file is missing,
+    # unreadable, from a different cache version, or for different message roots
+    def load(self):
+        if not os.path.exists(self.path):
+            return
+        try:
+            with open(self.path, 'r') as file:
+                content = json.load(file)
+        except (OSError, ValueError) as e:
+            tracer.warn(f'Ignoring unreadable schema cache {self.path} ({e})')
+            return
+        if content.get('version') == self.VERSION and content.get('roots') == self.roots:
+            self.entries['msgs'] = content.get('msgs', {})
+            if content.get('arrayHints', []) == self.arrayHints:
+                self.entries['types'] = content.get('types', {})
+
+    # takes in a path to a .msg file and returns [mtime, size, sha1] for it,
+    # every file is only hashed once per run
+    def file_state(self, msgPath):
+        state = self.fileStates.get(msgPath)
+        if state is None:
+            tracer.count("files stat'ed")
+            st = os.stat(msgPath)
+            with open(msgPath, 'rb') as file:
+                digest = hashlib.sha1(file.read()).hexdigest()
+            state = [st.st_mtime, st.st_size, digest]
+            self.fileStates[msgPath] = state
+        return state
+
+    # takes in a path to a .msg file and the [mtime, size, sha1] recorded for it and
+    # returns True if the file still has those contents. the hash is only computed when
+    # the mtime or size changed, and every file is only checked once per run
+    def check_file(self, msgPath, recorded):
+        if msgPath in self.fileChecks:
+            return self.fileChecks[msgPath] == recorded[2]
+        try:
+            tracer.count("files stat'ed")
+            st = os.stat(msgPath)
+            if st.st_mtime == recorded[0] and st.st_size == recorded[1]:
+                digest = recorded[2]
+            else:
+                digest = self.file_state(msgPath)[2]
+        except OSError:
+            digest = None
+        self.fileChecks[msgPath] = digest
+        return digest == recorded[2]
+
+    # takes in a lookup recorded as 'kind|package/Type' and the path it gave and
+    # returns True if the registry still gives that path
+    def check_lookup(self, lookup, recorded):
+        kind, _, miniPath = lookup.partition('|')
+        try:
+            return self.registry.resolve(kind, miniPath) == recorded
+        except KeyError:
+            return False
+
+    # takes in the kind of entry ('msgs' or 'types') and its key and returns
+    # (value, deps) if there is a valid entry, None otherwise
+    def get(self, kind, key):
+        entry = self.entries[kind].get(key)
+        if entry is None:
+            self.misses += 1
+            return None
+        lookups = entry.get('lookups', {})
+        if not (all(self.check_file(msgPath, recorded) for msgPath, recorded in entry['deps'].items())
+                and all(self.check_lookup(lookup, recorded) for lookup, recorded in lookups.items())):
+            self.stale += 1
+            return None
+        self.hits += 1
+        tracer.count('schema cache hits')
+        deps = set(entry['deps'])
+        for lookup, recorded in lookups.items():
+            deps.add(tuple(lookup.split('|', 1)) + (recorded,))
+        return entry['value'], deps
+
+    # takes in the kind of entry, its key, its value and the deps it was built from
+    def put(self, kind, key, value, deps):
+        depStates = {}
+        lookups = {}
+        for dep in deps:
+            if isinstance(dep, tuple):
+                lookupKind, miniPath, msgPath = dep
+                lookups[f'{lookupKind}|{miniPath}'] = msgPath
+                continue
+            try:
+                depStates[dep] = self.file_state(dep)
+            except OSError:
+                # can't validate it later, so don't keep it
+                return
+            self.fileChecks[dep] = depStates[dep][2]
+        self.entries[kind][key] = {'value': value, 'deps': depStates, 'lookups': lookups}
+        self.dirty = True
+
+    # writes the cache file if anything changed, via a temp file
+    def save(self):
+        if not self.dirty:
+            return
+        cacheDir = os.path.dirname(self.path)
+        if cacheDir:
+            os.makedirs(cacheDir, exist_ok=True)
+        content = {'version': self.VERSION, 'roots': self.roots, 'arrayHints': self.arrayHints,
+                   'msgs': self.entries['msgs'], 'types': self.entries['types']}
+        with atomic_write(self.path) as file:
+            json.dump(content, file)
+        self.dirty = False
+
+    def report(self):
+        tracer.log(f'schema cache: {self.hits} hits, {self.misses} misses, {self.stale} stale')
 
 
 # A BagStructDefs object holds the salient data structures and content
@@ -183,7 +2319,8 @@ class NamespaceTopics():
 # bag definition and struct definition from a .yaml file
 
 # take in a vehiclename, ('sentry', 'alvin' 'jason'), and data
-# which comes from the RosbagDiveData object
+# which comes from the RosbagDiveData object, optionally the RunConfig, and optionally
+# the SharedWork of a multi vehicle run
 
 # field name is string representing vehicle name
 
@@ -201,27 +2338,48 @@ class NamespaceTopics():
 
 # field structFields is a dictionary where every key is a struct (i.e. phinsbin.yaml) 
 # and every value is a tuple with tuple[0] = struct msg location directory 
-# (i.e. ds_sensor_msgs/PhinsStdbin3) and tuple[1] =  list of fieldtype/fieldname tuples
+# (i.e. ds_sensor_msgs/PhinsStdbin3) and tuple[1] = StructSchema of fieldtype/fieldname pairs
 #  extracted from that location directory 
 # (i.e. [('std_msgs/Header', 'header'), ('ds_core_msgs/DsHeader', 'ds_header'), ('uint32', 'nav_fields')...]
 
-# field structFieldsUnwrapped is similar to structFields, but with nested path types recursively
-# unwrapped so only primitive/non parsable types remain
+# field structFieldsUnwrapped is a dictionary where every key is a struct and every value is
+# a flat StructSchema of (fieldtype, fieldname) pairs, with nested path types unwrapped so only
+# primitive/non parsable types remain (i.e. (('uint32', 'header.seq'), ('time', 'header.stamp')...)
+
+# every field is only computed the first time its getter is called, so i.e. a run
+# which only populates bag defs never resolves or unwraps any .msg defs
 
-# note: importantly, the true master list of topics/types is the csv
+# note: importantly, the true master list of topics/types is the topic catalog
 # whereas the BagStructDefs object fields are based on 
 # on the RosbagDiveData, and can be manipulated to only 
 # include data for certain cruises or dives based on command line argument 'mode'
 
 class BagStructDefs():
-    def __init__(self, vehiclename, vehDir, data):
+    # the most levels of nested types unwrapping will follow
+    MAX_UNWRAP_DEPTH = 64
+
+    def __init__(self, vehiclename, vehDir, data, config=None, shared=None):
         self.name = vehiclename
         self.data = data
-        self.yaml = self.load_YamlExtract()
-        self.bags = self.generate_BagsDict()
-        self.structs = self.generate_StructsDict()
-        self.structFields = self.generate_FieldsDict()
-        self.structFieldsUnwrapped = self.generate_StructFieldsUnwrappedDict()
+        self.config = config if config is not None else RunConfig()
+        self.shared = shared
+        # every stage is computed on first access by its getter
+        self.yaml = None
+        self.bags = None
+        self.catalogs = None
+        self.registry = None
+        self.schemaCache = None
+        self.arrayHints = None
+        self.structs = None
+        self.structFields = None
+        self.structFieldsUnwrapped = None
+        self.msgMemo = TypeMemo('msg defs')
+        # .msg files are read once per run, whichever vehicle needs them first
+        self.msgFileMemo = shared.msgFileMemo if shared is not None else TypeMemo('msg files')
+        self.unwrapMemo = TypeMemo('unwrapped types')
+        self.structMemo = TypeMemo('struct types')
+        self.msgDeps = {}
+        self.unwrapDeps = {}
         
       
     def get_name(self):
@@ -230,6 +2388,9 @@ class BagStructDefs():
     def get_data(self):
         return self.data
 
+    def get_config(self):
+        return self.config
+
  
 
     # returns loaded vehiclename_extract.yaml file as dictionary
@@ -242,13 +2403,18 @@ class BagStructDefs():
                 basePath = os.path.join(root_dir, 'git', 'dslpp-git', 'dsros_python')
 
                 extractPath = os.path.join(basePath, '{}/{}_extract.yaml'.format(vehicleName, vehicleName))
+
+                # nobody to ask for another path when running unattended
+                if not self.get_config().interactive:
+                    with open(extractPath, 'r') as file:
+                        return yaml.load(file, Loader=YamlLoader)
                 
                 while True:
                     try:
                         if os.path.exists(extractPath):
 
                             with open(extractPath, 'r') as file:
-                                yamlDict = yaml.safe_load(file)
+                                yamlDict = yaml.load(file, Loader=YamlLoader)
                             return yamlDict
                         else:
                             print('Please try again')
@@ -259,7 +2425,7 @@ class BagStructDefs():
                             extractPath = os.path.join(basePath, '{}/{}_extract.yaml'.format(vehicleName, vehicleName))
                             if os.path.exists(extractPath):
                                 with open(extractPath, 'r') as file:
-                                    yamlDict = yaml.safe_load(file)
+                                    yamlDict = yaml.load(file, Loader=YamlLoader)
                                 return yamlDict
                     except:
                         print('Please try again')
@@ -267,7 +2433,29 @@ class BagStructDefs():
 
     
     def get_yaml(self):
+        if self.yaml is None:
+            self.yaml = self.load_YamlExtract()
         return self.yaml
+
+    # returns path to the bag scan cache, which lives in dsros_python/vehiclename/cache
+    # next to the .csv master lists
+    def get_scanCachePath(self):
+        return BagScanCache.default_path(self.get_name())
+
+    # returns path to the topic catalog, next to the .csv master lists
+    def get_catalogPath(self):
+        return TopicStore.default_path(self.get_name())
+
+    # returns path to the compiled schema cache, next to the bag scan cache
+    def get_schemaCachePath(self):
+        return os.path.join('dsros_python', self.get_name(), 'cache', 'msg_schemas.json')
+
+    # returns path to the special type rules for this vehicle, from the config
+    # or next to the .csv master lists
+    def get_specialTypesPath(self):
+        if self.get_config().specialTypesPath:
+            return self.get_config().specialTypesPath
+        return os.path.join('dsros_python', self.get_name(), 'special_types.yaml')
     
     # to do: 
     # add a check for self.mode being 'dive', 
@@ -285,53 +2473,82 @@ class BagStructDefs():
         if 'globals' in yamlDict:
             del yamlDict['globals']
 
-        numBagSamples = 3
-        intermediateDict = {}
         namespacetopicDict = {}
+        catalogs = {}
+        # list every dive directory once, bucketing its files by namespace
+        listing = BagListing(yamlDict.keys())
+        diveBuckets = [listing.list_dir(d) for d in dives]
+        listing.report()
+        namespaceDiveBags = {}
         for k in yamlDict.keys():
-                namespaceBagfiles = []
-                for d in dives:
-                        # Get the list of files in the dive directory
-                    files_in_dive = os.listdir(d)
-                        # Filter the files to get only those that match the prefix 'k' and don't end in '.active'
-                    matching_bagfiles = [file for file in files_in_dive if file.startswith(k) and not file.endswith(".active")]
-                        
-                        # Randomly select numBagSamples matching bag files (if available)
-                    selected_bagfiles = random.sample(matching_bagfiles, min(numBagSamples, len(matching_bagfiles)))
-                        
-                        # Append the paths of the selected bag files to namespaceBagfiles
-                    namespaceBagfiles.extend([os.path.join(d, bagfile) for bagfile in selected_bagfiles])
-
-                # Add the list of selected bag files to the intermediate dictionary
-                intermediateDict[k] = namespaceBagfiles
-        for k in intermediateDict:
-                print('this is k ' + str(k))
-                n = NamespaceTopics(name, intermediateDict[k])
-                masterDf = n.get_df()
-                namespacetopicDict[k] = masterDf
-
-        # update csv file which contains master list of topics and types
-        for namespace, df in namespacetopicDict.items():
-            csvPath = os.path.join('dsros_python', name, 'csv', f'{namespace}_topics_types.csv')
-            # if there's stuff in the .csv and dataframe, update csv with stuff from the dataframe
-            if os.path.exists(csvPath) and os.path.getsize(csvPath) > 0 and not df.empty:
-                csvDf = pd.read_csv(csvPath)
-                updatedDf = pd.concat([csvDf, df])
-                updatedDf.drop_duplicates(inplace=True)
-                updatedDf.to_csv(csvPath, index=False)
-            # if there doesn't yet exist a csv, create it and populate 
-            elif not os.path.exists(csvPath) and not df.empty:
-                with open(csvPath, 'w', newline='') as csvfile:
-                    df.to_csv(csvfile, index=False) 
-            # empty df means do nothing
-            else:
-                pass
+                # per dive, the files that match the prefix 'k' and don't end in '.active'
+                namespaceDiveBags[k] = [[os.path.join(d, bagfile) for bagfile in buckets.get(k, [])]
+                                        for d, buckets in zip(dives, diveBuckets)]
+
+        # draw bags for every namespace until its topics stop changing, the pool inspects
+        # a bag from every namespace at once, NamespaceTopics then merges from the pool's results
+        config = self.get_config()
+        cache = BagScanCache(self.get_scanCachePath(), listing)
+        budget = config.budget
+        pool = BagScanPool(config.jobs, cache, listing, budget,
+                           self.shared.executor if self.shared is not None else None)
+        stager = BagStager(config.stageDir, config.stageBudget, listing=listing, budget=budget)
+        # with a budget, what earlier runs scanned decides what gets scanned first
+        history = cache if budget.is_limited() else None
+        sampler = AdaptiveBagSampler(config.seed, config.convergeK, budget, history)
+        try:
+            intermediateDict = sampler.sample(namespaceDiveBags, pool)
+            sampler.report()
+            for k in intermediateDict:
+                    tracer.log('this is k ' + str(k), 2)
+                    n = NamespaceTopics(name, intermediateDict[k], pool, stager)
+                    catalogs[k] = n.get_catalog()
+                    namespacetopicDict[k] = n.get_df()
+        finally:
+            pool.shutdown()
+            cache.save()
+        pool.report()
+        stager.report()
+        budget.report()
+
+        self.catalogs = catalogs
+
+        # update the topic catalog which holds the master list of topics and types,
+        # the .csv master lists are written from it by the export-csv command
+        store = TopicStore(self.get_catalogPath())
+        try:
+            for namespace, catalog in catalogs.items():
+                # empty catalog means do nothing
+                if not len(catalog):
+                    continue
+                # a .csv master list from before the catalog existed gets imported once
+                csvPath = os.path.join('dsros_python', name, 'csv', f'{namespace}_topics_types.csv')
+                if not store.has_namespace(name, namespace) and os.path.exists(csvPath):
+                    store.import_csv(name, namespace, csvPath)
+                store.upsert(name, namespace, catalog, self.get_data().locate_bag)
+        finally:
+            store.close()
 
         return namespacetopicDict
 
     
     def get_bags(self):
+        if self.bags is None:
+            self.bags = self.generate_BagsDict()
         return self.bags
+
+    # takes in a dictionary of namespace -> topics and types dataframe and a dictionary
+    # of namespace -> TopicCatalog, and uses them as the bags instead of scanning,
+    # for callers which scanned the bags themselves (i.e. watch mode)
+    def use_bags(self, namespaceDfs, catalogs):
+        self.bags = namespaceDfs
+        self.catalogs = catalogs
+
+    # returns a dictionary where every key is a namespace and every value is the
+    # TopicCatalog the bags dataframe for that namespace was made from
+    def get_catalogs(self):
+        self.get_bags()
+        return self.catalogs
     
     # returns a dictionary where every key is a namespace
     # and every value is a list of tuples. each tuple contains a struct i.e. 'compass' 
@@ -355,12 +2572,97 @@ class BagStructDefs():
         
         return namespaceStructDict
     
+    # returns a MsgRegistry over the common and custom message roots from the config,
+    # or the default roots for this vehicle where the config has none
+    def create_MsgRegistry(self):
+        roots = self.get_config().msgRoots
+        if not roots:
+            roots = MsgRegistry.default_roots(self.get_name())
+        customRoots = self.get_config().customMsgRoots
+        if not customRoots:
+            customRoots = MsgRegistry.default_customRoots(self.get_name())
+        return MsgRegistry(roots, customRoots, self.shared)
+
+    def get_registry(self):
+        if self.registry is None:
+            self.registry = self.create_MsgRegistry()
+        return self.registry
+
+    def get_schemaCache(self):
+        if self.schemaCache is None:
+            registry = self.get_registry()
+            self.schemaCache = SchemaCache(self.get_schemaCachePath(), registry.get_rootGroups(), registry,
+                                           self.get_arrayHints())
+        return self.schemaCache
+
+    # returns a dictionary where every key is a (message type, field) tuple for an
+    # unsized array field and every value is the length to expand it to, sampled from
+    # the bags every topic was seen in. empty unless sampling arrays was asked for
+    def generate_ArrayHints(self):
+        config = self.get_config()
+        if not config.sampleArrays:
+            return {}
+        # a few bags per topic is plenty, the per topic caps bound the reads anyway
+        bagsPerTopic = 3
+        bagTypes = {}
+        for catalog in self.get_catalogs().values():
+            for topic, type in catalog.get_pairs():
+                for bag in sorted(catalog.get_bags(topic, type))[:bagsPerTopic]:
+                    bagTypes.setdefault(bag, set()).add(type)
+
+        start = time.perf_counter()
+        sampler = RosbagArraySampler(config.sampleMessages, config.sampleBytes, config.sampleMaxLength)
+        budget = config.budget
+        with tracer.span('array sampling', bags=len(bagTypes)):
+            for bag in sorted(bagTypes):
+                if budget.exhausted():
+                    tracer.warn('Run budget used up, sizing arrays from the bags sampled so far')
+                    break
+                bytesBefore = sampler.bytesRead
+                sampler.sample_bag(bag, bagTypes[bag])
+                budget.charge(sampler.bytesRead - bytesBefore)
+                tracer.count('bytes read', sampler.bytesRead - bytesBefore)
+        sampler.report()
+        tracer.log(f'sampled arrays in {time.perf_counter() - start:.3f}s')
+        return sampler.get_hints()
+
+    def get_arrayHints(self):
+        if self.arrayHints is None:
+            self.arrayHints = self.generate_ArrayHints()
+        return self.arrayHints
+
+    # takes in a message type and the (fieldType, field) tuples parsed from its .msg def
+    # and returns them with every unsized array which has an array hint given that size,
+    # i.e. ('PointField[]', 'fields') -> ('sensor_msgs/PointField[3]', 'fields'), so it
+    # gets expanded by addArraySuffixes like any sized array. optionally takes in a set
+    # of deps the registry lookups made get added to
+    def size_arrays(self, msgType, fieldTuples, deps=None):
+        hints = self.get_arrayHints()
+        if not hints:
+            return fieldTuples
+        msgType = self.processArrayNotation(msgType)[0]
+        msgDir = '/'.join(msgType.rsplit('/', 1)[:-1])
+        sized = []
+        for fieldType, field in fieldTuples:
+            length = hints.get((msgType, field)) if fieldType.endswith('[]') else None
+            if length:
+                baseType = fieldType[:-len('[]')]
+                if '/' not in baseType:
+                    baseType = self.addRelativePath(baseType, msgDir, deps)
+                fieldType = f'{baseType}[{length}]'
+            sized.append((fieldType, field))
+        return sized
+
     # takes in a field type and directory and returns a relative path
     # if field type and directory can form a valid relative path, returns
-    # type without directory if not 
-    def addRelativePath(self, fieldType, msgDir):
-        potentialRelPath = os.path.join(os.path.expanduser('~'), '/opt', 'ros', 'noetic', 'share', msgDir, 'msg', fieldType + '.msg')
-        if os.path.exists(potentialRelPath):
+    # type without directory if not. optionally takes in a set of deps the
+    # lookup gets added to (see SchemaCache)
+    def addRelativePath(self, fieldType, msgDir, deps=None):
+        miniPath = msgDir + '/' + fieldType
+        msgPath = self.get_registry().find_common(miniPath)
+        if deps is not None:
+            deps.add(('common', miniPath, msgPath))
+        if msgPath:
             return os.path.join(msgDir, fieldType)
         else:
             return fieldType
@@ -368,12 +2670,41 @@ class BagStructDefs():
 
     # takes in path to a .msg def, returns list of tuples
     # which represent fieldtype/field for that .msg def 
+
+    # every .msg def only gets read once, later calls are answered from msgMemo. the
+    # .msg file and the lookups made for it are kept in msgDeps
     def parse_msg(self, input_file_path, structMsgDir):
+        key = (input_file_path, structMsgDir)
+        cached = self.msgMemo.get(key)
+        if cached is not None:
+            return list(cached)
+        persisted = self.get_schemaCache().get('msgs', input_file_path + '|' + structMsgDir)
+        if persisted is not None:
+            matches = StructSchema(persisted[0])
+            self.msgMemo.put(key, matches)
+            self.msgDeps[key] = persisted[1]
+            return list(matches)
+        deps = {input_file_path}
+        matches = [(self.addRelativePath(fieldType, structMsgDir, deps), field)
+                   for fieldType, field in self.read_msg(input_file_path)]
+        self.msgMemo.put(key, StructSchema(matches))
+        self.msgDeps[key] = deps
+        self.get_schemaCache().put('msgs', input_file_path + '|' + structMsgDir, matches, deps)
+        return matches
+    
+    # takes in path to a .msg def and returns a StructSchema of (fieldtype, field) pairs as
+    # written in the file, before any relative paths are added. every file only gets
+    # read once, later calls are answered from msgFileMemo
+    def read_msg(self, input_file_path):
+        cached = self.msgFileMemo.get(input_file_path)
+        if cached is not None:
+            return cached
         # seperates the boys from the men 
         # kidding
         # seperates the field from the field type 
         pattern = r'^\s*([\w/\[\]]+)\s+([\w/\[\]]+)'
         matches = []
+        tracer.count('msg files parsed')
         with open(input_file_path, 'r') as infile:
             for line in infile:
                 if not line.startswith('#') and not line.isspace():
@@ -386,34 +2717,38 @@ class BagStructDefs():
                         fieldType = match.group(1)
                         if fieldType == 'Header':
                             fieldType = 'std_msgs/Header'
-                        fieldType = self.addRelativePath(fieldType, structMsgDir)
                         field = match.group(2)
                         matches.append((fieldType, field))
+        matches = StructSchema(matches)
+        self.msgFileMemo.put(input_file_path, matches)
         return matches
-    
+
     # to do: 
     # add support for sentry specific msg paths
 
     # takes in a tuple where tuples[0] is equal to struct.yaml. 
     # returns list of fields for .msg type
-    # based on preexisting .msg file 
+    # based on preexisting .msg file, or None if the .msg file
+    # can't be found and there is nobody to ask for it
     def extract_fields(self, tuple):
         miniPath = tuple[1]
         structMsgDir = '/'.join(miniPath.rsplit('/', 1)[:-1])
         msgFile = os.path.basename(miniPath) + '.msg'
         rootDir= os.path.expanduser("~")
         msgPathCustom = os.path.join(rootDir, 'ros', f'{self.get_name()}_ws', 'src', 'ds_msgs', structMsgDir, 'msg', msgFile)
-        msgPathCommon = os.path.join(rootDir, '/opt', 'ros', 'noetic', 'share', structMsgDir, 'msg', msgFile)
-  
+        msgPath = self.get_registry().find(miniPath)
+
+        if not self.get_config().interactive:
+            if msgPath:
+                return self.parse_msg(msgPath, structMsgDir)
+            tracer.warn(f'Couldn\'t find path to msg {msgFile}, skipping struct {tuple[0].lower()}.yaml')
+            return None
+
         while True:
             try:
-                if os.path.exists(msgPathCommon):
-                    fieldTuples = self.parse_msg(msgPathCommon, structMsgDir)
-                    return fieldTuples
-                elif os.path.exists(msgPathCustom):
-                    fieldTuples = self.parse_msg(msgPathCustom, structMsgDir)
+                if msgPath:
+                    fieldTuples = self.parse_msg(msgPath, structMsgDir)
                     return fieldTuples
-                
                 else:
                     print(f'Couldn\'t find path to msg {msgFile}\n')
                     msgPathUserProvided = input(f"Please provide an absolute path to the local location for the definition for {msgFile}, i.e. something like \n {msgPathCustom}")
@@ -431,26 +2766,35 @@ class BagStructDefs():
     # geometry_msgs/Vector3Stamped. tuple[1] is list of (potentially nested) tuples
     # with fieldtype, field i.e. [('std_msgs/Header', 'header'), ('geometry_msgs/Vector3', 'vector')]
     def generate_FieldsDict(self):
-        namespaceStructDict = self.generate_StructsDict()
-        structsList = []
-        structFieldDict = {}
-        for v in namespaceStructDict.values():
-            structsList.extend(v)
-
-        for t in structsList:
-            structName = t[0].lower() + '.yaml'
-            msgLoc = t[1]
-            fieldTuples = self.extract_fields(t)
-            structFieldDict[structName] = (msgLoc, fieldTuples)
-        return structFieldDict
+        namespaceStructDict = self.get_structs()
+        # sampled before the span, it reads bags rather than .msg files
+        self.get_arrayHints()
+        with tracer.span('msg resolution'):
+            structsList = []
+            structFieldDict = {}
+            for v in namespaceStructDict.values():
+                structsList.extend(v)
+
+            for t in structsList:
+                structName = t[0].lower() + '.yaml'
+                msgLoc = t[1]
+                fieldTuples = self.extract_fields(t)
+                if fieldTuples is None:
+                    continue
+                fieldTuples = self.size_arrays(msgLoc, fieldTuples)
+                structFieldDict[structName] = (msgLoc, StructSchema(fieldTuples))
+            return structFieldDict
 
     def get_structs(self):
+        if self.structs is None:
+            self.structs = self.generate_StructsDict()
         return self.structs
     
-    # deep copy since we don't want to risk mutatating field or .msg defs
-    # during unwrapping
+    # no copy needed, the StructSchemas are immutable
     def get_structFields(self):
-        return copy.deepcopy(self.structFields)
+        if self.structFields is None:
+            self.structFields = self.generate_FieldsDict()
+        return self.structFields
     
     # takes in a string representing a fieldtype and
     # returns a tuple where tuple[0] is the field type without any array digits
@@ -492,164 +2836,343 @@ class BagStructDefs():
             
     # takes in a relative path to a .msg file (i.e. ds_sensor_msgs/PhinsStatus) 
     # and returns absolute path if path can be found with supplied parameters
-    # '' if no path can be found 
-    def createPath(self, miniPath):
-        rootDir = os.path.expanduser('~')
-        name = self.get_name()
-
+    # '' if no path can be found. optionally takes in a set of deps the lookup gets added to
+    def createPath(self, miniPath, deps=None):
         indvFirstDir = '/'.join(miniPath.rsplit('/', 1)[:-1])
-        
+
         indvSecondPath = os.path.basename(miniPath)
         indvSecondPathNoDigits = self.processArrayNotation(indvSecondPath)[0]
 
-        msgPathCustom = os.path.join(rootDir, 'ros', f'{name}_ws', 'src', 'ds_msgs', indvFirstDir, 'msg', indvSecondPathNoDigits + '.msg')
-        msgPathCommon = os.path.join(rootDir, '/opt', 'ros', 'noetic', 'share', indvFirstDir, 'msg', indvSecondPathNoDigits + '.msg')
-        if os.path.exists(msgPathCustom):
-            return msgPathCustom
-        elif os.path.exists(msgPathCommon):
-            return msgPathCommon
-        else:
-            return ''   
+        if not indvFirstDir:
+            return ''
+        lookupPath = indvFirstDir + '/' + indvSecondPathNoDigits
+        msgPath = self.get_registry().find_custom_first(lookupPath)
+        if deps is not None:
+            deps.add(('custom_first', lookupPath, msgPath))
+        return msgPath
              
+    # takes in a field type i.e. 'geometry_msgs/Vector3Stamped[2]' and returns its unwrapped
+    # fields if they are already known, in memory or in the schema cache, None if not
+    def lookup_unwrapped(self, miniPath):
+        cached = self.unwrapMemo.get(miniPath)
+        if cached is not None:
+            return cached
+        persisted = self.get_schemaCache().get('types', miniPath)
+        if persisted is not None:
+            unwrapped = StructSchema(persisted[0])
+            self.unwrapMemo.put(miniPath, unwrapped)
+            self.unwrapDeps[miniPath] = persisted[1]
+            return unwrapped
+        return None
+
+    # takes in a field type and returns (subfields, deps) where subfields is a list of
+    # (fieldType, nameSuffix, nested) tuples for the direct subfields of the type with array
+    # suffixes added, nested being True for subfields which need unwrapping themselves,
+    # and deps is the set of .msg files read and registry lookups made (see SchemaCache)
+
+    # array sizes get expanded with addArraySuffixes on the subfields of the array type,
+    # and unsized arrays (i.e. 'Vector3[]') are left as is unless size_arrays sized them
+    def expand_type(self, miniPath):
+        relDir = '/'.join(miniPath.rsplit('/', 1)[:-1])
+        deps = set()
+        # absPath will not include digits
+        absPath = self.createPath(miniPath, deps)
+        arrayDigitString = self.processArrayNotation(miniPath)[1]
+
+        # if the type is nested (i.e. 'std_msgs/Header') its subfields come from its .msg def,
+        # if not (i.e. 'string[4]') the type is its own only subfield
+        if bool(absPath):
+            fieldTuples = self.parse_msg(absPath, relDir)
+            deps.update(self.msgDeps[(absPath, relDir)])
+            fieldTuples = self.size_arrays(miniPath, fieldTuples, deps)
+            subfields = [(fieldType, '.' + field) for fieldType, field in fieldTuples]
+        else:
+            subfields = [(miniPath, '')]
+
+        expanded = []
+        for subfield in subfields:
+            for fieldType, suffix in self.addArraySuffixes([subfield], arrayDigitString):
+                # true if primitive numbered type, i.e. 'uint8[16]'
+                numberedType = self.processArrayNotation(fieldType)[1] != ''
+                # true if path, false if path with a non-numbered array
+                # i.e. geometry_msgs/Vector3 is true, geometry_msgs/Vector3[4]
+                # is true, geometry_msgs/Vector3[] is false
+                pathType = '/' in fieldType and '[]' not in fieldType
+                # a path type with no .msg def to be found stays as is,
+                # otherwise it would unwrap to itself forever
+                unresolved = fieldType == miniPath and not absPath
+                expanded.append((fieldType, suffix, (pathType or numberedType) and not unresolved))
+        return expanded, deps
+
+    # takes in a field type and returns a StructSchema of (fieldType, nameSuffix) pairs which is
+    # that type fully unwrapped, where the full field name of each unwrapped field is the
+    # name of the field with that type plus nameSuffix
+    # i.e. a type with 'Header header' and 'geometry_msgs/Vector3[2] vector' fields unwraps to
+    # (('uint32', '.header.seq'), ..., ('float64', '.vector.x_1'), ('float64', '.vector.x_2'), ('float64', '.vector.y_1'), ...)
+
+    # since field names only ever get added onto, every type only needs to be unwrapped
+    # once no matter how many structs or fields it shows up in. results are kept in unwrapMemo
+    # and persisted in the schema cache along with every .msg file and lookup they were built from (unwrapDeps)
+
+    # nested types are unwrapped with an explicit stack rather than recursion, so deeply
+    # nested types can't hit the python recursion limit. a nested type which is already on
+    # the stack (a cycle) or would go deeper than MAX_UNWRAP_DEPTH is left wrapped
+    def unwrap_type(self, miniPath):
+        known = self.lookup_unwrapped(miniPath)
+        if known is not None:
+            return known
+
+        # every frame is [type, subfields, deps, index of the next subfield to look at]
+        stack = [[miniPath, None, None, 0]]
+        onStack = {miniPath}
+        while stack:
+            frame = stack[-1]
+            curType = frame[0]
+            if frame[1] is None:
+                frame[1], frame[2] = self.expand_type(curType)
+            subfields = frame[1]
+
+            # find the next nested subfield that hasn't been unwrapped yet
+            pushed = False
+            while frame[3] < len(subfields):
+                fieldType, suffix, nested = subfields[frame[3]]
+                if nested and self.lookup_unwrapped(fieldType) is None:
+                    if fieldType in onStack or len(stack) >= self.MAX_UNWRAP_DEPTH:
+                        reason = 'cycle' if fieldType in onStack else 'depth limit'
+                        chain = ' -> '.join([f[0] for f in stack] + [fieldType])
+                        tracer.warn(f'Leaving {fieldType} wrapped ({reason}: {chain})')
+                        subfields[frame[3]] = (fieldType, suffix, False)
+                    else:
+                        stack.append([fieldType, None, None, 0])
+                        onStack.add(fieldType)
+                        pushed = True
+                        frame[3] += 1
+                        break
+                frame[3] += 1
+            if pushed:
+                continue
+
+            # every nested subfield is unwrapped, put this type together
+            unwrapped = []
+            deps = set(frame[2])
+            for fieldType, suffix, nested in subfields:
+                if nested:
+                    unwrapped.extend((t, suffix + s) for t, s in self.unwrapMemo.values[fieldType])
+                    deps.update(self.unwrapDeps.get(fieldType, ()))
+                else:
+                    unwrapped.append((fieldType, suffix))
+            unwrapped = StructSchema(unwrapped)
+            self.unwrapMemo.put(curType, unwrapped)
+            self.unwrapDeps[curType] = deps
+            self.get_schemaCache().put('types', curType, list(unwrapped), deps)
+            stack.pop()
+            onStack.discard(curType)
+
+        return self.unwrapMemo.values[miniPath]
+
     # takes in a single tuple i.e. (std_msgs/Header, header) or (float64, error_rate)
-    # and performs unwrapping for the tuples, returning a single list which contains nested lists
-    # depending on recursion depth of indvTuple field types
+    # and performs unwrapping for the tuple, returning a list of (fieldType, field) tuples
+    # i.e. [('uint32', 'header.seq'), ('time', 'header.stamp'), ('string', 'header.frame_id')]
     def processIndvTuple(self, indvTuple):
-        # 'cur' prefix is used to indicate a variables relates to indvTuple as opposed to the 
-        # subfields of indvTuple
-        pattern = r'^\s*([\w/\[\]]+)\s+([\w/\[\]]+)'
-        curContainer = []
-        # curMiniPath includes digits if they are there 
         curMiniPath = indvTuple[0]
         curName = indvTuple[1]
-        relDir = '/'.join(curMiniPath.rsplit('/', 1)[:-1])
-        # curAbsPath will not include digits 
-        curAbsPath = self.createPath(curMiniPath)
-        curArrayDigitString = self.processArrayNotation(curMiniPath)[1]
-    
-        
-        # if the indvTuple is nested (i.e. 'std_msgs/Header', 'header'), create containers 
-        # for new subfields, populate containers, 
-        # and then add each of these subfield containers to curContainer
-        if bool(curAbsPath):
-            with open(curAbsPath, 'r') as infile:
-                for line in infile:
-                    if not line.startswith('#') and not line.isspace():
-                        # Remove text after '#' within a line
-                        line = re.sub(r'#.*', '', line)
-                        # Remove constants
-                        line = re.sub(r'.*=', '', line)
-                        match = re.match(pattern, line)
-                        if match:
-                            lineContainer = []
-                            # special case to turn ('Header', 'header') into 
-                            # (std_msgs/Header, 'header') to making unwrapping easier 
-                            # later on
-                            if match.group(1) == 'Header':
-                                fieldType = 'std_msgs/Header'
-                            else:
-                                fieldType = match.group(1)
-                            fieldType = self.addRelativePath(fieldType, relDir)
-                            field = match.group(2)
-                            # create the tuple 
-                            lineTuple = (fieldType, curName + '.' + field)
-                            lineContainer.append(lineTuple)
-                            curContainer.append(lineContainer)
-        # if indvTuple is not nested (i.e. 'string[4]', 'child_frame_id') create container, 
-        # add tuple to container, and add container to curContainer
-        else:
-            unnestedTupleContainer = []
-            unnestedTuple = (curMiniPath, curName)
-            unnestedTupleContainer.append(unnestedTuple)
-            curContainer.append(unnestedTupleContainer)
-        #  at this point curContainer structure is something like
-        #  where length = number of fields of indvTuple
-        #  [[(... , ...)], [(... ,...)]]
-        #  or 
-        #  [[(... , ...)]]
-        curSuffixedContainer = []
-        for container in curContainer:
-            suffixedContainer = self.addArraySuffixes(container, curArrayDigitString)
-            curSuffixedContainer.append(suffixedContainer)
-
-        # this function takes in a list of lists with suffix information 
-        # and recurs, unwrapping any nested types
-        # it outputs a final list of lists which does not contain any known nested types
-
-        # to do:
-        # recursion in rare cases produces excess brackets, somewhat trivial as overall list 
-        # still matches desired length but would be good to fix either post or during recursion
-
-        # note: may contain nested type if type contains unspecified array size
-        # could fix by asking user for input but would introduce an undesired dependency 
-        # on populate method and object instantation 
-        def recurOnCurContainer(curSufContainer):
-            processed_structure = []
-                
-            for item in curSufContainer:
-                if isinstance(item, list):
-                    processed_item = recurOnCurContainer(item)  
-                    processed_structure.append(processed_item)
-                elif isinstance(item, tuple):
-                    
-                    # true if primitive numbered type, i.e. 'uint8[16]'
-                    numberedType = self.processArrayNotation(item[0])[1] != ''
-                    # true if path, false if path with a non-numbered array
-                    # i.e. geometry_msgs/Vector3 is true, geometry_msgs/Vector3[4]
-                    # is true, geometry_msgs/Vector3[] is false 
-                    # addRelPath spec allows '/' to be valid path indicator
-                    pathType = '/' in item[0] and '[]' not in item[0]
-                    if pathType or numberedType:
-                        processedIndvTuple = self.processIndvTuple(item) 
-                        processed_structure.append(processedIndvTuple)
-                    else:
-                        processed_structure.append(item)
-            return processed_structure
-        return recurOnCurContainer(curSuffixedContainer)
+        return [(fieldType, curName + suffix) for fieldType, suffix in self.unwrap_type(curMiniPath)]
 
     # this function takes in a list of tuples (fieldType, field)
     # which come from the struct.yaml corresponding struct.msg def
-    # it returns a list where every item in the list 
+    # it returns a flat StructSchema where every item 
     # corresponds to a (fieldType, field)
-    # tuple with all the fieldTypes 'unwrapped', meaning fieldTypes which are paths
-    # to other .msg defs get recursively broken down into subsquent fieldTypes
+    # pair with all the fieldTypes 'unwrapped', meaning fieldTypes which are paths
+    # to other .msg defs get broken down into subsquent fieldTypes
     # until only primitive/special fieldTypes remain
 
-    # ultimately emit one structTupleListofLists per struct.yaml
+    # ultimately emit one StructSchema of records per struct.yaml
     def processStructTuples(self, structTuplesList):
         # say struct tuple five times fast 
-        structTupleListofLists = []
+        records = []
         for structTuple in structTuplesList:
-            print('this is individual tuple in processStructTuples')
-            print(structTuple)
-            structTupleListofLists.append(self.processIndvTuple(structTuple))     
-        return structTupleListofLists
+            tracer.log('this is individual tuple in processStructTuples', 2)
+            tracer.log(structTuple, 2)
+            records.extend(self.processIndvTuple(structTuple))
+        return StructSchema(records)
 
 
     
     # returns a dictionary where every key is
-    # struct.yaml and every value is a list of lists of tuples with
-    # path types unwrapped. 
+    # struct.yaml and every value is a flat StructSchema of (fieldType, field) pairs with
+    # path types unwrapped, i.e. (('uint32', 'header.seq'), ('time', 'header.stamp'), ...)
 
     # same structure as structFields but more conducive to 
     # populating the /struct_defs folder 
-    
+
+    # structs with the same .msg def share one unwrapped tuple
     def generate_StructFieldsUnwrappedDict(self):
         structFieldDict = self.get_structFields()
-        unwrappedDict = {}
-        for key, value in structFieldDict.items():
-            unwrappedDict[key] = self.processStructTuples(value[1])
-        return unwrappedDict
+        with tracer.span('unwrapping'):
+            start = time.perf_counter()
+            unwrappedDict = {}
+            for key, value in structFieldDict.items():
+                msgLoc = value[0]
+                unwrapped = self.structMemo.get(msgLoc)
+                if unwrapped is None:
+                    unwrapped = self.processStructTuples(value[1])
+                    self.structMemo.put(msgLoc, unwrapped)
+                unwrappedDict[key] = unwrapped
+            tracer.log(f'unwrapped {len(unwrappedDict)} structs in {time.perf_counter() - start:.3f}s')
+            for memo in (self.msgFileMemo, self.msgMemo, self.unwrapMemo, self.structMemo):
+                memo.report()
+            symbols.report()
+            self.get_registry().report()
+            self.get_schemaCache().report()
+            self.get_schemaCache().save()
+            return unwrappedDict
     
-    # deep copy because don't want to risk modifying dictionary during
-    # populate method if populate method changes 
+    # no copy needed, the unwrapped StructSchemas are immutable
     def get_structFieldsUnwrapped(self):
-        return copy.deepcopy(self.structFieldsUnwrapped)
+        if self.structFieldsUnwrapped is None:
+            self.structFieldsUnwrapped = self.generate_StructFieldsUnwrappedDict()
+        return self.structFieldsUnwrapped
 
 
 
     
 
+# A SpecialTypeRules object holds the answers to 'is this bool/string field a special
+# type?' for a vehicle, so populate_structs only asks about a field once ever instead
+# of once per struct per run. the rules live in a .yaml file which can also be edited
+# by hand, i.e.
+
+#   fields:
+#     ds_sensor_msgs/Gyro:
+#       header.frame_id: string
+#       names_1: cell
+#   patterns:
+#   - field: '*.frame_id'
+#     type: string
+#   - field: '*power*'
+#     from: bool
+#     type: pwr_state
+
+# 'fields' are exact rules per message type and field, and are checked first.
+# 'patterns' are checked in order and match the field with fnmatch, optionally only
+# for fields of the 'from' type. a rule whose type is the field's own type keeps it
+
+# takes in the path to the rules file (created on save if it doesn't exist yet)
+
+class SpecialTypeRules():
+    def __init__(self, rulesPath):
+        self.path = rulesPath
+        self.fields = {}
+        self.patterns = []
+        self.applied = 0
+        self.learned = 0
+        self.dirty = False
+        self.load()
+
+    # loads the rules file, starting with no rules if it is missing or unreadable
+    def load(self):
+        if not os.path.exists(self.path):
+            return
+        try:
+            with open(self.path, 'r') as file:
+                content = yaml.load(file, Loader=YamlLoader) or {}
+        except (OSError, yaml.YAMLError) as e:
+            tracer.warn(f'Ignoring unreadable special type rules {self.path} ({e})')
+            return
+        self.fields = content.get('fields') or {}
+        self.patterns = [p for p in content.get('patterns') or [] if 'field' in p and 'type' in p]
+
+    # takes in a message type, a field i.e. 'header.frame_id' and its type and returns
+    # the type the field should be populated with, or None if no rule covers it
+    def lookup(self, msgType, field, fieldType):
+        newType = self.fields.get(msgType, {}).get(field)
+        if newType is None:
+            for pattern in self.patterns:
+                if fnmatch.fnmatchcase(field, pattern['field']) and pattern.get('from', fieldType) == fieldType:
+                    newType = pattern['type']
+                    break
+        if newType is not None:
+            self.applied += 1
+        return newType
+
+    # takes in a message type, field and the type the user chose for it and remembers it
+    def learn(self, msgType, field, newType):
+        self.fields.setdefault(msgType, {})[field] = newType
+        self.learned += 1
+        self.dirty = True
+
+    # writes the rules file if anything was learned, via a temp file
+    def save(self):
+        if not self.dirty:
+            return
+        rulesDir = os.path.dirname(self.path)
+        if rulesDir:
+            os.makedirs(rulesDir, exist_ok=True)
+        with atomic_write(self.path) as file:
+            yaml.dump({'fields': self.fields, 'patterns': self.patterns}, file, Dumper=YamlDumper)
+        self.dirty = False
+
+    def report(self):
+        tracer.log(f'special type rules: {self.applied} fields resolved from {self.path}, {self.learned} answers saved')
+
+
+# A YamlWriter object writes the generated bag_defs and struct_defs .yaml files.
+# every file's new content is merged into what is already on disk (new keys win,
+# keys only on disk are kept) and the file is only written if that changes it, via
+# atomic_write so readers never see a half written file
+
+# field 'counts' is a dictionary with how many files were 'created', 'updated'
+# and 'unchanged'
+
+class YamlWriter():
+    def __init__(self):
+        self.pending = []
+        self.counts = {'created': 0, 'updated': 0, 'unchanged': 0}
+
+    # takes in a path and the content generated for it, written on flush
+    def add(self, path, content):
+        self.pending.append((path, content))
+
+    # takes in a path and returns its loaded content, or None if the file is missing or empty
+    def load(self, path):
+        if not os.path.exists(path):
+            return None
+        with open(path, 'r') as file:
+            return yaml.load(file, Loader=YamlLoader)
+
+    # takes in a path and the content generated for it and merges and writes it,
+    # returning 'created', 'updated' or 'unchanged'
+    def write(self, path, content):
+        existingContent = self.load(path)
+        if existingContent:
+            merged = dict(existingContent)
+            merged.update(content)
+            if merged == existingContent:
+                return 'unchanged'
+            status = 'updated'
+        else:
+            merged = content
+            status = 'updated' if os.path.exists(path) else 'created'
+        with atomic_write(path) as file:
+            yaml.dump(merged, file, Dumper=YamlDumper)
+        return status
+
+    # writes every added file and returns a dictionary of path -> status
+    def flush(self):
+        with tracer.span('yaml writing', files=len(self.pending)):
+            statuses = {}
+            for path, content in self.pending:
+                status = self.write(path, content)
+                self.counts[status] += 1
+                statuses[path] = status
+            self.pending = []
+            return statuses
+
+    def report(self, what):
+        tracer.log(f"{what}: {self.counts['created']} created, {self.counts['updated']} updated, "
+                   f"{self.counts['unchanged']} unchanged")
+
+
 # this class represents a RosbagDiveData object which can be instantiated by supplying 
 # two parameters: vehiclename which is the string 'jason', 'alvin', or 'sentry', 
 # and a dataDir which is the directory that holds all cruise information for the vehicle, 
@@ -664,22 +3187,40 @@ class BagStructDefs():
 # field 'dir' = directory path depending on mode, comes from --datadir command line arg 
 
 # field 'cruises' = a representative sample of cruises which that vehicle has been on, 
-# in the form of a list of paths to those cruises (empty if --mode is 'dive')
+# in the form of a list of paths to those cruises (empty if --mode is 'dive'). with
+# everyCruise set, cumulative mode lists every cruise instead of sampling them
 
 # field 'dives' = a representative sample of dives from those cruises, in the form of a 
 # list of paths to rosbag directories for those dives 
 
 class RosbagDiveData:
-    def __init__(self, vehiclename: str, dataDir, mode):
+    def __init__(self, vehiclename: str, dataDir, mode, seed=0, history=None, everyCruise=False):
         self.name = vehiclename
         self.mode = mode
         self.dir = dataDir
-        self.cruises = self.create_cruiseDirList(dataDir)
-        self.dives = self.create_diveDirList(self.cruises)
+        self.rng = random.Random(seed)
+        self.history = history
+        self.everyCruise = everyCruise
+        with tracer.span('dive discovery'):
+            self.cruises = self.create_cruiseDirList(dataDir)
+            self.dives = self.create_diveDirList(self.cruises)
 
 
     def get_mode(self):
         return self.mode
+
+    # takes in a parent directory, a list of its subdirectories and how many to pick and
+    # returns that many at random, or the ones earlier runs scanned the fewest bags under
+    # (ties broken at random) when there is a history of earlier runs. returns all of
+    # them when every cruise is wanted
+    def pick_least_covered(self, parentDir, subdirs, count):
+        if self.everyCruise:
+            return list(subdirs)
+        count = min(count, len(subdirs))
+        if self.history is None:
+            return self.rng.sample(subdirs, count)
+        keyed = [(self.history.count_under(os.path.join(parentDir, d)), self.rng.random(), d) for d in subdirs]
+        return [d for _, _, d in sorted(keyed)[:count]]
     
     def get_dir(self):
         return self.dir
@@ -707,11 +3248,11 @@ class RosbagDiveData:
                 yearDir = os.path.join(curDir, str(y))
                 if os.path.exists(yearDir) and os.path.isdir(yearDir):
                     # Get a list of subdirectories within the year directory
-                    subdirs = os.listdir(yearDir)
+                    subdirs = sorted(os.listdir(yearDir))
                     subdirs = [subdir for subdir in subdirs if os.path.isdir(os.path.join(yearDir, subdir)) and subdir.startswith(str(y))]
                     # grab y-name directories and shipnameprefix directories
                     # Randomly select two subdirectories (if available) and append them to cruiseDirList
-                    selected_subdirs = random.sample(subdirs, min(2, len(subdirs)))
+                    selected_subdirs = self.pick_least_covered(yearDir, subdirs, 2)
                     cruiseDirList.extend([os.path.join(yearDir, subdir) for subdir in selected_subdirs])
         elif self.name in ('jason', 'alvin'):
             for y in yearsJasonAlvin:
@@ -719,17 +3260,19 @@ class RosbagDiveData:
                     ships = shipsJason
                 if self.name == 'alvin':
                     ships = shipsAlvin
+                if not os.path.isdir(os.path.join(curDir, str(y))):
+                    tracer.warn(f"No directory found for year {y}")
+                    continue
                 for s in ships:
-                    subdirs = [os.path.join(curDir, str(y), sdir) for sdir in os.listdir(os.path.join(curDir, str(y))) 
+                    subdirs = [os.path.join(curDir, str(y), sdir) for sdir in sorted(os.listdir(os.path.join(curDir, str(y)))) 
                                if os.path.isdir(os.path.join(curDir, str(y), sdir))]
                     # Filter subdirectories to keep only the ones that start with the current ship prefix (s)
                     subdirs_with_prefix = [subdir for subdir in subdirs if os.path.basename(subdir).startswith(s)]
                     # Randomly select one s from the subdirectories with the current ship prefix (s)
                     if subdirs_with_prefix:
-                        chosen_s = random.choice(subdirs_with_prefix)
-                        cruiseDirList.append(chosen_s)
+                        cruiseDirList.extend(self.pick_least_covered('', subdirs_with_prefix, 1))
                     else:
-                        print(f"No directory found for {s} in year {y}")
+                        tracer.warn(f"No directory found for {s} in year {y}")
         return cruiseDirList
     
     # takes in directory path supplied from command line
@@ -744,55 +3287,51 @@ class RosbagDiveData:
         elif mode == 'dive':
             cruisesList = []
         else:
-            print('this should never get printed and if it does we\'re gonna need a bigger boat')
+            tracer.warn('this should never get printed and if it does we\'re gonna need a bigger boat')
         return cruisesList
     
 
     # takes in list of cruises and returns a list of paths to directories 
     # containing .bag files for a certain dive 
+
+    # every dive of the cruises is returned, sorted. which bags of which dives actually
+    # get inspected is up to the AdaptiveBagSampler, which spreads its draws over all of them
     def create_diveDirList(self, cruises):
-        if self.get_mode() == 'cumulative':
-            numDives = 3
-        elif self.get_mode() == 'cruise':
-            numDives = 2
-        elif self.get_mode() == 'dive':
+        if self.get_mode() == 'dive':
             return [self.get_dir()]
         dives = []
-        # randomly select three dives per cruise
         for c in cruises:
-            print(c)
+            tracer.log(c, 2)
             # separate into cases because of disparity in directory structure between vehicles 
             if self.name == 'jason':
                 # with jason directory structure, this leads you to list of dives which 
                 # are containers for rosbag files
                 rosbagsForDivesPath = os.path.join(c, 'Vehicle/Rawdata/Navest/rosbag')
                 if os.path.exists(rosbagsForDivesPath) and os.path.isdir(rosbagsForDivesPath):
-                    subdirectories = os.listdir(rosbagsForDivesPath)
-                    chosenDives = random.sample(subdirectories, min(numDives, len(subdirectories)))
-                    chosenDives = [os.path.join(c, 'Vehicle/Rawdata/Navest/rosbag', dive) for dive in chosenDives]
+                    subdirectories = sorted(os.listdir(rosbagsForDivesPath))
+                    chosenDives = [os.path.join(c, 'Vehicle/Rawdata/Navest/rosbag', dive) for dive in subdirectories]
                
                     dives.append(chosenDives)
                  
             elif self.name == 'alvin':
                 dives_path = c
                 if os.path.exists(dives_path) and os.path.isdir(dives_path):
-                    subdirectories = os.listdir(dives_path)
+                    subdirectories = sorted(os.listdir(dives_path))
                     # filter out subdirectories to only include subdirectories that begin with 'AL'
                     filteredSubdirectories = [s for s in subdirectories if s.startswith('AL')]
-                    # pick random sample of dives 
-                    chosenDives = random.sample(filteredSubdirectories, min(numDives, len(filteredSubdirectories)))
                     # grab rosbag directory for those dives 
                     dives_with_rosbag = []
-                    for dive in chosenDives:
+                    for dive in filteredSubdirectories:
                         rosbag_path = os.path.join(dives_path, dive, 'c+c/rosbag')
                         if os.path.exists(rosbag_path) and os.path.isdir(rosbag_path):
                             dives_with_rosbag.append(rosbag_path)
                     dives.append(dives_with_rosbag)
-                dives.append(dives_with_rosbag)
 
             elif self.name == 'sentry':
-                #chosenDives = random.sample(os.path.join(c, 'dives'), min(numDives, len(os.listdir(os.path.join(c, 'dives')))))
-                chosenDivesSentry = os.listdir(os.path.join(c, 'dives'))
+                # a cruise which was just created may not have its dives directory yet
+                if not os.path.isdir(os.path.join(c, 'dives')):
+                    continue
+                chosenDivesSentry = sorted(os.listdir(os.path.join(c, 'dives')))
                 filteredChosenDives = [d for d in chosenDivesSentry if d.startswith('sentry') and '-' not in d]
                 divesRosbag = [os.path.join(c, 'dives', d, 'nav-sci', 'raw', 'rosbag') for d in filteredChosenDives]
                 validDivesRosbag = [d for d in divesRosbag if os.path.exists(d)]
@@ -800,10 +3339,28 @@ class RosbagDiveData:
 
         # turn list of lists into list
         flattenedDives = [item for sublist in dives for item in sublist]
+        # least scanned dives first when there is a history of earlier runs
+        if self.history is not None:
+            flattenedDives.sort(key=self.history.count_under)
 
         return flattenedDives
     
 
+    # takes in a path to a bag and returns (dive, cruise, year): the directory the bag is
+    # in, the cruise directory it is under (None in dive mode) and the year directory it
+    # is under (None if there isn't one)
+    def locate_bag(self, bagFile):
+        dive = os.path.dirname(bagFile)
+        year = None
+        for part in dive.split(os.sep):
+            if len(part) == 4 and part.isdigit():
+                year = int(part)
+                break
+        for c in self.cruises:
+            if dive.startswith(c.rstrip(os.sep) + os.sep):
+                return dive, c, year
+        return dive, None, year
+
     # Getter for the 'name' field
     def get_name(self):
         return self.name
@@ -827,6 +3384,7 @@ def populate_Bags(defs : BagStructDefs):
     name = defs.get_name()
     namespaceDict = defs.get_bags()
     yamlExtract = defs.get_yaml()
+    writer = YamlWriter()
     
 
     # iterate through namespaces in extract.yaml file 
@@ -851,22 +3409,11 @@ def populate_Bags(defs : BagStructDefs):
                         'def': f"{lastPart}.yaml"
 
                     }
-                # perform various checks for state of yaml file and then populate  
-                if os.path.exists(namespacePath):
-                    with open(namespacePath, 'r') as file:
-                        isNonEmpty = bool(file.read().strip())
-                        file.seek(0)
-                        existingContent = yaml.safe_load(file)
-                        if isNonEmpty and existingContent is not None:
-                            existingContent.update(newYamlContent)
-                    with open(namespacePath, 'w') as file:
-                        if existingContent is not None and bool(existingContent):
-                            yaml.safe_dump(existingContent, file)
-                        else:
-                            yaml.safe_dump(newYamlContent, file)
-                else:
-                    with open(namespacePath, 'w') as file:
-                        yaml.safe_dump(newYamlContent, file)
+                # merged with what's on disk and only written if that changes the file
+                writer.add(namespacePath, newYamlContent)
+
+    writer.flush()
+    writer.report('bag_defs')
 
 # this function creates struct definitions 
 # in the dsros_python/vehiclename/struct_defs directory 
@@ -875,12 +3422,18 @@ def populate_Bags(defs : BagStructDefs):
 def populate_structs(defs : BagStructDefs):
     originalUnwrappedDict = defs.get_structFieldsUnwrapped()
     originalStructList = list(originalUnwrappedDict.keys())
+    structFields = defs.get_structFields()
     vehName = defs.get_name()
+    interactive = defs.get_config().interactive
+    rules = SpecialTypeRules(defs.get_specialTypesPath())
+    unresolved = []
     
     # this function uses user input to create a list
     # of desired structs to populate /struct_defs with
     # returns list with desired structs
     def createProcessedStructList(unprocStructList : list):
+        if not interactive:
+            return unprocStructList
         print("Please enter any structs you wish to omit from generation,")
         print("separated by a comma and then press enter, or just press enter if you do not wish to omit any structs.")
         while True:
@@ -927,64 +3480,73 @@ def populate_structs(defs : BagStructDefs):
         processedUnwrappedDict = {}
             
 
-        # takes in a nested list of tuples which represent the unwrapped
+        # takes in the flat tuple of (fieldtype, field) tuples which represent the unwrapped
         # fieldtype, field for an entire struct, and creates a new
-        # nested list with modificiations that account for special types 
-        def processValue(structKey, nestedTupleList):
+        # tuple with modificiations that account for special types 
+        def processValue(structKey, records):
             processedValue = []
-                
-            for item in nestedTupleList:
-                   
-
-
-                # if list, recur until tuple 
-                # i.e. unwrap it and recur 
-                if isinstance(item, list):
-
-                    newItem = processValue(structKey, item)
-                    processedValue.append(newItem)
-                        
-
-                # if tuple, check all special cases and 
-                # append tuples to processedValue accordingly
-                elif isinstance(item, tuple):
-                        
-
-                    # rostime
-                    if item[0] == 'time' and item[1] == 'header.stamp':
-                        processedValue.append(('rostime', 'header.stamp'))
-
-                    # bool or string type indicates potential special type
-                    elif item[0] == 'bool' or item[0] == 'string':
-                        newType1 = f"\n\nIdentified a possible special type in {item}) for struct '{structKey}'"
-                        newType2 = f"Please enter a new type for '{item[0]}' (e.g., 'cell' or 'pwr_state')"
-                        newType3 = f"or press Enter if '{item[0]}' is an acceptable type for '{item[1]}': "
-                        newType = input(newType1 + '\n' + newType2 + '\n' + newType3 + '\n\n')
-                        if newType != '':
-                            processedValue.append((newType, item[1]))
-                            print(f"Type {item[0]} changed to {newType}")
-                        else:
-                            processedValue.append(item)
-
-                       
-
-                    # tuple but not special 
+            msgType = structFields[structKey][0]
+            knownTypes = {}
+            for fieldType, field in records:
+                if fieldType == 'bool' or fieldType == 'string':
+                    ruleType = rules.lookup(msgType, field, fieldType)
+                    if ruleType is not None:
+                        knownTypes[field] = ruleType
+
+            # check all special cases and 
+            # append tuples to processedValue accordingly
+            for item in records:
+
+                # rostime
+                if item[0] == 'time' and item[1] == 'header.stamp':
+                    processedValue.append(('rostime', 'header.stamp'))
+
+                # bool or string type indicates potential special type,
+                # which the rules may already have an answer for
+                elif (item[0] == 'bool' or item[0] == 'string') and item[1] in knownTypes:
+                    processedValue.append((knownTypes[item[1]], item[1]))
+
+                elif (item[0] == 'bool' or item[0] == 'string') and not interactive:
+                    unresolved.append((structKey, item))
+                    processedValue.append(item)
+
+                elif item[0] == 'bool' or item[0] == 'string':
+                    newType1 = f"\n\nIdentified a possible special type in {item}) for struct '{structKey}'"
+                    newType2 = f"Please enter a new type for '{item[0]}' (e.g., 'cell' or 'pwr_state')"
+                    newType3 = f"or press Enter if '{item[0]}' is an acceptable type for '{item[1]}': "
+                    newType = input(newType1 + '\n' + newType2 + '\n' + newType3 + '\n\n')
+                    if newType != '':
+                        processedValue.append((newType, item[1]))
+                        print(f"Type {item[0]} changed to {newType}")
                     else:
                         processedValue.append(item)
-                
-            return processedValue
-                    
-                    
+                    # a blank answer is remembered too, as keeping the type
+                    rules.learn(msgType, item[1], newType if newType != '' else item[0])
+
+                # tuple but not special 
+                else:
+                    processedValue.append(item)
+
+            return tuple(processedValue)
 
 
         for key, value in originalDictionary.items():
             if key in processedStructList:
-                print('Now generating struct defs for :' + key)
+                tracer.log('Now generating struct defs for :' + key, 2)
                 processedUnwrappedDict[key] = processValue(key, value)
         return processedUnwrappedDict
            
-    # call handleSpecialTypes
-    processeedUnwrappedDict = handleSpecialTypes(processedStructList, originalUnwrappedDict)
+    # call handleSpecialTypes, saving answers as they are given
+    try:
+        processeedUnwrappedDict = handleSpecialTypes(processedStructList, originalUnwrappedDict)
+    finally:
+        rules.save()
+    rules.report()
+    if unresolved:
+        tracer.warn(f'{len(unresolved)} possible special types have no rule and kept their type:')
+        for structKey, item in unresolved:
+            tracer.warn(f'  {structKey}: {item[1]} ({item[0]})')
+        tracer.warn(f'add rules for them to {rules.path} or run without --non-interactive')
 
         
     # takes in final processed dictionary which accounts
@@ -996,88 +3558,76 @@ def populate_structs(defs : BagStructDefs):
         dictForPopulating = {}
         
               
-        # takes in list of lists representing 
+        # takes in the flat tuple of records representing 
         # unwrapped types for a yaml struct and 
         # outputs a .yaml friendly dict with those
         # types   
         def setYaml(value):
-            print('printing set yaml')
-            print(value)
+            tracer.log('printing set yaml', 2)
+            tracer.log(value, 2)
             newYamlContent = {}
             for item in value:
-                if isinstance(item, list):
-                    newItem = setYaml(item)
-                    if isinstance(newItem, dict):
-                        newYamlContent.update(newItem)
-                elif isinstance(item, tuple):
-                    if item[0] =='FlaggedDouble':
-                        print('flaggeddouble item')
-                        print(item)
-                        # special case which gets dealt with here 
-                        # instead of other method because type doesn't
-                        # need to be changed 
-                        newYamlContent[item[1]] = {
-                                'type': 'flagged',
-                                'value': item[1] + '.value',
-                                'valid': item[1] + '.valid'
-                            }
-                    else:
-                        newYamlContent[item[1]] = {
-                                'type': item[0],
-                                'value': item[1]
-                            }
+                if item[0] =='FlaggedDouble':
+                    tracer.log('flaggeddouble item', 2)
+                    tracer.log(item, 2)
+                    # special case which gets dealt with here 
+                    # instead of other method because type doesn't
+                    # need to be changed 
+                    newYamlContent[item[1]] = {
+                            'type': 'flagged',
+                            'value': item[1] + '.value',
+                            'valid': item[1] + '.valid'
+                        }
+                else:
+                    newYamlContent[item[1]] = {
+                            'type': item[0],
+                            'value': item[1]
+                        }
                         
             return newYamlContent
             
             
         
+        rootDir = os.path.expanduser("~")
+        def getBasePath():         
+            basePath = os.path.join(rootDir, 'git', 'dslpp-git', 'dsros_python')
+
+            while True:
+                try:
+                    if os.path.exists(basePath):
+                        return basePath
+                    elif not interactive:
+                        raise SystemExit(f"Couldn't find dsros_python at {basePath}")
+                    else:
+                        print(f"Please provide a path to the dsros_python directory on your machine")
+                        print(f"i.e. something like \n {basePath}")
+                        basePath = input('Enter path: ')
+                        if os.path.exists(basePath):
+                            return basePath
+                        else:
+                            raise FileNotFoundError()
+                except FileNotFoundError as e:
+                    print(e)
+                    print("Couldn't find path, try again")
+                    continue
+
+        # resolved once for every struct
+        basePath = getBasePath()
+        writer = YamlWriter()
+
         # actually populate 
         for key, value in procUnwrappedDict.items():
             dictForPopulating[key] = setYaml(value)
             newYamlContent = dictForPopulating[key]
 
             structFilename = key
-            rootDir = os.path.expanduser("~")
-            def getBasePath():         
-                basePath = os.path.join(rootDir, 'git', 'dslpp-git', 'dsros_python')
-
-                while True:
-                    try:
-                        if os.path.exists(basePath):
-                            return basePath
-                        else:
-                            print(f"Please provide a path to the dsros_python directory on your machine")
-                            print(f"i.e. something like \n {basePath}")
-                            basePath = input('Enter path: ')
-                            if os.path.exists(basePath):
-                                return basePath
-                            else:
-                                raise FileNotFoundError()
-                    except FileNotFoundError as e:
-                        print(e)
-                        print("Couldn't find path, try again")
-                        continue
-                        
-                    
-            basePath = getBasePath()
             structDefPath = os.path.join(basePath, vehName, 'struct_defs', structFilename)
-            
 
-            if os.path.exists(structDefPath):
-                with open(structDefPath, 'r') as file:
-                        isNonEmpty = bool(file.read().strip())
-                        file.seek(0)
-                        existingContent = yaml.safe_load(file)
-                        if isNonEmpty and existingContent is not None:
-                            existingContent.update(newYamlContent)
-                with open(structDefPath, 'w') as file:
-                    if existingContent is not None and bool(existingContent):
-                        yaml.safe_dump(existingContent, file)
-                    else:
-                        yaml.safe_dump(newYamlContent, file)
-            else:
-                with open(structDefPath, 'w') as file:
-                    yaml.safe_dump(newYamlContent, file)
+            # merged with what's on disk and only written if that changes the file
+            writer.add(structDefPath, newYamlContent)
+
+        writer.flush()
+        writer.report('struct_defs')
     # call populateStructDefFiles 
     populateStructDefFiles(processeedUnwrappedDict)
                 
@@ -1085,22 +3635,666 @@ def populate_structs(defs : BagStructDefs):
 
 
 
+# An InotifyWaker object wakes a watch loop up as soon as something changes in the
+# directories it watches, using Linux inotify through libc (no extra packages). a file
+# being created, renamed into a directory (i.e. 'x.bag.active' -> 'x.bag') or closed
+# after writing counts as a change. where inotify isn't available (i.e. not Linux, or
+# the data directory is on a network mount which doesn't deliver events) the watch loop
+# just polls, so the waker only ever shortens the wait, it never decides what changed
+
+# field 'fd' is the inotify file descriptor, None if inotify isn't available
+
+class InotifyWaker():
+    IN_CLOSE_WRITE = 0x00000008
+    IN_MOVED_TO = 0x00000080
+    IN_CREATE = 0x00000100
+    IN_NONBLOCK = os.O_NONBLOCK
+
+    def __init__(self):
+        self.fd = None
+        self.watched = set()
+        self.libc = None
+        if not sys.platform.startswith('linux'):
+            return
+        try:
+            self.libc = ctypes.CDLL(ctypes.util.find_library('c') or 'libc.so.6', use_errno=True)
+            fd = self.libc.inotify_init1(self.IN_NONBLOCK)
+        except (OSError, AttributeError):
+            return
+        if fd >= 0:
+            self.fd = fd
+
+    def available(self):
+        return self.fd is not None
+
+    # takes in a directory and starts watching it, if it isn't watched already
+    def watch(self, dirPath):
+        if self.fd is None or dirPath in self.watched:
+            return
+        mask = self.IN_CLOSE_WRITE | self.IN_MOVED_TO | self.IN_CREATE
+        if self.libc.inotify_add_watch(self.fd, os.fsencode(dirPath), mask) >= 0:
+            self.watched.add(dirPath)
+
+    # takes in a number of seconds and waits until either something changed in a watched
+    # directory or that many seconds passed, returns True if something changed
+    def wait(self, timeout):
+        if self.fd is None:
+            time.sleep(timeout)
+            return False
+        ready, _, _ = select.select([self.fd], [], [], timeout)
+        if not ready:
+            return False
+        # only the wake up matters, the events themselves are thrown away
+        try:
+            while os.read(self.fd, 64 * 1024):
+                pass
+        except BlockingIOError:
+            pass
+        return True
+
+    def close(self):
+        if self.fd is not None:
+            os.close(self.fd)
+            self.fd = None
+
+
+# A DiveWatcher object keeps a vehicle's defs up to date as dives land. it polls the
+# dive directories (waking early on inotify events where available) for bags which
+# have been closed since it started, i.e. the recorder renamed 'x.bag.active' to
+# 'x.bag', and scans only those. new bags are collected until none have turned up for
+# 'debounce' seconds, or until 'batchWindow' seconds after the first of them, so the
+# burst of bags at the end of a dive gets handled as one batch. a batch is recorded
+# in the topic catalog, and when it brings (topic, type) pairs the catalog hadn't seen,
+# the bag_defs and struct_defs of just those topics are written. a batch which fails is
+# logged and its bags are picked up again on the next poll, and once the run budget
+# (--time-budget, --byte-budget) is used up watching stops
+
+# takes in a vehicle name, the directory with its data, the mode (which decides which
+# dive directories get watched, like for a normal run, except that cumulative mode
+# watches every cruise rather than a sample of them), the RunConfig, and the poll
+# interval, debounce and batch window in seconds
+
+# bags already there when watching starts aren't scanned, run once without --watch first
+
+# field 'seen' is the set of bags which were already there when watching started or
+# have been handled in a batch
+
+class DiveWatcher():
+    def __init__(self, vehicleName, dataDir, mode, config, pollInterval=30, debounce=10, batchWindow=120):
+        self.name = vehicleName
+        self.dataDir = dataDir
+        self.mode = mode
+        self.config = config
+        self.pollInterval = pollInterval
+        self.debounce = debounce
+        self.batchWindow = batchWindow
+        self.waker = InotifyWaker()
+        self.data = None
+        self.seen = set()
+        self.batches = 0
+        self.namespaces = [k for k in BagStructDefs(vehicleName, dataDir, None, config).get_yaml() if k != 'globals']
+
+    # takes in a dictionary of the bags already waiting for a batch, finds the dive
+    # directories to watch (picking up dives and cruises which appeared since the last
+    # poll) and returns a dictionary of bag -> namespace for every closed bag in them
+    # which hasn't been seen before and isn't waiting already
+    def poll(self, pendingBags=()):
+        try:
+            self.data = RosbagDiveData(self.name, self.dataDir, self.mode, self.config.seed, everyCruise=True)
+        except OSError as e:
+            tracer.warn(f'Could not list the dive directories of {self.name} ({e}), trying again next poll')
+            return {}
+        listing = BagListing(self.namespaces)
+        newBags = {}
+        for diveDir in self.data.get_dives():
+            self.waker.watch(diveDir)
+            try:
+                buckets = listing.list_dir(diveDir)
+            except OSError:
+                continue
+            for namespace, bagfiles in buckets.items():
+                for bagfile in bagfiles:
+                    bagPath = os.path.join(diveDir, bagfile)
+                    if bagPath not in self.seen and bagPath not in pendingBags:
+                        newBags[bagPath] = namespace
+        return newBags
+
+    # takes in a dictionary of bag -> namespace, scans the bags, records them in the
+    # topic catalog and writes the defs of any topics the catalog hadn't seen
+    def process(self, pendingBags):
+        self.batches += 1
+        with tracer.span('watch batch', bags=len(pendingBags)):
+            byNamespace = {}
+            for bagPath, namespace in sorted(pendingBags.items()):
+                byNamespace.setdefault(namespace, []).append(bagPath)
+            defs = BagStructDefs(self.name, self.dataDir, self.data, self.config)
+            listing = BagListing()
+            cache = BagScanCache(defs.get_scanCachePath(), listing)
+            budget = self.config.budget
+            pool = BagScanPool(self.config.jobs, cache, listing, budget)
+            stager = BagStager(self.config.stageDir, self.config.stageBudget, listing=listing, budget=budget)
+            store = TopicStore(defs.get_catalogPath())
+            namespaceDfs = {}
+            catalogs = {}
+            try:
+                for namespace, bagfiles in byNamespace.items():
+                    catalog = NamespaceTopics(self.name, bagfiles, pool, stager).get_catalog()
+                    fresh = TopicCatalog()
+                    for topic, type in catalog.get_pairs():
+                        if not store.has_pair(self.name, namespace, topic, type):
+                            for bag in catalog.get_bags(topic, type):
+                                fresh.add(topic, type, bag, catalog.get_md5sum(topic, type))
+                    store.upsert(self.name, namespace, catalog, self.data.locate_bag)
+                    if len(fresh):
+                        namespaceDfs[namespace] = fresh.to_df()
+                        catalogs[namespace] = fresh
+            finally:
+                pool.shutdown()
+                cache.save()
+                store.close()
+            tracer.log(f'batch {self.batches}: {len(pendingBags)} new bags, '
+                       f'{sum(len(c) for c in catalogs.values())} new topics')
+            if not namespaceDfs:
+                return
+            for namespace, catalog in catalogs.items():
+                for topic, type in catalog.get_pairs():
+                    tracer.log(f'  {namespace}: {topic} ({type})')
+            defs.use_bags(namespaceDfs, catalogs)
+            populate_Bags(defs)
+            populate_structs(defs)
+
+    # watches until interrupted (ctrl-c) or the run budget is used up, handling new
+    # bags in batches
+    def run(self):
+        self.seen.update(self.poll())
+        how = 'inotify and polling' if self.waker.available() else 'polling'
+        numDives = len(self.data.get_dives()) if self.data is not None else 0
+        tracer.log(f'watching {numDives} dive directories of {self.name} '
+                   f'({len(self.seen)} bags already there) with {how} every {self.pollInterval:.0f}s')
+        pendingBags = {}
+        firstNew = None
+        lastNew = None
+        budget = self.config.budget
+        try:
+            while not budget.exhausted():
+                timeout = self.pollInterval
+                if pendingBags:
+                    now = time.monotonic()
+                    dueIn = min(lastNew + self.debounce, firstNew + self.batchWindow) - now
+                    timeout = max(0.0, min(timeout, dueIn))
+                self.waker.wait(timeout)
+                newBags = self.poll(pendingBags)
+                now = time.monotonic()
+                if newBags:
+                    tracer.log(f'{len(newBags)} new bags', 2)
+                    pendingBags.update(newBags)
+                    lastNew = now
+                    firstNew = firstNew if firstNew is not None else now
+                if pendingBags and (now - lastNew >= self.debounce or now - firstNew >= self.batchWindow):
+                    try:
+                        self.process(pendingBags)
+                        self.seen.update(pendingBags)
+                    except Exception as e:
+                        # the bags aren't seen yet, so the next poll picks them up for another batch
+                        tracer.warn(f'batch {self.batches} of {len(pendingBags)} bags failed ({e!r}), '
+                                    'trying them again')
+                    pendingBags = {}
+                    firstNew = None
+            tracer.log(f'run budget used up, stopped watching after {self.batches} batches')
+        except KeyboardInterrupt:
+            tracer.log(f'stopped watching after {self.batches} batches')
+        finally:
+            self.waker.close()
+
+
+# takes in a dictionary of bag -> size in bytes and a shard count and returns a list
+# with the bags of every shard. bags are handed out biggest first, each to the shard
+# with the fewest bytes so far (ties going to the lowest shard, bags of the same size
+# going in path order), so every shard gets about the same number of bytes to read and
+# every node working out the shards from the same listing gets the same answer
+def shard_bags(bagSizes, shardCount):
+    shards = [[] for _ in range(shardCount)]
+    shardBytes = [0] * shardCount
+    for bagFile in sorted(bagSizes, key=lambda b: (-bagSizes[b], b)):
+        lightest = min(range(shardCount), key=lambda i: (shardBytes[i], i))
+        shards[lightest].append(bagFile)
+        shardBytes[lightest] += bagSizes[bagFile]
+    return [sorted(shard) for shard in shards]
+
+# takes in a shard string such as '2/8' and returns (2, 8), shards counting from 1
+def parse_shard(shardString):
+    try:
+        index, count = (int(part) for part in str(shardString).split('/'))
+    except ValueError:
+        raise ValueError(f'{shardString} is not a shard, i.e. 2/8')
+    if count < 1 or not 1 <= index <= count:
+        raise ValueError(f'{shardString} is not a shard, shards go from 1/N to N/N')
+    return index, count
+
+
+# A PartialResults object is what one shard of a sharded scan found: for every namespace
+# the (topic, type) pairs, their md5sums and the bags they were seen in, along with the
+# dive, cruise and year of every bag. it is written to a self-describing .json file
+# (which vehicle, which shard of how many, how it was discovered) so shards can run on
+# different machines and their files be merged anywhere later
+
+# takes in a vehicle name and a dictionary with what the shard was run with
+# ('shard', 'shards', 'mode', 'dataDir', 'seed', 'bags', 'bytes')
+
+# field 'catalogs' is a dictionary where every key is a namespace and every value is a TopicCatalog
+# field 'locations' is a dictionary where every key is a bag and every value is its (dive, cruise, year)
+
+class PartialResults():
+    FORMAT = 'bagstructdefs-partial'
+    VERSION = 1
+
+    def __init__(self, vehicleName, info):
+        self.name = vehicleName
+        self.info = dict(info)
+        self.catalogs = {}
+        self.locations = {}
+
+    # takes in a namespace, the TopicCatalog found for it and a function which takes in
+    # a bag and returns its (dive, cruise, year), and adds them
+    def add(self, namespace, catalog, locateBag):
+        merged = self.catalogs.setdefault(namespace, TopicCatalog())
+        merged.update(catalog)
+        for topic, type in catalog.get_pairs():
+            for bag in catalog.get_bags(topic, type):
+                if bag not in self.locations:
+                    self.locations[bag] = tuple(locateBag(bag))
+
+    # takes in a bag and returns its (dive, cruise, year), for TopicStore.upsert
+    def locate_bag(self, bagFile):
+        return self.locations.get(bagFile, (os.path.dirname(bagFile), None, None))
+
+    # takes in a path and writes the partial results to it, via a temp file so
+    # a shard which gets killed never leaves a half written file behind
+    def write(self, partialPath):
+        namespaces = {}
+        for namespace, catalog in self.catalogs.items():
+            namespaces[namespace] = [{'topic': topic, 'type': type, 'md5sum': catalog.get_md5sum(topic, type),
+                                      'bags': sorted(catalog.get_bags(topic, type))}
+                                     for topic, type in catalog.get_pairs()]
+        content = {'format': self.FORMAT, 'version': self.VERSION, 'vehicle': self.name, **self.info,
+                   'namespaces': namespaces,
+                   'locations': {bag: list(location) for bag, location in sorted(self.locations.items())}}
+        partialDir = os.path.dirname(partialPath)
+        if partialDir:
+            os.makedirs(partialDir, exist_ok=True)
+        with atomic_write(partialPath) as file:
+            json.dump(content, file, indent=1)
+
+    # takes in a path to a partial results file and returns the PartialResults in it,
+    # raises ValueError if it isn't one
+    @classmethod
+    def load(cls, partialPath):
+        with open(partialPath, 'r') as file:
+            content = json.load(file)
+        if content.get('format') != cls.FORMAT or content.get('version') != cls.VERSION:
+            raise ValueError(f'{partialPath} is not a version {cls.VERSION} partial results file')
+        info = {k: v for k, v in content.items() if k not in ('format', 'version', 'vehicle', 'namespaces', 'locations')}
+        partial = cls(content['vehicle'], info)
+        for namespace, rows in content['namespaces'].items():
+            catalog = partial.catalogs.setdefault(namespace, TopicCatalog())
+            for row in rows:
+                catalog.add(row['topic'], row['type'], md5sum=row.get('md5sum'))
+                for bag in row['bags']:
+                    catalog.add(row['topic'], row['type'], bag)
+        partial.locations = {bag: tuple(location) for bag, location in content['locations'].items()}
+        return partial
+
+    # takes in another PartialResults and adds what it found to this one
+    def update(self, other):
+        for namespace, catalog in other.catalogs.items():
+            self.catalogs.setdefault(namespace, TopicCatalog()).update(catalog)
+        self.locations.update(other.locations)
+
+    # returns the default path of the partial results of shard 'index' of 'count' for a
+    # vehicle, which lives in dsros_python/vehiclename/partials next to the .csv master lists
+    @staticmethod
+    def default_path(vehicleName, index, count):
+        return os.path.join('dsros_python', vehicleName, 'partials', f'shard-{index}-of-{count}.json')
+
+
+# takes in a vehicle name, the directory with its data, the mode, the RunConfig, the
+# shard to scan (counting from 1) and how many shards there are, and the path to write
+# the partial results to. every bag of every dive is listed (in cumulative mode of every
+# cruise, not a sample of them) and split into shards by size, and this shard's bags are
+# all scanned (no sampling, a sharded scan is meant to cover the whole archive). every
+# shard has to be run with the same --datadir and --mode to discover the same dives.
+# writes no defs and doesn't touch the catalog, that's left to merge
+def run_shard(vehicleName, dataDir, mode, config, shardIndex, shardCount, partialPath):
+    data = RosbagDiveData(vehicleName, dataDir, mode, config.seed, everyCruise=True)
+    defs = BagStructDefs(vehicleName, dataDir, data, config)
+    namespaces = [k for k in defs.get_yaml() if k != 'globals']
+    listing = BagListing(namespaces)
+    bagNamespaces = {}
+    for diveDir in data.get_dives():
+        for namespace, bagfiles in listing.list_dir(diveDir).items():
+            for bagfile in bagfiles:
+                bagNamespaces[os.path.join(diveDir, bagfile)] = namespace
+    listing.report()
+    shards = shard_bags({bagFile: listing.get_size(bagFile) for bagFile in bagNamespaces}, shardCount)
+    shardBags = shards[shardIndex - 1]
+    shardBytes = sum(listing.get_size(bagFile) for bagFile in shardBags)
+    tracer.log(f'shard {shardIndex}/{shardCount}: {len(shardBags)} of {len(bagNamespaces)} bags, '
+               f'{shardBytes / 1e6:.1f} MB')
+
+    partial = PartialResults(vehicleName, {'shard': shardIndex, 'shards': shardCount, 'mode': mode,
+                                           'dataDir': os.path.abspath(dataDir), 'seed': config.seed,
+                                           'bags': len(shardBags), 'bytes': shardBytes})
+    byNamespace = {}
+    for bagFile in shardBags:
+        byNamespace.setdefault(bagNamespaces[bagFile], []).append(bagFile)
+    cache = BagScanCache(defs.get_scanCachePath(), listing)
+    pool = BagScanPool(config.jobs, cache, listing, config.budget)
+    stager = BagStager(config.stageDir, config.stageBudget, listing=listing, budget=config.budget)
+    try:
+        for namespace in namespaces:
+            if namespace in byNamespace:
+                catalog = NamespaceTopics(vehicleName, byNamespace[namespace], pool, stager).get_catalog()
+                partial.add(namespace, catalog, data.locate_bag)
+    finally:
+        pool.shutdown()
+        cache.save()
+    pool.report()
+    stager.report()
+    partial.write(partialPath)
+    tracer.log(f'wrote {partialPath}')
+
+# takes in the paths to partial results files, the RunConfig and the stages asked for,
+# and merges the partial results into the topic catalog and writes the defs for
+# everything they found, once. returns the BagStructDefs the defs were written from
+def merge_partials(partialPaths, config, stages):
+    partials = [PartialResults.load(path) for path in partialPaths]
+    vehicles = {partial.name for partial in partials}
+    if len(vehicles) != 1:
+        raise SystemExit(f"partial results are from more than one vehicle: {', '.join(sorted(vehicles))}")
+    vehicleName = vehicles.pop()
+    shardCounts = {partial.info.get('shards') for partial in partials}
+    shardsFound = sorted(partial.info.get('shard') for partial in partials)
+    if len(shardCounts) == 1:
+        shardCount = shardCounts.pop()
+        missing = sorted(set(range(1, shardCount + 1)) - set(shardsFound))
+        if missing:
+            tracer.warn(f"Warning: merging without shards {', '.join(map(str, missing))} of {shardCount}")
+    else:
+        tracer.warn('Warning: merging partial results from scans with different numbers of shards')
+    if len(set(shardsFound)) != len(shardsFound):
+        tracer.warn('Warning: some shards are being merged more than once')
+    # shards only split the same bags between them if they discovered the same dives
+    for key in ('mode', 'dataDir'):
+        if len({str(partial.info.get(key)) for partial in partials}) > 1:
+            tracer.warn(f'Warning: partial results were scanned with different {key} values, shards may overlap or miss bags')
+
+    merged = PartialResults(vehicleName, {})
+    for partial in partials:
+        merged.update(partial)
+    tracer.log(f"merged {len(partials)} partial results for {vehicleName}: "
+               f"{sum(partial.info.get('bags', 0) for partial in partials)} bags, "
+               f"{sum(len(catalog) for catalog in merged.catalogs.values())} topics")
+
+    dataDir = partials[0].info.get('dataDir', '.')
+    defs = BagStructDefs(vehicleName, dataDir, None, config)
+    store = TopicStore(defs.get_catalogPath())
+    try:
+        for namespace, catalog in merged.catalogs.items():
+            if len(catalog):
+                store.upsert(vehicleName, namespace, catalog, merged.locate_bag)
+    finally:
+        store.close()
+    defs.use_bags({namespace: catalog.to_df() for namespace, catalog in merged.catalogs.items()}, merged.catalogs)
+    if 'bags' in stages:
+        populate_Bags(defs)
+    if 'structs' in stages:
+        populate_structs(defs)
+    return defs
+
+
+# defs which main() can be asked to generate via --stages
+STAGES = ('bags', 'structs')
+
+# vehicles main() can generate defs for, --vehicle all means every one of them
+VEHICLES = ('jason', 'sentry', 'alvin')
+
+# what main() can be asked to do: generate defs (the default), write the .csv
+# master lists from the topic catalog, look up where a topic was seen, or merge
+# the partial results of a sharded scan and generate defs from them
+COMMANDS = ('generate', 'export-csv', 'query', 'merge')
+
+# takes in a vehicle name and writes a .csv master list for every namespace
+# in its topic catalog, in dsros_python/vehiclename/csv
+def export_csv(vehicleName):
+    catalogPath = TopicStore.default_path(vehicleName)
+    if not os.path.exists(catalogPath):
+        raise SystemExit(f'No topic catalog at {catalogPath}, run generate first')
+    store = TopicStore(catalogPath)
+    try:
+        for namespace in store.get_namespaces(vehicleName):
+            csvPath = os.path.join('dsros_python', vehicleName, 'csv', f'{namespace}_topics_types.csv')
+            numRows = store.export_csv(vehicleName, namespace, csvPath)
+            tracer.log(f'{csvPath}: {numRows} topics')
+    finally:
+        store.close()
+
+# takes in the vehicles asked for and the parsed arguments and prints the bags, dives
+# or cruises the topic catalog has seen args.topic in. with no vehicles asked for,
+# every vehicle which has a catalog is searched
+def query_catalog(vehicles, args):
+    for vehicleName in vehicles or VEHICLES:
+        catalogPath = TopicStore.default_path(vehicleName)
+        if not os.path.exists(catalogPath):
+            if vehicles:
+                raise SystemExit(f'No topic catalog at {catalogPath}, run generate first')
+            continue
+        store = TopicStore(catalogPath)
+        try:
+            start = time.perf_counter()
+            found = store.find(args.topic, args.type, vehicleName, args.year, args.cruise, args.by)
+            elapsed = time.perf_counter() - start
+        finally:
+            store.close()
+        for value in found:
+            print(value)
+        tracer.log(f'{vehicleName}: {len(found)} {args.by} with {args.topic} ({elapsed * 1000:.1f} ms)')
+
+# takes in a vehicle name, the directory with its data, the mode, the RunConfig, the
+# SharedWork of the run and the stages asked for, and computes everything the stages
+# need short of writing defs (the bag scan and the struct unwrap). returns the
+# BagStructDefs to populate from and the summary lines logged along the way
+def prepare_vehicle(vehicleName, dataDir, mode, config, shared, stages):
+    with tracer.buffered() as lines:
+        # with a budget, cruises and dives earlier runs scanned least get picked first
+        history = BagScanCache(BagScanCache.default_path(vehicleName)) if config.budget.is_limited() else None
+        data = RosbagDiveData(vehicleName, dataDir, mode, config.seed, history, config.everyCruise)
+        defs = BagStructDefs(vehicleName, dataDir, data, config, shared)
+        # defs only compute what the chosen stages ask for, i.e. bags alone never parses .msg files
+        if 'bags' in stages:
+            defs.get_bags()
+        if 'structs' in stages:
+            defs.get_structFieldsUnwrapped()
+    return defs, lines
+
 # the main event if you will 
 def main():
     parser = argparse.ArgumentParser(description='Create bag_defs and struct_defs based on _extract.yaml')
+    parser.add_argument('command', nargs='?', default='generate', choices=COMMANDS,
+                        help='generate defs (default), export-csv to write the .csv master lists from the topic catalog, '
+                             'query to list where --topic was seen, or merge to combine the partial results of '
+                             '--shard runs and generate defs from them')
+    parser.add_argument('partials', nargs='*', help='merge: partial results files written by --shard runs')
     parser.add_argument('--datadir', default='.', help='Directory which stores all data')
-    parser.add_argument('--vehicle', choices=['jason', 'sentry', 'alvin'], help='Vehicle you wish to create defs for')
+    parser.add_argument('--vehicle', default=None,
+                        help='Vehicle you wish to create defs for: ' + ', '.join(VEHICLES) +
+                             ', a comma separated list of them, or all. with more than one vehicle, '
+                             '--datadir holds a directory per vehicle')
     parser.add_argument('--mode', default='cumulative', choices=['cumulative', 'cruise', 'dive'], help='Data you wish to create defs for')
-    args = parser.parse_args()
-    dataDir = args.datadir
-    vehicleName= args.vehicle
+    parser.add_argument('--jobs', type=int, default=1, help='Number of bags to inspect in parallel')
+    parser.add_argument('--stage-dir', default='/tmp', help='Directory to copy bags into when they need to be local')
+    parser.add_argument('--stage-budget', default=None, help='Most bytes to stage at once, i.e. 20G (default: no limit)')
+    parser.add_argument('--msg-root', action='append', default=None,
+                        help='ROS share style directory to search for .msg definitions, can be given more than once (default: /opt/ros/noetic/share)')
+    parser.add_argument('--custom-msg-root', action='append', default=None,
+                        help='Vehicle workspace to search for .msg definitions, can be given more than once (default: ~/ros/<vehicle>_ws/src/ds_msgs)')
+    parser.add_argument('--sample-arrays', action='store_true',
+                        help='Read a few messages per topic from the bags to size unsized array fields')
+    parser.add_argument('--sample-messages', type=int, default=50, help='Most messages to sample per topic')
+    parser.add_argument('--sample-bytes', default='16M', help='Most chunk bytes to read per topic when sampling, i.e. 64M')
+    parser.add_argument('--sample-max-length', type=int, default=64,
+                        help='Longest unsized array to expand, longer ones stay unsized')
+    parser.add_argument('--seed', type=int, default=0,
+                        help='Seed for picking cruises, dives and bags, the same seed picks the same data (default: 0)')
+    parser.add_argument('--every-cruise', action='store_true',
+                        help='cumulative: look at every cruise instead of a sample of them (always on for --shard and --watch)')
+    parser.add_argument('--converge-k', type=int, default=3,
+                        help='Stop sampling a namespace after this many bags in a row add no new topics')
+    parser.add_argument('--time-budget', default=None,
+                        help='Stop scanning once the run has taken this long, i.e. 30m or 2h (default: no limit)')
+    parser.add_argument('--byte-budget', default=None,
+                        help='Stop scanning once this much has been read from the data server, i.e. 50G (default: no limit)')
+    parser.add_argument('--non-interactive', action='store_true',
+                        help='Never prompt: special types come from the rules file only and unresolved fields are reported')
+    parser.add_argument('--special-types', default=None,
+                        help='Special type rules file (default: dsros_python/<vehicle>/special_types.yaml)')
+    parser.add_argument('--trace', default=None, metavar='OUT.json',
+                        help='Write a Chrome trace of where the run spent its time to this file')
+    parser.add_argument('-v', '--verbose', action='count', default=0, help='Print more, give twice for debug output')
+    parser.add_argument('-q', '--quiet', action='store_true', help='Only print warnings and prompts')
+    parser.add_argument('--shard', default=None, metavar='I/N',
+                        help='Scan every bag of shard I of N (bags split evenly by size) and write partial results '
+                             'for merge instead of defs')
+    parser.add_argument('--partial-out', default=None,
+                        help='shard: where to write the partial results '
+                             '(default: dsros_python/<vehicle>/partials/shard-I-of-N.json)')
+    parser.add_argument('--watch', action='store_true',
+                        help='Keep running, scanning bags as they are closed and writing the defs of new topics '
+                             '(implies --non-interactive, watches every cruise in cumulative mode, stop with ctrl-c '
+                             'or a run budget)')
+    parser.add_argument('--poll-interval', default='30s', help='watch: how often to look for new bags (default: 30s)')
+    parser.add_argument('--debounce', default='10s',
+                        help='watch: handle new bags once none have turned up for this long (default: 10s)')
+    parser.add_argument('--batch-window', default='2m',
+                        help='watch: handle new bags at most this long after the first of them (default: 2m)')
+    parser.add_argument('--topic', default=None, help='query: topic to look up, * and ? wildcards allowed')
+    parser.add_argument('--type', default=None, help='query: only sightings of the topic with this type')
+    parser.add_argument('--year', type=int, default=None, help='query: only sightings from this year')
+    parser.add_argument('--cruise', default=None, help='query: only sightings from cruises whose path contains this')
+    parser.add_argument('--by', default='dives', choices=['bags', 'dives', 'cruises'],
+                        help='query: list the bags, dives or cruises the topic was seen in (default: dives)')
+    parser.add_argument('--stages', default='bags,structs',
+                        help='Comma separated defs to generate, any of: ' + ','.join(STAGES) + ' (default: bags,structs)')
+    # options can come before, between or after the command and its files
+    args = parser.parse_intermixed_args()
+    stages = [stage.strip() for stage in args.stages.split(',') if stage.strip()]
+    unknownStages = [stage for stage in stages if stage not in STAGES]
+    if unknownStages or not stages:
+        parser.error(f"--stages must be a comma separated list of: {', '.join(STAGES)}")
+    vehicles = []
+    if args.vehicle == 'all':
+        vehicles = list(VEHICLES)
+    elif args.vehicle:
+        vehicles = [vehicle.strip() for vehicle in args.vehicle.split(',') if vehicle.strip()]
+        if any(vehicle not in VEHICLES for vehicle in vehicles) or len(set(vehicles)) != len(vehicles):
+            parser.error(f"--vehicle must be all or a comma separated list of: {', '.join(VEHICLES)}")
     mode = args.mode
-    data = RosbagDiveData(vehicleName, dataDir, mode)
-    defs = BagStructDefs(vehicleName, dataDir, data)
-
-  
-    populate_Bags(defs)
-    populate_structs(defs)
+    tracer.verbosity = 0 if args.quiet else 1 + args.verbose
+    if args.command == 'query':
+        if args.topic is None:
+            parser.error('query needs --topic')
+        query_catalog(vehicles, args)
+        return
+    if args.command == 'merge':
+        if not args.partials:
+            parser.error('merge needs partial results files')
+        config = RunConfig.from_args(args)
+        try:
+            merge_partials(args.partials, config, stages)
+        finally:
+            if args.trace:
+                tracer.write(args.trace)
+            tracer.report()
+        return
+    if args.partials:
+        parser.error('partial results files are only taken by merge')
+    if not vehicles:
+        parser.error(f'{args.command} needs --vehicle')
+    if args.command == 'export-csv':
+        for vehicleName in vehicles:
+            export_csv(vehicleName)
+        return
+    if len(vehicles) > 1 and mode != 'cumulative':
+        parser.error('more than one vehicle can only be run in cumulative mode')
+    if args.shard:
+        try:
+            shardIndex, shardCount = parse_shard(args.shard)
+        except ValueError as e:
+            parser.error(str(e))
+        if len(vehicles) > 1 or args.watch:
+            parser.error('--shard works on one vehicle at a time and not with --watch')
+        config = RunConfig.from_args(args)
+        partialPath = args.partial_out or PartialResults.default_path(vehicles[0], shardIndex, shardCount)
+        try:
+            run_shard(vehicles[0], args.datadir, mode, config, shardIndex, shardCount, partialPath)
+        finally:
+            if args.trace:
+                tracer.write(args.trace)
+            tracer.report()
+        return
+    if args.watch:
+        if len(vehicles) > 1:
+            parser.error('--watch works on one vehicle at a time')
+        # nobody is around to answer prompts while watching
+        args.non_interactive = True
+        config = RunConfig.from_args(args)
+        watcher = DiveWatcher(vehicles[0], args.datadir, mode, config, parse_duration(args.poll_interval),
+                              parse_duration(args.debounce), parse_duration(args.batch_window))
+        try:
+            watcher.run()
+        finally:
+            if args.trace:
+                tracer.write(args.trace)
+            tracer.report()
+        return
+    dataDirs = {vehicles[0]: args.datadir}
+    if len(vehicles) > 1:
+        dataDirs = {vehicleName: os.path.join(args.datadir, vehicleName) for vehicleName in vehicles}
+    config = RunConfig.from_args(args)
+    shared = SharedWork(config.jobs)
+    try:
+        # the bag scans and struct unwraps of all vehicles run at once, sharing the bag
+        # inspection workers and .msg files. prompts can't be told apart between
+        # vehicles, so an interactive run prepares one vehicle at a time
+        prepared = {}
+        if len(vehicles) > 1 and not config.interactive:
+            with concurrent.futures.ThreadPoolExecutor(max_workers=len(vehicles),
+                                                       thread_name_prefix='vehicle') as executor:
+                futures = {vehicleName: executor.submit(prepare_vehicle, vehicleName, dataDirs[vehicleName],
+                                                        mode, config, shared, stages)
+                           for vehicleName in vehicles}
+                prepared = {vehicleName: future.result() for vehicleName, future in futures.items()}
+        else:
+            for vehicleName in vehicles:
+                prepared[vehicleName] = prepare_vehicle(vehicleName, dataDirs[vehicleName], mode, config,
+                                                        shared, stages)
+
+        # defs get written one vehicle at a time, each after its own summary
+        for vehicleName in vehicles:
+            defs, lines = prepared[vehicleName]
+            if len(vehicles) > 1:
+                tracer.log(f'\n==== {vehicleName} ====')
+            for line in lines:
+                print(line)
+            if 'bags' in stages:
+                populate_Bags(defs)
+            if 'structs' in stages:
+                populate_structs(defs)
+    finally:
+        shared.shutdown()
+        # written even if the run failed, that's when it's most useful
+        if args.trace:
+            tracer.write(args.trace)
+        tracer.report()
 
 if __name__ == '__main__':
     main()